@@ -2,27 +2,68 @@ from __future__ import annotations
 
 import asyncio
 import logging
+import os
+import random
 import time
-from datetime import datetime, timedelta
+from datetime import datetime, timezone
 from urllib.parse import parse_qs
 
 from aiogram import Bot, Dispatcher
+from aiogram.exceptions import TelegramConflictError
 from aiogram.types import Update
 from fastapi import FastAPI, Request, Response, Header
 
 from bot import dao
 from bot.config import load_config
-from bot.db import get_db, init_db, ensure_default_settings
+from bot.db import (
+    DEFERRED_VERSION,
+    checkpoint_wal,
+    close_pool,
+    deferred_version,
+    epoch_backfill_done,
+    ensure_default_settings,
+    get_db,
+    init_db,
+    run_deferred_migrations,
+)
 from bot.handlers import routers
 from bot.runtime import runtime
 from bot.services.proxy_provider import MockProxyProvider, CommandProxyProvider, DantedPamProxyProvider
 from bot.services.billing import run_billing_once
-from bot.services.mtproto import sync_mtproto_secrets, reenable_proxies_for_user, maybe_restart_mtproxy_service
-from bot.ui import send_bg_to_user
+from bot.services.mtproto import (
+    apply_requested_mtproxy_restart,
+    maybe_restart_mtproxy_service,
+    reenable_proxies_for_user,
+    sync_mtproto_secrets,
+)
+from bot.services.flood_control import reload_policy
+from bot.services.ledger import verify_ledger
+from bot.services.retention import run_retention
+from bot.services.backup import backup_database, backup_dir, last_backup_ts
+from bot.services.update_decoder import peek_update
+from bot.session import PreparedMarkupSession
+from bot.services.scheduler import FREEKASSA_POLL, SUPPORT_SLA, scheduler
+from bot.services.leader import refresh_leadership, release_leadership, renew_interval_sec
+from bot.ui import get_bot_info, load_bg_file_id, send_bg_to_user
 from bot.services.settings import get_int_setting
 from bot.keyboards import main_menu_inline_kb
 from bot.services.freekassa import verify_notification, get_order_status
-from fastapi.responses import PlainTextResponse
+from bot.services.db_profiler import db_profiler
+from bot.services.loop_monitor import loop_monitor
+from bot.services.metrics import (
+    DB_WAL_BYTES,
+    LOOP_SECONDS,
+    MTPROXY_RESTARTS,
+    POLLED_UPDATES,
+    STARTUP_STEP_SECONDS,
+    WAL_CHECKPOINTS,
+    WEBHOOK_SECONDS,
+    UpdateScope,
+    current_scope,
+    render_latest,
+)
+from bot.middlewares import FloodControlMiddleware, HandlerLabelMiddleware, TelegramApiMetricsMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 
 config = load_config()
 logger = logging.getLogger(__name__)
@@ -51,14 +92,23 @@ else:
         default_port=config.proxy_default_port,
     )
 
-bot = Bot(token=config.bot_token)
+bot = Bot(token=config.bot_token, session=PreparedMarkupSession())
+bot.session.middleware(TelegramApiMetricsMiddleware())
 
 # Dispatcher
 
 dp = Dispatcher()
+dp.message.outer_middleware(FloodControlMiddleware())
+dp.callback_query.outer_middleware(FloodControlMiddleware())
 for router in routers:
+    router.message.middleware(HandlerLabelMiddleware())
+    router.callback_query.middleware(HandlerLabelMiddleware())
+    router.pre_checkout_query.middleware(HandlerLabelMiddleware())
     dp.include_router(router)
 
+# Both setWebhook and getUpdates ask Telegram only for update types some handler consumes.
+ALLOWED_UPDATES = dp.resolve_used_update_types()
+
 def _normalize_prefix(prefix: str) -> str:
     prefix = prefix.strip()
     if not prefix:
@@ -74,7 +124,11 @@ APP_PREFIX = _normalize_prefix(config.app_prefix)
 WEBHOOK_PATH = f"{APP_PREFIX}/webhook" if APP_PREFIX else "/webhook"
 WEBHOOK_ROOT = APP_PREFIX if APP_PREFIX else None
 HEALTH_PATH = f"{APP_PREFIX}/health" if APP_PREFIX else "/health"
+READY_PATH = f"{APP_PREFIX}/ready" if APP_PREFIX else "/ready"
 FREEKASSA_PATH = f"{APP_PREFIX}/freekassa" if APP_PREFIX else "/freekassa"
+METRICS_PATH = f"{APP_PREFIX}/metrics" if APP_PREFIX else "/metrics"
+FREEKASSA_POLL_MAX_AGE_SEC = 48 * 3600
+POLLING_OFFSET_SETTING = "polling_offset"
 
 app = FastAPI()
 
@@ -166,7 +220,14 @@ async def _credit_payment_and_notify(
         "paid",
         provider_payment_id=provider_payment_id,
     )
-    await dao.add_user_balance(db, payment["user_id"], payment["amount"])
+    await dao.add_user_balance(
+        db,
+        payment["user_id"],
+        payment["amount"],
+        kind="payment",
+        idempotency_key=f"payment:{payment['id']}",
+        ref=provider_payment_id,
+    )
     reenabled = await reenable_proxies_for_user(db, payment["user_id"])
     if reenabled:
         await sync_mtproto_secrets(db)
@@ -203,59 +264,274 @@ async def _set_payment_status_and_notify(
     await _send_payment_status_message(db, payment, status_text.format(id=payment["id"]))
 
 
+_ready_event = asyncio.Event()
+_polling_task: asyncio.Task | None = None
+_polling_inflight: set[asyncio.Task] = set()
+_write_behind_task: asyncio.Task | None = None
+_write_behind_stop = asyncio.Event()
+
+
 @app.on_event("startup")
 async def on_startup() -> None:
+    # Only what every request depends on runs before uvicorn starts serving: the schema and leadership.
+    # Cache warm-up, the webhook and the background loops follow in _warm_up; /ready reports when it is done.
+    started = time.perf_counter()
+    if config.loop_lag_threshold_ms > 0:
+        loop_monitor.configure(
+            config.loop_lag_interval_ms / 1000,
+            config.loop_lag_threshold_ms / 1000,
+        )
+        loop_monitor.start()
+
     db = await get_db(config.db_path)
     try:
-        await init_db(db)
+        applied = await init_db(db)
+        if applied:
+            logger.info("Schema migrations applied: %s", ", ".join(applied))
         await ensure_default_settings(db)
-        await sync_mtproto_secrets(db)
-        bg_enabled = await dao.get_setting(db, "bg_enabled", "1")
-        runtime.bg_enabled = str(bg_enabled) == "1"
+        await refresh_leadership(db)
+        runtime.epoch_ts_ready = await epoch_backfill_done(db)
+        deferred_pending = await deferred_version(db) < DEFERRED_VERSION
     finally:
         await db.close()
+    STARTUP_STEP_SECONDS.set("schema", value=time.perf_counter() - started)
 
-    await bot.set_webhook(
-        url=config.webhook_url,
-        secret_token=config.webhook_secret,
-        drop_pending_updates=True,
-    )
+    asyncio.create_task(leader_loop())
+    asyncio.create_task(_warm_up(started, deferred_pending))
+
+
+async def _startup_step(name: str, step) -> None:
+    started = time.perf_counter()
+    try:
+        db = await get_db(config.db_path)
+        try:
+            await step(db)
+        finally:
+            await db.close()
+    except Exception:
+        # A cold cache is slower, not broken: the value is loaded on first use instead.
+        logger.exception("Startup step %s failed", name)
+    finally:
+        STARTUP_STEP_SECONDS.set(name, value=time.perf_counter() - started)
 
-    asyncio.create_task(billing_loop())
-    asyncio.create_task(freekassa_reconcile_loop())
-    asyncio.create_task(mtproxy_watchdog_loop())
-    asyncio.create_task(support_sla_loop())
+
+async def _warm_settings(db) -> None:
+    settings = await dao.get_settings_map(db)
+    runtime.bg_enabled = settings.get("bg_enabled", "1") == "1"
+    await reload_policy(db)
+    await load_bg_file_id(db)
+
+
+def _start_loop(loop, jitter: float) -> None:
+    # Spread the first iterations so a restart does not hit the DB with every loop at once.
+    async def runner() -> None:
+        if jitter > 0:
+            await asyncio.sleep(random.uniform(0, jitter))
+        await loop()
+
+    asyncio.create_task(runner())
+
+
+async def _warm_up(started: float, deferred_pending: bool) -> None:
+    await asyncio.gather(
+        _startup_step("settings", _warm_settings),
+        _startup_step("scheduled_tasks", lambda db: dao.backfill_scheduled_tasks(db, time.time())),
+        _startup_step("mtproto_secrets", sync_mtproto_secrets),
+        _startup_step("bot_info", lambda db: get_bot_info(bot)),
+    )
+    # With several uvicorn workers only the lease holder touches the webhook and runs singleton jobs.
+    if runtime.is_leader and config.update_mode == "webhook":
+        await _startup_step("webhook", lambda db: _set_webhook(drop_pending_updates=True))
+    elif runtime.is_leader:
+        # getUpdates is refused while a webhook is set; keep what Telegram queued for the poller.
+        await _startup_step("webhook", lambda db: bot.delete_webhook(drop_pending_updates=False))
+    runtime.ready = True
+    _ready_event.set()
+    STARTUP_STEP_SECONDS.set("total", value=time.perf_counter() - started)
+    logger.info("Ready in %.2fs", time.perf_counter() - started)
+
+    global _polling_task
+    start_write_behind()
+    if config.update_mode == "polling":
+        _polling_task = asyncio.create_task(polling_loop())
+
+    jitter = max(0.0, config.loop_start_jitter_sec)
+    _start_loop(billing_loop, jitter)
+    _start_loop(lambda: scheduler.run(config.db_path), jitter)
+    _start_loop(mtproxy_watchdog_loop, jitter)
+    _start_loop(ledger_verify_loop, jitter)
+    _start_loop(payments_maintenance_loop, jitter)
+    _start_loop(retention_loop, jitter)
+    _start_loop(backup_loop, jitter)
+    _start_loop(wal_checkpoint_loop, jitter)
+    _start_loop(flood_policy_loop, jitter)
+    if deferred_pending:
+        _start_loop(deferred_migrations_loop, jitter)
 
 
 @app.on_event("shutdown")
 async def on_shutdown() -> None:
-    await bot.delete_webhook(drop_pending_updates=True)
+    loop_monitor.stop()
+    if _polling_task is not None:
+        _polling_task.cancel()
+        if _polling_inflight:
+            # Let updates already taken from Telegram finish rather than cutting handlers off.
+            await asyncio.wait(list(_polling_inflight), timeout=10)
+    await stop_write_behind()
+    if runtime.is_leader:
+        if config.update_mode == "webhook":
+            await bot.delete_webhook(drop_pending_updates=True)
+        db = await get_db(config.db_path)
+        try:
+            await release_leadership(db)
+        finally:
+            await db.close()
+    await close_pool()
     await bot.session.close()
 
 
+async def _set_webhook(drop_pending_updates: bool) -> None:
+    await bot.set_webhook(
+        url=config.webhook_url,
+        secret_token=config.webhook_secret,
+        drop_pending_updates=drop_pending_updates,
+        allowed_updates=ALLOWED_UPDATES,
+    )
+
+
 async def _handle_webhook(
     request: Request,
     x_telegram_bot_api_secret_token: str | None = Header(None),
 ) -> Response:
     if config.webhook_secret and x_telegram_bot_api_secret_token != config.webhook_secret:
         return Response(status_code=401)
-
-    data = await request.json()
-    update = Update.model_validate(data)
-
-    if update.update_id is not None:
-        db = await get_db(config.db_path)
+    if not runtime.ready:
+        # Updates that arrive during warm-up (the webhook of the previous run is still set) wait for it briefly.
         try:
-            inserted = await dao.insert_processed_update(db, update.update_id)
-            if not inserted:
-                return Response(status_code=200)
-        finally:
-            await db.close()
+            await asyncio.wait_for(_ready_event.wait(), timeout=max(0.0, config.ready_wait_sec))
+        except asyncio.TimeoutError:
+            pass
 
-    await dp.feed_update(bot, update)
+    started = time.perf_counter()
+    body = await request.body()
+    update_id, update_type = peek_update(body)
+    if update_type is not None and update_type not in ALLOWED_UPDATES:
+        # No handler consumes it (allowed_updates from an older deploy, a webhook set by hand): skip validation.
+        logger.debug("Dropping unsupported update %s (%s)", update_id, update_type)
+        WEBHOOK_SECONDS.observe(time.perf_counter() - started, update_type, "unsupported")
+        return Response(status_code=200)
+    # Validated straight from the bytes, without an intermediate dict.
+    await process_update(Update.model_validate_json(body))
     return Response(status_code=200)
 
 
+async def process_update(update: Update) -> None:
+    # Shared by the webhook and getUpdates: dedup, dispatch and per-update metrics.
+    started = time.perf_counter()
+    scope = UpdateScope(update_id=update.update_id)
+    token = current_scope.set(scope)
+    try:
+        scope.update_type = update.event_type
+    except Exception:
+        pass
+    try:
+        if update.update_id is not None:
+            db = await get_db(config.db_path)
+            try:
+                inserted = await dao.insert_processed_update(db, update.update_id)
+                if not inserted:
+                    scope.handler = "duplicate"
+                    return
+            finally:
+                await db.close()
+
+        await dp.feed_update(bot, update)
+    finally:
+        current_scope.reset(token)
+        WEBHOOK_SECONDS.observe(time.perf_counter() - started, scope.update_type, scope.handler)
+        db_profiler.finish_update(scope)
+
+
+async def _load_polling_offset() -> int | None:
+    db = await get_db(config.db_path)
+    try:
+        value = await dao.get_setting(db, POLLING_OFFSET_SETTING, cached=False)
+    finally:
+        await db.close()
+    return int(value) if value else None
+
+
+async def _store_polling_offset(offset: int) -> None:
+    db = await get_db(config.db_path)
+    try:
+        await dao.set_setting(db, POLLING_OFFSET_SETTING, str(offset))
+    finally:
+        await db.close()
+
+
+async def _run_polled_update(update: Update, slots: asyncio.Semaphore) -> None:
+    try:
+        await process_update(update)
+    except Exception:
+        logger.exception("Update %s failed", update.update_id)
+    finally:
+        slots.release()
+
+
+async def polling_loop() -> None:
+    # UPDATE_MODE=polling: the lease holder long-polls getUpdates; other workers stay idle until they get the lease.
+    # Updates are dispatched as soon as they arrive, like parallel webhook deliveries, and the next getUpdates
+    # goes out without waiting for them. POLLING_MAX_INFLIGHT bounds the backlog: when it is full the poller
+    # stops fetching, and Telegram keeps the rest queued.
+    offset: int | None = None
+    backoff = 1.0
+    slots = asyncio.Semaphore(max(1, config.polling_max_inflight))
+    while True:
+        if not runtime.is_leader:
+            offset = None
+            await asyncio.sleep(renew_interval_sec())
+            continue
+        if offset is None:
+            offset = await _load_polling_offset()
+        try:
+            updates = await bot.get_updates(
+                offset=offset,
+                limit=config.polling_limit,
+                timeout=config.polling_timeout_sec,
+                allowed_updates=ALLOWED_UPDATES,
+                request_timeout=config.polling_timeout_sec + 10,
+            )
+        except TelegramConflictError:
+            # A webhook is set again or a previous leader is still polling.
+            logger.warning("getUpdates conflict, removing webhook and retrying in %.0fs", backoff)
+            try:
+                await bot.delete_webhook(drop_pending_updates=False)
+            except Exception:
+                logger.exception("deleteWebhook failed")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30.0)
+            continue
+        except Exception:
+            logger.exception("getUpdates failed, retrying in %.0fs", backoff)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30.0)
+            continue
+        backoff = 1.0
+        if not updates:
+            continue
+        POLLED_UPDATES.inc(value=len(updates))
+        for update in updates:
+            await slots.acquire()
+            task = asyncio.create_task(_run_polled_update(update, slots))
+            _polling_inflight.add(task)
+            task.add_done_callback(_polling_inflight.discard)
+        # Telegram confirms a batch only with the next getUpdates call; the stored offset lets a restarted
+        # poller confirm it too instead of receiving it again. Delivery is at most once, as with the webhook
+        # (processed_updates is marked before the handler runs): updates in flight when the process dies are lost.
+        offset = max(update.update_id for update in updates) + 1
+        await _store_polling_offset(offset)
+
+
 @app.post(WEBHOOK_PATH)
 async def webhook(
     request: Request,
@@ -278,6 +554,17 @@ async def health() -> dict:
     return {"ok": True}
 
 
+@app.get(READY_PATH)
+async def ready() -> Response:
+    # For load balancers and deploy scripts: 503 until startup warm-up is done.
+    return JSONResponse({"ready": runtime.ready}, status_code=200 if runtime.ready else 503)
+
+
+@app.get(METRICS_PATH)
+async def metrics() -> Response:
+    return PlainTextResponse(render_latest(), media_type="text/plain; version=0.0.4")
+
+
 @app.post(FREEKASSA_PATH)
 async def freekassa_webhook(request: Request) -> Response:
     if not (config.freekassa_shop_id and config.freekassa_secret2):
@@ -308,6 +595,7 @@ async def freekassa_webhook(request: Request) -> Response:
         if payment["status"] == "paid":
             return PlainTextResponse("YES")
         await _credit_payment_and_notify(db, payment, provider_payment_id=f"freekassa:{payment_id}")
+        await scheduler.cancel(db, FREEKASSA_POLL, payment_id)
     finally:
         await db.close()
     return PlainTextResponse("YES")
@@ -319,86 +607,344 @@ async def freekassa_webhook_status() -> Response:
     return PlainTextResponse("OK")
 
 
-async def billing_loop() -> None:
-    while True:
-        db = await get_db(config.db_path)
+async def _flush_write_behind() -> None:
+    if not dao.has_pending_writes():
+        return
+    started = time.perf_counter()
+    # A failed batch stays buffered and is retried on the next tick.
+    await dao.sync_pending_writes()
+    LOOP_SECONDS.observe(time.perf_counter() - started, "write_behind")
+
+
+def start_write_behind() -> None:
+    global _write_behind_task
+    if config.write_behind_flush_ms <= 0 or _write_behind_task is not None:
+        return
+    # Every worker buffers its own bookkeeping writes, so the flusher is not leader-only.
+    runtime.write_behind = True
+    _write_behind_task = asyncio.create_task(write_behind_loop())
+
+
+async def stop_write_behind() -> None:
+    if _write_behind_task is None:
+        return
+    # The loop flushes once more on its way out; anything written after that goes straight to the DB.
+    _write_behind_stop.set()
+    await asyncio.wait([_write_behind_task], timeout=10)
+    runtime.write_behind = False
+    await _flush_write_behind()
+
+
+async def write_behind_loop() -> None:
+    interval = config.write_behind_flush_ms / 1000
+    while not _write_behind_stop.is_set():
         try:
-            result = await run_billing_once(db)
-            if result.changed:
-                await sync_mtproto_secrets(db)
-            if result.disabled_by_balance:
-                await _notify_disabled_proxies(bot, db, result.disabled_by_balance)
-            if result.low_balance_warnings:
-                await _notify_low_balance(bot, db, result.low_balance_warnings)
-        finally:
-            await db.close()
-        await asyncio.sleep(config.billing_interval_sec)
+            await asyncio.wait_for(_write_behind_stop.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+        await _flush_write_behind()
 
 
-async def freekassa_reconcile_loop() -> None:
+async def leader_loop() -> None:
     while True:
-        interval = max(30, int(config.freekassa_reconcile_interval_sec))
-        db = await get_db(config.db_path)
+        await asyncio.sleep(renew_interval_sec())
         try:
-            await _reconcile_pending_freekassa(db)
-        finally:
-            await db.close()
-        await asyncio.sleep(interval)
+            db = await get_db(config.db_path)
+            try:
+                changed = await refresh_leadership(db)
+                if runtime.is_leader:
+                    if changed:
+                        # Previous leader went away; it may have deleted the webhook on shutdown.
+                        await _set_webhook(drop_pending_updates=False)
+                    await apply_requested_mtproxy_restart(db)
+            finally:
+                await db.close()
+        except Exception:
+            logger.exception("Leader loop iteration failed")
+
+
+async def billing_loop() -> None:
+    while True:
+        delay = float(config.billing_interval_sec)
+        if runtime.is_leader:
+            started = time.perf_counter()
+            db = await get_db(config.db_path)
+            try:
+                result = await run_billing_once(db)
+                if result.next_due_at is not None:
+                    # Sleep until the earliest due proxy; BILLING_INTERVAL_SEC only caps the wait.
+                    delay = min(delay, max(1.0, result.next_due_at - time.time()))
+                if result.changed:
+                    await sync_mtproto_secrets(db)
+                if result.disabled_by_balance:
+                    await _notify_disabled_proxies(bot, db, result.disabled_by_balance)
+                if result.low_balance_warnings:
+                    await _notify_low_balance(bot, db, result.low_balance_warnings)
+            finally:
+                await db.close()
+                LOOP_SECONDS.observe(time.perf_counter() - started, "billing")
+        await asyncio.sleep(delay)
 
 
 async def mtproxy_watchdog_loop() -> None:
     while True:
+        if runtime.is_leader:
+            started = time.perf_counter()
+            try:
+                await maybe_restart_mtproxy_service()
+                await _check_mtproxy_health(bot)
+            except Exception:
+                pass
+            LOOP_SECONDS.observe(time.perf_counter() - started, "mtproxy_watchdog")
+        await asyncio.sleep(60)
+
+
+async def ledger_verify_loop() -> None:
+    while True:
+        if runtime.is_leader:
+            started = time.perf_counter()
+            db = await get_db(config.db_path)
+            try:
+                await verify_ledger(db)
+            except Exception:
+                logger.exception("Ledger verification failed")
+            finally:
+                await db.close()
+                LOOP_SECONDS.observe(time.perf_counter() - started, "ledger_verify")
+        await asyncio.sleep(3600)
+
+
+async def _expire_pending_payments(db, batch: int = 1000) -> int:
+    ttl_hours = await get_int_setting(db, "payment_pending_ttl_hours", 48)
+    if ttl_hours <= 0:
+        return 0
+    notify = (await dao.get_setting(db, "payment_expiry_notify", "1")) == "1"
+    # Orders abandoned long before expiry existed are closed silently instead of flooding their owners.
+    notify_after = time.time() - (ttl_hours + 24) * 3600
+    cutoff = time.time() - ttl_hours * 3600
+    expired = 0
+    while True:
+        rows = await dao.expire_pending_payments(db, cutoff, batch)
+        expired += len(rows)
+        for payment in rows:
+            if notify and (_row_ts(payment, "created") or 0) >= notify_after:
+                await _send_payment_status_message(
+                    db,
+                    payment,
+                    f"⌛️ Платёж #{payment['id']} на {payment['amount']} ₽ не был оплачен и отменён по сроку.\n"
+                    "Статус: expired.",
+                )
+        if len(rows) < batch:
+            return expired
+
+
+async def payments_maintenance_loop() -> None:
+    while True:
+        if runtime.is_leader:
+            started = time.perf_counter()
+            db = await get_db(config.db_path)
+            try:
+                expired = await _expire_pending_payments(db)
+                archive_days = await get_int_setting(db, "payment_archive_days", 90)
+                archived = await dao.archive_payments(db, time.time() - archive_days * 86400) if archive_days > 0 else 0
+                if expired or archived:
+                    logger.info("Payments maintenance: expired=%s archived=%s", expired, archived)
+            except Exception:
+                logger.exception("Payments maintenance failed")
+            finally:
+                await db.close()
+                LOOP_SECONDS.observe(time.perf_counter() - started, "payments_maintenance")
+        await asyncio.sleep(600)
+
+
+async def retention_loop() -> None:
+    while True:
+        if runtime.is_leader:
+            started = time.perf_counter()
+            db = await get_db(config.db_path)
+            try:
+                result = await run_retention(db)
+                if result.removed and any(result.removed.values()):
+                    logger.info(
+                        "Retention: removed=%s archive=%s vacuumed_pages=%s",
+                        result.removed,
+                        result.archive_path,
+                        result.vacuumed_pages,
+                    )
+            except Exception:
+                logger.exception("Retention run failed")
+            finally:
+                await db.close()
+                LOOP_SECONDS.observe(time.perf_counter() - started, "retention")
+        await asyncio.sleep(6 * 3600)
+
+
+def _backup_report(result) -> str:
+    return (
+        "💾 Бэкап БД готов\n"
+        f"Файл: {os.path.basename(result.path)}\n"
+        f"Размер: {result.size_bytes / 1024 / 1024:.1f} МБ (БД {result.db_bytes / 1024 / 1024:.1f} МБ)\n"
+        f"Время: {result.duration_sec:.1f} с, перезапусков копирования: {result.restarts}\n"
+        f"integrity_check: {result.integrity}"
+    )
+
+
+async def backup_loop() -> None:
+    interval = config.backup_interval_hours * 3600
+    if interval <= 0:
+        return
+    directory = backup_dir()
+    retry_at = 0.0
+    while True:
+        # The newest file's mtime is the schedule, so restarts and leader changes don't add extra backups.
+        now = time.time()
+        if runtime.is_leader and now >= retry_at and now - last_backup_ts(directory) >= interval:
+            started = time.perf_counter()
+            try:
+                result = await asyncio.to_thread(backup_database, config.db_path, directory, config.backup_keep)
+                text = _backup_report(result)
+            except Exception as exc:
+                logger.exception("DB backup failed")
+                text = f"❌ Бэкап БД не удался: {exc}"
+                retry_at = now + 3600
+            LOOP_SECONDS.observe(time.perf_counter() - started, "backup")
+            for admin_id in config.admin_tg_ids:
+                try:
+                    await bot.send_message(admin_id, text, disable_notification=True)
+                except Exception:
+                    continue
+        await asyncio.sleep(300)
+
+
+def _wal_size(db_path: str) -> int:
+    try:
+        return os.path.getsize(db_path + "-wal")
+    except OSError:
+        return 0
+
+
+async def wal_checkpoint_loop() -> None:
+    interval = max(1, int(config.wal_checkpoint_interval_sec))
+    truncate_bytes = max(1, int(config.wal_truncate_mb)) * 1024 * 1024
+    while True:
+        await asyncio.sleep(interval)
+        if not runtime.is_leader:
+            continue
+        started = time.perf_counter()
+        # PASSIVE never waits on anyone; once the WAL has grown past the limit, TRUNCATE waits for
+        # readers (busy_timeout) so the file can be reset to zero length.
+        mode = "TRUNCATE" if _wal_size(config.db_path) >= truncate_bytes else "PASSIVE"
         try:
-            await maybe_restart_mtproxy_service()
-            await _check_mtproxy_health(bot)
+            db = await get_db(config.db_path)
+            try:
+                busy, _, _ = await checkpoint_wal(db, mode)
+            finally:
+                await db.close()
+            WAL_CHECKPOINTS.inc(mode.lower(), "1" if busy else "0")
         except Exception:
-            pass
+            logger.exception("WAL checkpoint failed")
+        DB_WAL_BYTES.set(value=float(_wal_size(config.db_path)))
+        LOOP_SECONDS.observe(time.perf_counter() - started, "wal_checkpoint")
+
+
+async def deferred_migrations_loop() -> None:
+    # Index builds and backfills run on the leader once the app is serving; other workers wait for its marker.
+    while True:
+        started = time.perf_counter()
+        done = False
+        try:
+            db = await get_db(config.db_path)
+            try:
+                if runtime.is_leader:
+                    applied = await run_deferred_migrations(db)
+                    if applied:
+                        logger.info("Deferred migrations applied: %s", ", ".join(applied))
+                done = await deferred_version(db) >= DEFERRED_VERSION
+                if done:
+                    runtime.epoch_ts_ready = await epoch_backfill_done(db)
+            finally:
+                await db.close()
+        except Exception:
+            logger.exception("Deferred migrations failed")
+        if runtime.is_leader:
+            LOOP_SECONDS.observe(time.perf_counter() - started, "deferred_migrations")
+        if done:
+            return
         await asyncio.sleep(60)
 
 
-async def support_sla_loop() -> None:
+async def flood_policy_loop() -> None:
+    # Every worker keeps its own copy; this picks up edits made through another worker.
     while True:
-        db = await get_db(config.db_path)
+        await asyncio.sleep(60)
         try:
-            await _check_support_sla(db)
-        finally:
-            await db.close()
-        await asyncio.sleep(300)
+            db = await get_db(config.db_path)
+            try:
+                await reload_policy(db)
+            finally:
+                await db.close()
+        except Exception:
+            logger.exception("Flood policy reload failed")
+
+
+def _iso_ts(value: str | None) -> float | None:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "")).replace(tzinfo=timezone.utc).timestamp()
+    except ValueError:
+        return None
 
 
-async def _reconcile_pending_freekassa(db) -> None:
+def _row_ts(row, stem: str) -> float | None:
+    # Rows not reached by the epoch backfill yet only have the ISO column.
+    value = row[f"{stem}_ts"]
+    return float(value) if value is not None else _iso_ts(row[f"{stem}_at"])
+
+
+def _freekassa_poll_delay(age_sec: float) -> float:
+    # Poll fresh orders at the configured interval, then back off as the order ages (up to 30 min).
+    base = max(30, int(config.freekassa_reconcile_interval_sec))
+    return min(1800.0, max(float(base), age_sec / 4))
+
+
+async def _poll_freekassa_payment(db, task) -> None:
     if not (config.freekassa_shop_id and config.freekassa_api_key):
         return
-    pending = await dao.list_pending_freekassa_payments(db, limit=100)
-    for payment in pending:
-        try:
-            data = await get_order_status(
-                api_base=config.freekassa_api_base,
-                api_key=config.freekassa_api_key,
-                shop_id=config.freekassa_shop_id,
-                payment_id=int(payment["id"]),
-            )
-            if data.get("error"):
-                logger.warning("FreeKassa poll error payment_id=%s: %s", payment["id"], data.get("error"))
-                continue
-            status = _fk_status_from_data(data)
-            if status == "paid":
-                await _credit_payment_and_notify(
-                    db,
-                    payment,
-                    provider_payment_id=f"freekassa:{payment['id']}",
-                )
-            elif status in {"failed", "canceled"}:
-                await _set_payment_status_and_notify(
-                    db,
-                    payment,
-                    status,
-                    provider_payment_id=f"freekassa:{payment['id']}",
-                )
-        except Exception:
-            logger.exception("FreeKassa reconcile failed payment_id=%s", payment["id"])
-            continue
+    payment = await dao.get_payment_by_id(db, int(task["entity_id"]))
+    if not payment or payment["status"] != "pending":
+        return
+    data = await get_order_status(
+        api_base=config.freekassa_api_base,
+        api_key=config.freekassa_api_key,
+        shop_id=config.freekassa_shop_id,
+        payment_id=int(payment["id"]),
+    )
     runtime.last_freekassa_reconcile_ts = time.time()
+    if data.get("error"):
+        logger.warning("FreeKassa poll error payment_id=%s: %s", payment["id"], data.get("error"))
+        status = "unknown"
+    else:
+        status = _fk_status_from_data(data)
+    if status == "paid":
+        await _credit_payment_and_notify(
+            db,
+            payment,
+            provider_payment_id=f"freekassa:{payment['id']}",
+        )
+        return
+    if status in {"failed", "canceled"}:
+        await _set_payment_status_and_notify(
+            db,
+            payment,
+            status,
+            provider_payment_id=f"freekassa:{payment['id']}",
+        )
+        return
+    now = time.time()
+    age = now - (_row_ts(payment, "created") or now)
+    if age < FREEKASSA_POLL_MAX_AGE_SEC:
+        await scheduler.schedule(db, FREEKASSA_POLL, int(payment["id"]), now + _freekassa_poll_delay(age))
 
 
 async def _check_mtproxy_health(bot: Bot) -> None:
@@ -453,44 +999,48 @@ async def _check_mtproxy_health(bot: Bot) -> None:
                     )
                     await proc.communicate()
                     runtime.mtproxy_last_restart_ts = now_ts
+                    MTPROXY_RESTARTS.inc("watchdog")
                 except Exception:
                     pass
     else:
         runtime.mtproxy_last_state = state
 
 
-async def _check_support_sla(db) -> None:
+async def _check_support_sla(db, task) -> None:
+    ticket = await dao.get_support_ticket_for_sla(db, int(task["entity_id"]))
+    if not ticket or ticket["status"] != "waiting_admin":
+        return
     minutes = await get_int_setting(db, "support_sla_minutes", 30)
     minutes = max(5, minutes)
-    threshold = (datetime.utcnow() - timedelta(minutes=minutes)).replace(microsecond=0).isoformat() + "Z"
-    now_iso = datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
-    tickets = await dao.list_overdue_support_tickets(db, threshold)
-    for ticket in tickets:
-        last_alert = ticket["last_sla_alert_at"] or ""
-        if last_alert:
-            try:
-                last_dt = datetime.fromisoformat(last_alert.replace("Z", ""))
-                if datetime.utcnow() - last_dt < timedelta(hours=1):
-                    continue
-            except Exception:
-                pass
-        user_label = f"@{ticket['username']}" if ticket["username"] else f"tg:{ticket['tg_id']}"
-        text = (
-            f"SLA: тикет #{ticket['id']} без ответа {minutes}+ мин.\n"
-            f"Пользователь: {user_label}"
-        )
-        targets: list[int] = []
-        assigned = ticket["assigned_admin_tg_id"]
-        if assigned:
-            targets = [int(assigned)]
-        else:
-            targets = list(runtime.config.admin_tg_ids if runtime.config else [])
-        for admin_id in targets:
-            try:
-                await bot.send_message(admin_id, text, disable_notification=True)
-            except Exception:
-                continue
-        await dao.update_support_ticket_sla_alert_at(db, int(ticket["id"]), now_iso)
+    now = time.time()
+    overdue_at = (_row_ts(ticket, "updated") or now) + minutes * 60
+    last_alert = _row_ts(ticket, "last_sla_alert")
+    alert_at = max(overdue_at, last_alert + 3600 if last_alert else 0.0)
+    if alert_at > now:
+        await scheduler.schedule(db, SUPPORT_SLA, int(ticket["id"]), alert_at)
+        return
+    user_label = f"@{ticket['username']}" if ticket["username"] else f"tg:{ticket['tg_id']}"
+    text = (
+        f"SLA: тикет #{ticket['id']} без ответа {minutes}+ мин.\n"
+        f"Пользователь: {user_label}"
+    )
+    targets: list[int] = []
+    assigned = ticket["assigned_admin_tg_id"]
+    if assigned:
+        targets = [int(assigned)]
+    else:
+        targets = list(runtime.config.admin_tg_ids if runtime.config else [])
+    for admin_id in targets:
+        try:
+            await bot.send_message(admin_id, text, disable_notification=True)
+        except Exception:
+            continue
+    await dao.update_support_ticket_sla_alert_at(db, int(ticket["id"]), int(now))
+    await scheduler.schedule(db, SUPPORT_SLA, int(ticket["id"]), now + 3600)
+
+
+scheduler.register(FREEKASSA_POLL, _poll_freekassa_payment)
+scheduler.register(SUPPORT_SLA, _check_support_sla)
 
 
 async def _notify_disabled_proxies(bot: Bot, db, disabled_map: dict[int, list]) -> None:
@@ -531,3 +1081,23 @@ async def _notify_low_balance(bot: Bot, db, warnings: dict[int, dict]) -> None:
             await send_bg_to_user(bot, db, user, text)
         except Exception:
             continue
+
+
+async def run_polling() -> None:
+    # Entry point without an HTTP server (behind NAT): getUpdates only. /freekassa is not served then,
+    # so FreeKassa payments are picked up by the status polling scheduled for every new order.
+    await on_startup()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await on_shutdown()
+
+
+if __name__ == "__main__":
+    if config.update_mode != "polling":
+        raise SystemExit("python -m app.main needs UPDATE_MODE=polling; use uvicorn for the webhook")
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    try:
+        asyncio.run(run_polling())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from aiogram import Router
+from aiogram.dispatcher.event.handler import CallableObject
+from aiogram.filters import Filter
+from aiogram.types import CallbackQuery
+
+
+class CallbackRoutes(Filter):
+    # callback_data index for one router. aiogram checks a router's handlers one filter at a time, so with
+    # `F.data == ...` chains every callback paid for each handler registered before its own. Here the router gets a
+    # single callback_query handler and the lookup is a dict hit on the exact value, then one dict probe per
+    # registered prefix length (callback_data is at most 64 bytes), however many handlers there are.
+    # The longest prefix wins and exact values win over prefixes, which is what first-match order gave before.
+
+    def __init__(self, router: Router) -> None:
+        self._exact: Dict[str, CallableObject] = {}
+        self._prefixes: Dict[str, CallableObject] = {}
+        self._prefix_lengths: List[int] = []
+        self.routes: List[Tuple[str, str, Callable[..., Any]]] = []
+        router.callback_query.register(self._dispatch, self)
+
+    def exact(self, *values: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+        def decorator(callback: Callable[..., Any]) -> Callable[..., Any]:
+            target = CallableObject(callback)
+            for value in values:
+                if value in self._exact:
+                    raise ValueError(f"callback_data {value!r} is already routed")
+                self._exact[value] = target
+                self.routes.append(("exact", value, callback))
+            return callback
+
+        return decorator
+
+    def prefix(self, value: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+        def decorator(callback: Callable[..., Any]) -> Callable[..., Any]:
+            if value in self._prefixes:
+                raise ValueError(f"callback_data prefix {value!r} is already routed")
+            self._prefixes[value] = CallableObject(callback)
+            self._prefix_lengths = sorted({len(key) for key in self._prefixes}, reverse=True)
+            self.routes.append(("prefix", value, callback))
+            return callback
+
+        return decorator
+
+    def resolve(self, data: str) -> Optional[Tuple[CallableObject, List[str]]]:
+        target = self._exact.get(data)
+        if target is not None:
+            return target, []
+        size = len(data)
+        for length in self._prefix_lengths:
+            if length > size:
+                continue
+            target = self._prefixes.get(data[:length])
+            if target is not None:
+                rest = data[length:]
+                if rest.startswith(":"):
+                    rest = rest[1:]
+                return target, rest.split(":") if rest else []
+        return None
+
+    async def __call__(self, call: CallbackQuery) -> bool | Dict[str, Any]:
+        if not call.data:
+            return False
+        found = self.resolve(call.data)
+        if found is None:
+            return False
+        # Handlers may take callback_args: the part after the prefix, split on ":".
+        return {"callback_route": found[0], "callback_args": found[1]}
+
+    @staticmethod
+    async def _dispatch(call: CallbackQuery, callback_route: CallableObject, **data: Any) -> Any:
+        return await callback_route.call(call, callback_route=callback_route, **data)
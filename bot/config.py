@@ -39,6 +39,29 @@ class Config:
     rate_limit_start_per_min: int
     rate_limit_topup_per_min: int
     rate_limit_support_per_min: int
+    rate_limit_backend: str
+    rate_limit_max_keys: int
+    rate_limit_db_path: str
+    loop_lag_interval_ms: int
+    loop_lag_threshold_ms: int
+    leader_lease_ttl_sec: int
+    archive_dir: str
+    backup_dir: str
+    backup_interval_hours: float
+    backup_keep: int
+    sqlite_profile: str
+    sqlite_pragmas: str
+    sqlite_pool_size: int
+    wal_checkpoint_interval_sec: int
+    wal_truncate_mb: int
+    settings_cache_ttl_sec: float
+    loop_start_jitter_sec: float
+    ready_wait_sec: float
+    update_mode: str
+    polling_timeout_sec: int
+    polling_limit: int
+    polling_max_inflight: int
+    write_behind_flush_ms: int
 
 
 def _parse_int_list(value: str) -> List[int]:
@@ -58,10 +81,13 @@ def load_config() -> Config:
 
     bot_token = os.getenv("BOT_TOKEN", "").strip()
     webhook_url = os.getenv("WEBHOOK_URL", "").strip()
+    update_mode = os.getenv("UPDATE_MODE", "webhook").strip().lower() or "webhook"
 
     if not bot_token:
         raise RuntimeError("BOT_TOKEN is required")
-    if not webhook_url:
+    if update_mode not in ("webhook", "polling"):
+        raise RuntimeError("UPDATE_MODE must be webhook or polling")
+    if update_mode == "webhook" and not webhook_url:
         raise RuntimeError("WEBHOOK_URL is required")
 
     return Config(
@@ -92,4 +118,27 @@ def load_config() -> Config:
         rate_limit_start_per_min=int(os.getenv("RATE_LIMIT_START_PER_MIN", "10")),
         rate_limit_topup_per_min=int(os.getenv("RATE_LIMIT_TOPUP_PER_MIN", "20")),
         rate_limit_support_per_min=int(os.getenv("RATE_LIMIT_SUPPORT_PER_MIN", "8")),
+        rate_limit_backend=os.getenv("RATE_LIMIT_BACKEND", "memory").strip().lower() or "memory",
+        rate_limit_max_keys=int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000")),
+        rate_limit_db_path=os.getenv("RATE_LIMIT_DB_PATH", "").strip(),
+        loop_lag_interval_ms=int(os.getenv("LOOP_LAG_INTERVAL_MS", "100")),
+        loop_lag_threshold_ms=int(os.getenv("LOOP_LAG_THRESHOLD_MS", "250")),
+        leader_lease_ttl_sec=int(os.getenv("LEADER_LEASE_TTL_SEC", "30")),
+        archive_dir=os.getenv("ARCHIVE_DIR", "").strip(),
+        backup_dir=os.getenv("BACKUP_DIR", "").strip(),
+        backup_interval_hours=float(os.getenv("BACKUP_INTERVAL_HOURS", "24")),
+        backup_keep=int(os.getenv("BACKUP_KEEP", "7")),
+        sqlite_profile=os.getenv("SQLITE_PROFILE", "safe").strip().lower() or "safe",
+        sqlite_pragmas=os.getenv("SQLITE_PRAGMAS", "").strip(),
+        sqlite_pool_size=int(os.getenv("SQLITE_POOL_SIZE", "8")),
+        wal_checkpoint_interval_sec=int(os.getenv("WAL_CHECKPOINT_INTERVAL_SEC", "60")),
+        wal_truncate_mb=int(os.getenv("WAL_TRUNCATE_MB", "64")),
+        settings_cache_ttl_sec=float(os.getenv("SETTINGS_CACHE_TTL_SEC", "30")),
+        loop_start_jitter_sec=float(os.getenv("LOOP_START_JITTER_SEC", "10")),
+        ready_wait_sec=float(os.getenv("READY_WAIT_SEC", "10")),
+        update_mode=update_mode,
+        polling_timeout_sec=int(os.getenv("POLLING_TIMEOUT_SEC", "25")),
+        polling_limit=min(100, max(1, int(os.getenv("POLLING_LIMIT", "100")))),
+        polling_max_inflight=int(os.getenv("POLLING_MAX_INFLIGHT", "200")),
+        write_behind_flush_ms=int(os.getenv("WRITE_BEHIND_FLUSH_MS", "250")),
     )
@@ -1,10 +1,19 @@
 from __future__ import annotations
 
+import asyncio
+import logging
+import time
 from datetime import datetime, timedelta
 from typing import Any, Dict, List, Optional, Tuple
 
 import aiosqlite
 
+from bot.db import get_db
+from bot.runtime import runtime
+from bot.services.metrics import WRITE_BEHIND_ROWS
+
+logger = logging.getLogger(__name__)
+
 
 def now_iso() -> str:
     return datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
@@ -14,25 +23,52 @@ def days_ago_iso(days: int) -> str:
     return (datetime.utcnow() - timedelta(days=days)).replace(microsecond=0).isoformat() + "Z"
 
 
+def hours_ago_iso(hours: int) -> str:
+    return (datetime.utcnow() - timedelta(hours=hours)).replace(microsecond=0).isoformat() + "Z"
+
+
+def now_ts() -> int:
+    return int(time.time())
+
+
+def ts_to_iso(ts: float) -> str:
+    return datetime.utcfromtimestamp(int(ts)).isoformat() + "Z"
+
+
+def epoch_bound(stem: str, ts: float) -> Tuple[str, Any]:
+    """Column and value for a range bound on `<stem>_at`: the integer `<stem>_ts` shadow once it is backfilled."""
+    if runtime.epoch_ts_ready:
+        return f"{stem}_ts", int(ts)
+    return f"{stem}_at", ts_to_iso(ts)
+
+
+def next_bill_ts(now: Optional[float] = None) -> int:
+    # Billing is per UTC calendar day, so a proxy billed (or created) today is next due at midnight.
+    now = time.time() if now is None else now
+    return (int(now) // 86400 + 1) * 86400
+
+
 async def get_user_by_tg_id(db: aiosqlite.Connection, tg_id: int) -> Optional[aiosqlite.Row]:
     cur = await db.execute(
         "SELECT * FROM users WHERE tg_id = ? AND deleted_at IS NULL",
         (tg_id,),
     )
-    return await cur.fetchone()
+    return _with_pending(await cur.fetchone())
 
 
 async def get_user_by_tg_id_any(db: aiosqlite.Connection, tg_id: int) -> Optional[aiosqlite.Row]:
     cur = await db.execute("SELECT * FROM users WHERE tg_id = ?", (tg_id,))
-    return await cur.fetchone()
+    return _with_pending(await cur.fetchone())
 
 
 async def get_user_by_id(db: aiosqlite.Connection, user_id: int) -> Optional[aiosqlite.Row]:
     cur = await db.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-    return await cur.fetchone()
+    return _with_pending(await cur.fetchone())
 
 
 async def get_user_by_username(db: aiosqlite.Connection, username: str) -> Optional[aiosqlite.Row]:
+    # A username refreshed in /start may still be buffered, and the lookup is by that column.
+    await sync_pending_writes()
     cur = await db.execute(
         "SELECT * FROM users WHERE LOWER(username) = LOWER(?) AND deleted_at IS NULL",
         (username,),
@@ -45,7 +81,7 @@ async def get_user_by_ref_code(db: aiosqlite.Connection, ref_code: str) -> Optio
         "SELECT * FROM users WHERE ref_code = ? AND deleted_at IS NULL",
         (ref_code,),
     )
-    return await cur.fetchone()
+    return _with_pending(await cur.fetchone())
 
 
 async def create_user(
@@ -56,33 +92,145 @@ async def create_user(
     referred_by: Optional[str],
     balance: int,
 ) -> int:
+    ts = now_ts()
     cur = await db.execute(
         """
-        INSERT INTO users (tg_id, username, ref_code, referred_by, balance, created_at, last_seen_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
+        INSERT INTO users (
+            tg_id, username, ref_code, referred_by, balance, created_at, last_seen_at, created_ts, last_seen_ts
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
         """,
-        (tg_id, username, ref_code, referred_by, balance, now_iso(), now_iso()),
+        (tg_id, username, ref_code, referred_by, balance, ts_to_iso(ts), ts_to_iso(ts), ts, ts),
     )
+    user_id = cur.lastrowid
+    if balance:
+        await db.execute(
+            "INSERT INTO balance_ledger (user_id, kind, delta, idempotency_key, created_at) VALUES (?, ?, ?, ?, ?)",
+            (user_id, "free_credit", balance, f"signup:{user_id}", now_iso()),
+        )
     await db.commit()
-    return cur.lastrowid
+    return user_id
+
+
+# Write-behind buffer for per-user bookkeeping (last seen, menu message id, username) and referral clicks.
+# While the flusher in app.main runs (runtime.write_behind), these writes only record the latest value per
+# column here and flush_pending_writes() applies them in one transaction; otherwise they are written directly.
+# The single-user getters above overlay pending values, so this worker reads its own writes before they are
+# flushed; lookups, filters and lists over these columns call sync_pending_writes() first, which flushes on its
+# own connection so the caller's transaction is never committed or rolled back under it.
+_pending_users: Dict[int, Dict[str, Any]] = {}
+_flushing_users: Dict[int, Dict[str, Any]] = {}
+_pending_clicks: Dict[Tuple[str, int], str] = {}
+_flush_lock = asyncio.Lock()
+
+
+def _with_pending(row: Optional[aiosqlite.Row]) -> Optional[aiosqlite.Row]:
+    if row is None or not (_pending_users or _flushing_users):
+        return row
+    tg_id = row["tg_id"]
+    flushing = _flushing_users.get(tg_id)
+    pending = _pending_users.get(tg_id)
+    if flushing is None and pending is None:
+        return row
+    merged = dict(row)
+    merged.update(flushing or {})
+    merged.update(pending or {})
+    return merged
+
+
+async def _update_user_columns(db: Optional[aiosqlite.Connection], tg_id: int, values: Dict[str, Any]) -> None:
+    if runtime.write_behind:
+        _pending_users.setdefault(tg_id, {}).update(values)
+        return
+    assignments = ", ".join(f"{column} = ?" for column in values)
+    await db.execute(f"UPDATE users SET {assignments} WHERE tg_id = ?", (*values.values(), tg_id))
+    await db.commit()
+
+
+def has_pending_writes() -> bool:
+    return bool(_pending_users or _pending_clicks)
+
+
+async def flush_pending_writes(db: aiosqlite.Connection) -> Tuple[int, int]:
+    """Apply buffered user updates and referral clicks in one transaction; returns (users, clicks) written.
+
+    Commits or rolls back `db`, so it must be a connection of its own; everything else goes through
+    sync_pending_writes().
+    """
+    global _pending_users, _flushing_users, _pending_clicks
+    if not _pending_users and not _pending_clicks and not _flush_lock.locked():
+        return 0, 0
+    async with _flush_lock:
+        if not _pending_users and not _pending_clicks:
+            return 0, 0
+        assert not db.in_transaction, "flush_pending_writes needs a connection without an open transaction"
+        users, clicks = _pending_users, _pending_clicks
+        _pending_users, _pending_clicks = {}, {}
+        _flushing_users = users
+        try:
+            # One executemany per distinct column set: most batches have two or three.
+            groups: Dict[Tuple[str, ...], List[Tuple[Any, ...]]] = {}
+            for tg_id, values in users.items():
+                columns = tuple(sorted(values))
+                groups.setdefault(columns, []).append((*(values[column] for column in columns), tg_id))
+            for columns, params in groups.items():
+                assignments = ", ".join(f"{column} = ?" for column in columns)
+                await db.executemany(f"UPDATE users SET {assignments} WHERE tg_id = ?", params)
+            if clicks:
+                await db.executemany(
+                    "INSERT OR IGNORE INTO referral_clicks(link_code, tg_id, created_at) VALUES(?, ?, ?)",
+                    [(link_code, tg_id, created_at) for (link_code, tg_id), created_at in clicks.items()],
+                )
+            await db.commit()
+        except BaseException:
+            try:
+                await db.rollback()
+            except Exception:
+                pass
+            # Put the batch back under anything written since, so the next flush retries it.
+            for tg_id, values in users.items():
+                _pending_users[tg_id] = {**values, **_pending_users.get(tg_id, {})}
+            for key, created_at in clicks.items():
+                _pending_clicks.setdefault(key, created_at)
+            raise
+        finally:
+            _flushing_users = {}
+    return len(users), len(clicks)
+
+
+async def sync_pending_writes() -> Tuple[int, int]:
+    """Flush the write-behind buffer on a dedicated connection; failures are logged and the batch stays buffered."""
+    if not _pending_users and not _pending_clicks and not _flush_lock.locked():
+        return 0, 0
+    if runtime.config is None:
+        return 0, 0
+    try:
+        db = await get_db(runtime.config.db_path)
+        try:
+            users, clicks = await flush_pending_writes(db)
+        finally:
+            await db.close()
+    except Exception:
+        logger.exception("Write-behind flush failed")
+        return 0, 0
+    WRITE_BEHIND_ROWS.inc("users", value=users)
+    WRITE_BEHIND_ROWS.inc("referral_clicks", value=clicks)
+    return users, clicks
 
 
 async def update_user_last_seen(db: aiosqlite.Connection, tg_id: int) -> None:
-    await db.execute(
-        "UPDATE users SET last_seen_at = ? WHERE tg_id = ?",
-        (now_iso(), tg_id),
-    )
-    await db.commit()
+    ts = now_ts()
+    await _update_user_columns(db, tg_id, {"last_seen_at": ts_to_iso(ts), "last_seen_ts": ts})
 
 
 async def update_user_last_menu_message_id(
-    db: aiosqlite.Connection, tg_id: int, message_id: int
+    db: Optional[aiosqlite.Connection], tg_id: int, message_id: int
 ) -> None:
-    await db.execute(
-        "UPDATE users SET last_menu_message_id = ? WHERE tg_id = ?",
-        (message_id, tg_id),
-    )
-    await db.commit()
+    await _update_user_columns(db, tg_id, {"last_menu_message_id": message_id})
+
+
+async def update_user_username(db: aiosqlite.Connection, tg_id: int, username: Optional[str]) -> None:
+    await _update_user_columns(db, tg_id, {"username": username})
 
 
 async def update_user_low_balance_warn_at(
@@ -115,13 +263,132 @@ async def update_user_warn_6h_at(
     await db.commit()
 
 
-async def set_user_balance(db: aiosqlite.Connection, user_id: int, balance: int) -> None:
-    await db.execute("UPDATE users SET balance = ? WHERE id = ?", (balance, user_id))
+LedgerEntry = Tuple[int, str, int, Optional[str], Optional[str]]
+
+
+async def set_user_balance(
+    db: aiosqlite.Connection,
+    user_id: int,
+    balance: int,
+    kind: str = "admin_set",
+    idempotency_key: Optional[str] = None,
+    ref: Optional[str] = None,
+) -> bool:
+    cur = await db.execute(
+        "INSERT OR IGNORE INTO balance_ledger (user_id, kind, delta, idempotency_key, ref, created_at) "
+        "SELECT id, ?, ? - balance, ?, ?, ? FROM users WHERE id = ?",
+        (kind, balance, idempotency_key, ref, now_iso(), user_id),
+    )
+    applied = cur.rowcount > 0
+    if applied:
+        await db.execute("UPDATE users SET balance = ? WHERE id = ?", (balance, user_id))
     await db.commit()
+    return applied
 
 
-async def add_user_balance(db: aiosqlite.Connection, user_id: int, delta: int) -> None:
-    await db.execute("UPDATE users SET balance = balance + ? WHERE id = ?", (delta, user_id))
+async def add_user_balance(
+    db: aiosqlite.Connection,
+    user_id: int,
+    delta: int,
+    kind: str = "adjustment",
+    idempotency_key: Optional[str] = None,
+    ref: Optional[str] = None,
+) -> bool:
+    """Appends a ledger entry and moves the cached balance; False if the key was already used."""
+    cur = await db.execute(
+        "INSERT OR IGNORE INTO balance_ledger (user_id, kind, delta, idempotency_key, ref, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (user_id, kind, delta, idempotency_key, ref, now_iso()),
+    )
+    applied = cur.rowcount > 0
+    if applied:
+        await db.execute("UPDATE users SET balance = balance + ? WHERE id = ?", (delta, user_id))
+    await db.commit()
+    return applied
+
+
+async def append_ledger_entries(db: aiosqlite.Connection, entries: List[LedgerEntry]) -> int:
+    """Bulk version of add_user_balance for (user_id, kind, delta, idempotency_key, ref) rows.
+
+    Returns the number of entries applied; duplicates by idempotency key are skipped.
+    """
+    if not entries:
+        return 0
+    if not db.in_transaction:
+        # Take the write lock first so no other writer can slip entries in above `floor`.
+        await db.execute("BEGIN IMMEDIATE")
+    try:
+        cur = await db.execute("SELECT COALESCE(MAX(id), 0) FROM balance_ledger")
+        floor = (await cur.fetchone())[0]
+        created_at = now_iso()
+        await db.executemany(
+            "INSERT OR IGNORE INTO balance_ledger (user_id, kind, delta, idempotency_key, ref, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [(user_id, kind, delta, key, ref, created_at) for user_id, kind, delta, key, ref in entries],
+        )
+        await db.execute(
+            """
+            UPDATE users SET balance = balance + (
+                SELECT SUM(l.delta) FROM balance_ledger l WHERE l.user_id = users.id AND l.id > ?
+            )
+            WHERE id IN (SELECT user_id FROM balance_ledger WHERE id > ?)
+            """,
+            (floor, floor),
+        )
+        cur = await db.execute("SELECT COUNT(*) FROM balance_ledger WHERE id > ?", (floor,))
+        applied = (await cur.fetchone())[0]
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+    return int(applied)
+
+
+async def get_ledger_max_id(db: aiosqlite.Connection) -> int:
+    cur = await db.execute("SELECT COALESCE(MAX(id), 0) FROM balance_ledger")
+    return int((await cur.fetchone())[0])
+
+
+async def get_ledger_verify_rows(
+    db: aiosqlite.Connection, after_id: int, upto_id: int
+) -> List[aiosqlite.Row]:
+    """Expected vs cached balance as of ledger entry `upto_id` for users touched in (after_id, upto_id]."""
+    if not db.in_transaction:
+        # One read snapshot for the ledger and users, so concurrent writes can't skew the comparison.
+        await db.execute("BEGIN")
+    try:
+        cur = await db.execute(
+            """
+            WITH touched AS (
+                SELECT user_id, SUM(delta) AS delta
+                FROM balance_ledger
+                WHERE id > ? AND id <= ?
+                GROUP BY user_id
+            )
+            SELECT t.user_id,
+                   COALESCE(c.balance, 0) + t.delta AS expected,
+                   u.balance - COALESCE(
+                       (SELECT SUM(l.delta) FROM balance_ledger l WHERE l.user_id = t.user_id AND l.id > ?), 0
+                   ) AS actual
+            FROM touched t
+            JOIN users u ON u.id = t.user_id
+            LEFT JOIN balance_checkpoints c ON c.user_id = t.user_id
+            """,
+            (after_id, upto_id, upto_id),
+        )
+        rows = await cur.fetchall()
+    finally:
+        await db.commit()
+    return rows
+
+
+async def save_balance_checkpoints(db: aiosqlite.Connection, balances: List[Tuple[int, int]]) -> None:
+    checked_at = now_iso()
+    await db.executemany(
+        "INSERT INTO balance_checkpoints (user_id, balance, checked_at) VALUES (?, ?, ?) "
+        "ON CONFLICT(user_id) DO UPDATE SET balance = excluded.balance, checked_at = excluded.checked_at",
+        [(user_id, balance, checked_at) for user_id, balance in balances],
+    )
     await db.commit()
 
 
@@ -142,6 +409,9 @@ async def delete_user(db: aiosqlite.Connection, user_id: int) -> None:
     )
     await db.execute("DELETE FROM referral_links WHERE owner_user_id = ?", (user_id,))
     await db.execute("DELETE FROM payments WHERE user_id = ?", (user_id,))
+    await db.execute("DELETE FROM payments_archive WHERE user_id = ?", (user_id,))
+    await db.execute("DELETE FROM balance_ledger WHERE user_id = ?", (user_id,))
+    await db.execute("DELETE FROM balance_checkpoints WHERE user_id = ?", (user_id,))
     await db.execute("DELETE FROM proxies WHERE user_id = ?", (user_id,))
     await db.execute("DELETE FROM users WHERE id = ?", (user_id,))
     await db.commit()
@@ -154,9 +424,10 @@ async def count_users(db: aiosqlite.Connection) -> int:
 
 
 async def count_active_users(db: aiosqlite.Connection, days: int) -> int:
-    since = days_ago_iso(days)
+    await sync_pending_writes()
+    column, since = epoch_bound("last_seen", time.time() - days * 86400)
     cur = await db.execute(
-        "SELECT COUNT(*) AS cnt FROM users WHERE deleted_at IS NULL AND last_seen_at >= ?",
+        f"SELECT COUNT(*) AS cnt FROM users WHERE deleted_at IS NULL AND {column} >= ?",
         (since,),
     )
     row = await cur.fetchone()
@@ -174,12 +445,14 @@ async def create_proxy(
     is_free: int,
     mtproto_secret: Optional[str] = None,
 ) -> int:
+    ts = now_ts()
     cur = await db.execute(
         """
         INSERT INTO proxies (
-            user_id, login, password, ip, port, status, is_free, mtproto_secret, created_at, last_billed_at
+            user_id, login, password, ip, port, status, is_free, mtproto_secret, created_at, last_billed_at,
+            last_billed_ts, next_bill_at
         )
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         """,
         (
             user_id,
@@ -190,8 +463,10 @@ async def create_proxy(
             status,
             is_free,
             mtproto_secret,
-            now_iso(),
-            now_iso(),
+            ts_to_iso(ts),
+            ts_to_iso(ts),
+            ts,
+            next_bill_ts(ts),
         ),
     )
     await db.commit()
@@ -264,39 +539,101 @@ async def count_active_proxies(db: aiosqlite.Connection, user_id: Optional[int]
 
 
 async def update_proxy_last_billed(db: aiosqlite.Connection, proxy_id: int) -> None:
-    await db.execute("UPDATE proxies SET last_billed_at = ? WHERE id = ?", (now_iso(), proxy_id))
+    ts = now_ts()
+    await db.execute(
+        "UPDATE proxies SET last_billed_at = ?, last_billed_ts = ?, next_bill_at = ? WHERE id = ?",
+        (ts_to_iso(ts), ts, next_bill_ts(ts), proxy_id),
+    )
+    await db.commit()
+
+
+async def update_proxies_last_billed(db: aiosqlite.Connection, proxy_ids: List[int]) -> None:
+    if not proxy_ids:
+        return
+    ts = now_ts()
+    billed_at = ts_to_iso(ts)
+    next_at = next_bill_ts(ts)
+    await db.executemany(
+        "UPDATE proxies SET last_billed_at = ?, last_billed_ts = ?, next_bill_at = ? WHERE id = ?",
+        [(billed_at, ts, next_at, proxy_id) for proxy_id in proxy_ids],
+    )
     await db.commit()
 
 
 async def update_proxies_last_billed_by_user(db: aiosqlite.Connection, user_id: int) -> None:
+    ts = now_ts()
     await db.execute(
-        "UPDATE proxies SET last_billed_at = ? WHERE user_id = ? AND deleted_at IS NULL",
-        (now_iso(), user_id),
+        "UPDATE proxies SET last_billed_at = ?, last_billed_ts = ?, next_bill_at = ? "
+        "WHERE user_id = ? AND deleted_at IS NULL",
+        (ts_to_iso(ts), ts, next_bill_ts(ts), user_id),
     )
     await db.commit()
 
 
-async def get_active_proxies_for_billing(db: aiosqlite.Connection) -> List[aiosqlite.Row]:
+async def get_due_proxies_for_billing(db: aiosqlite.Connection, now_ts: int) -> List[aiosqlite.Row]:
+    # Served by the partial idx_proxies_next_bill index: only due rows are read.
     cur = await db.execute(
         "SELECT p.*, u.balance AS user_balance, u.blocked_at AS user_blocked, "
         "u.deleted_at AS user_deleted, u.last_low_balance_warn_at AS user_warn_at, "
         "u.last_warn_24h_at AS user_warn_24h_at, u.last_warn_6h_at AS user_warn_6h_at "
         "FROM proxies p JOIN users u ON u.id = p.user_id "
-        "WHERE p.status = 'active' AND p.deleted_at IS NULL AND u.deleted_at IS NULL"
+        "WHERE p.status = 'active' AND p.deleted_at IS NULL AND p.next_bill_at <= ?",
+        (now_ts,),
+    )
+    return await cur.fetchall()
+
+
+async def count_active_proxies_for_due_users(db: aiosqlite.Connection, now_ts: int) -> Dict[int, int]:
+    cur = await db.execute(
+        "SELECT user_id, COUNT(*) AS cnt FROM proxies "
+        "WHERE status = 'active' AND deleted_at IS NULL AND user_id IN ("
+        "    SELECT user_id FROM proxies WHERE status = 'active' AND deleted_at IS NULL AND next_bill_at <= ?"
+        ") GROUP BY user_id",
+        (now_ts,),
+    )
+    return {row["user_id"]: int(row["cnt"]) for row in await cur.fetchall()}
+
+
+async def get_billing_book_rows(db: aiosqlite.Connection) -> List[aiosqlite.Row]:
+    # (balance, active proxies, users) of everyone billing would charge; users with the same pair share a row.
+    cur = await db.execute(
+        "SELECT balance, active, COUNT(*) AS users FROM ("
+        "    SELECT u.balance AS balance, COUNT(*) AS active FROM proxies p JOIN users u ON u.id = p.user_id "
+        "    WHERE p.status = 'active' AND p.deleted_at IS NULL AND u.deleted_at IS NULL AND u.blocked_at IS NULL "
+        "    GROUP BY p.user_id"
+        ") GROUP BY balance, active"
     )
     return await cur.fetchall()
 
 
+async def count_users_created_since(db: aiosqlite.Connection, since_ts: float) -> int:
+    column, since = epoch_bound("created", since_ts)
+    cur = await db.execute(f"SELECT COUNT(*) AS cnt FROM users WHERE {column} >= ?", (since,))
+    row = await cur.fetchone()
+    return int(row["cnt"])
+
+
+async def get_next_bill_at(db: aiosqlite.Connection) -> Optional[int]:
+    cur = await db.execute(
+        "SELECT MIN(next_bill_at) AS next_at FROM proxies WHERE status = 'active' AND deleted_at IS NULL"
+    )
+    row = await cur.fetchone()
+    return int(row["next_at"]) if row and row["next_at"] is not None else None
+
+
 async def create_payment(
     db: aiosqlite.Connection,
     user_id: int,
     amount: int,
     status: str,
     payload: str,
+    provider: str,
 ) -> int:
+    ts = now_ts()
     cur = await db.execute(
-        "INSERT INTO payments (user_id, amount, status, payload, created_at) VALUES (?, ?, ?, ?, ?)",
-        (user_id, amount, status, payload, now_iso()),
+        "INSERT INTO payments (user_id, amount, status, provider, payload, created_at, created_ts) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (user_id, amount, status, provider, payload, ts_to_iso(ts), ts),
     )
     await db.commit()
     return cur.lastrowid
@@ -331,42 +668,123 @@ async def get_payment_by_provider_id(
     cur = await db.execute(
         "SELECT * FROM payments WHERE provider_payment_id = ?", (provider_payment_id,)
     )
-    return await cur.fetchone()
+    row = await cur.fetchone()
+    if row is None:
+        cur = await db.execute(
+            "SELECT * FROM payments_archive WHERE provider_payment_id = ?", (provider_payment_id,)
+        )
+        row = await cur.fetchone()
+    return row
 
 
-async def get_payments_sum(db: aiosqlite.Connection, since_iso: str) -> int:
+async def get_payments_sum(db: aiosqlite.Connection, since_ts: float) -> int:
+    column, since = epoch_bound("created", since_ts)
     cur = await db.execute(
-        "SELECT COALESCE(SUM(amount), 0) AS total FROM payments WHERE status = 'paid' AND created_at >= ?",
-        (since_iso,),
+        "SELECT COALESCE(SUM(amount), 0) AS total FROM ("
+        f"SELECT amount FROM payments WHERE status = 'paid' AND {column} >= ? "
+        "UNION ALL "
+        f"SELECT amount FROM payments_archive WHERE status = 'paid' AND {column} >= ?)",
+        (since, since),
     )
     row = await cur.fetchone()
     return int(row["total"])
 
 
-async def list_pending_freekassa_payments(
-    db: aiosqlite.Connection, limit: int = 100
+async def expire_pending_payments(
+    db: aiosqlite.Connection, created_before_ts: float, limit: int = 1000
 ) -> List[aiosqlite.Row]:
+    column, cutoff = epoch_bound("created", created_before_ts)
     cur = await db.execute(
-        "SELECT * FROM payments "
-        "WHERE status = 'pending' AND payload LIKE 'freekassa:%' "
-        "ORDER BY id DESC LIMIT ?",
-        (limit,),
+        "UPDATE payments SET status = 'expired' WHERE id IN ("
+        f"SELECT id FROM payments WHERE status = 'pending' AND {column} < ? LIMIT ?"
+        ") AND status = 'pending' "
+        "RETURNING id, user_id, amount, provider, created_at, created_ts",
+        (cutoff, limit),
     )
-    return await cur.fetchall()
+    rows = await cur.fetchall()
+    await db.commit()
+    return rows
+
+
+async def archive_payments(
+    db: aiosqlite.Connection, created_before_ts: float, batch: int = 5000
+) -> int:
+    """Moves settled payments older than the cutoff to payments_archive, one short transaction per batch."""
+    column, cutoff = epoch_bound("created", created_before_ts)
+    moved = 0
+    while True:
+        if not db.in_transaction:
+            await db.execute("BEGIN IMMEDIATE")
+        try:
+            cur = await db.execute(
+                f"SELECT id FROM payments WHERE status != 'pending' AND {column} < ? LIMIT ?",
+                (cutoff, batch),
+            )
+            ids = [row["id"] for row in await cur.fetchall()]
+            if ids:
+                placeholders = ",".join("?" for _ in ids)
+                await db.execute(
+                    "INSERT OR REPLACE INTO payments_archive "
+                    "(id, user_id, amount, status, provider, provider_payment_id, payload, created_at, created_ts, "
+                    "archived_at) "
+                    "SELECT id, user_id, amount, status, provider, provider_payment_id, payload, created_at, "
+                    "created_ts, ? "
+                    f"FROM payments WHERE id IN ({placeholders})",
+                    (now_iso(), *ids),
+                )
+                await db.execute(f"DELETE FROM payments WHERE id IN ({placeholders})", ids)
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+        moved += len(ids)
+        if len(ids) < batch:
+            return moved
+
+
+# Process-wide copy of the settings table, refreshed as a whole once it is older than the TTL. Writes through
+# set_setting update it immediately; edits made by another worker show up within SETTINGS_CACHE_TTL_SEC.
+_settings_cache: Dict[str, str] = {}
+_settings_cache_at = 0.0
+_settings_version = 0
+
+
+def _settings_cache_ttl() -> float:
+    return runtime.config.settings_cache_ttl_sec if runtime.config is not None else 30.0
+
+
+def invalidate_settings_cache() -> None:
+    global _settings_cache_at
+    _settings_cache_at = 0.0
+
+
+def settings_version() -> int:
+    # Bumped whenever a setting seen by this process changes; lets renderers reuse output built from the map.
+    return _settings_version
 
 
 async def get_settings_map(db: aiosqlite.Connection) -> Dict[str, str]:
+    global _settings_cache, _settings_cache_at, _settings_version
     cur = await db.execute("SELECT key, value FROM settings")
     rows = await cur.fetchall()
-    return {row["key"]: row["value"] for row in rows}
-
-
-async def get_setting(db: aiosqlite.Connection, key: str, default: Optional[str] = None) -> Optional[str]:
-    cur = await db.execute("SELECT value FROM settings WHERE key = ?", (key,))
-    row = await cur.fetchone()
-    if row is None:
-        return default
-    return row["value"]
+    settings = {row["key"]: row["value"] for row in rows}
+    if settings != _settings_cache:
+        _settings_version += 1
+    _settings_cache, _settings_cache_at = dict(settings), time.monotonic()
+    return settings
+
+
+async def get_setting(
+    db: aiosqlite.Connection, key: str, default: Optional[str] = None, cached: bool = True
+) -> Optional[str]:
+    if not cached:
+        # Keys other workers use to signal this one (e.g. mtproxy_restart_requested_at) must not lag by the TTL.
+        cur = await db.execute("SELECT value FROM settings WHERE key = ?", (key,))
+        row = await cur.fetchone()
+        return default if row is None else row["value"]
+    if time.monotonic() - _settings_cache_at >= _settings_cache_ttl():
+        await get_settings_map(db)
+    return _settings_cache.get(key, default)
 
 
 async def set_setting(db: aiosqlite.Connection, key: str, value: str) -> None:
@@ -375,6 +793,10 @@ async def set_setting(db: aiosqlite.Connection, key: str, value: str) -> None:
         (key, value),
     )
     await db.commit()
+    global _settings_version
+    if _settings_cache.get(key) != value:
+        _settings_version += 1
+    _settings_cache[key] = value
 
 
 async def get_open_support_ticket_by_user(
@@ -395,19 +817,21 @@ async def get_support_ticket(db: aiosqlite.Connection, ticket_id: int) -> Option
 
 
 async def create_support_ticket(db: aiosqlite.Connection, user_id: int) -> int:
-    now = now_iso()
+    ts = now_ts()
+    now = ts_to_iso(ts)
     cur = await db.execute(
-        "INSERT INTO support_tickets(user_id, status, created_at, updated_at) VALUES(?, 'open', ?, ?)",
-        (user_id, now, now),
+        "INSERT INTO support_tickets(user_id, status, created_at, updated_at, updated_ts) VALUES(?, 'open', ?, ?, ?)",
+        (user_id, now, now, ts),
     )
     await db.commit()
     return int(cur.lastrowid)
 
 
 async def set_support_ticket_status(db: aiosqlite.Connection, ticket_id: int, status: str) -> None:
+    ts = now_ts()
     await db.execute(
-        "UPDATE support_tickets SET status = ?, updated_at = ? WHERE id = ?",
-        (status, now_iso(), ticket_id),
+        "UPDATE support_tickets SET status = ?, updated_at = ?, updated_ts = ? WHERE id = ?",
+        (status, ts_to_iso(ts), ts, ticket_id),
     )
     await db.commit()
 
@@ -415,19 +839,20 @@ async def set_support_ticket_status(db: aiosqlite.Connection, ticket_id: int, st
 async def set_support_ticket_assignee(
     db: aiosqlite.Connection, ticket_id: int, admin_tg_id: int | None
 ) -> None:
+    ts = now_ts()
     await db.execute(
-        "UPDATE support_tickets SET assigned_admin_tg_id = ?, updated_at = ? WHERE id = ?",
-        (admin_tg_id, now_iso(), ticket_id),
+        "UPDATE support_tickets SET assigned_admin_tg_id = ?, updated_at = ?, updated_ts = ? WHERE id = ?",
+        (admin_tg_id, ts_to_iso(ts), ts, ticket_id),
     )
     await db.commit()
 
 
 async def update_support_ticket_sla_alert_at(
-    db: aiosqlite.Connection, ticket_id: int, value: str
+    db: aiosqlite.Connection, ticket_id: int, ts: Optional[int]
 ) -> None:
     await db.execute(
-        "UPDATE support_tickets SET last_sla_alert_at = ? WHERE id = ?",
-        (value, ticket_id),
+        "UPDATE support_tickets SET last_sla_alert_at = ?, last_sla_alert_ts = ? WHERE id = ?",
+        (ts_to_iso(ts) if ts is not None else None, ts, ticket_id),
     )
     await db.commit()
 
@@ -439,15 +864,16 @@ async def add_support_message(
     sender_id: int,
     message: str,
 ) -> None:
-    now = now_iso()
+    ts = now_ts()
+    now = ts_to_iso(ts)
     await db.execute(
         "INSERT INTO support_messages(ticket_id, sender_role, sender_id, message, created_at) "
         "VALUES(?, ?, ?, ?, ?)",
         (ticket_id, sender_role, sender_id, message, now),
     )
     await db.execute(
-        "UPDATE support_tickets SET updated_at = ? WHERE id = ?",
-        (now, ticket_id),
+        "UPDATE support_tickets SET updated_at = ?, updated_ts = ? WHERE id = ?",
+        (now, ts, ticket_id),
     )
     await db.commit()
 
@@ -455,6 +881,7 @@ async def add_support_message(
 async def list_support_tickets(
     db: aiosqlite.Connection, status: str | None = "open", limit: int = 20, offset: int = 0
 ) -> List[aiosqlite.Row]:
+    await sync_pending_writes()
     query = (
         "SELECT t.*, u.tg_id, u.username, au.username AS assigned_admin_username "
         "FROM support_tickets t "
@@ -483,20 +910,92 @@ async def list_support_messages(
     return rows
 
 
-async def list_overdue_support_tickets(
-    db: aiosqlite.Connection, older_than_iso: str
-) -> List[aiosqlite.Row]:
+async def get_support_ticket_for_sla(db: aiosqlite.Connection, ticket_id: int) -> Optional[aiosqlite.Row]:
+    await sync_pending_writes()
     cur = await db.execute(
         "SELECT t.*, u.tg_id, u.username, au.username AS assigned_admin_username "
         "FROM support_tickets t "
         "JOIN users u ON u.id = t.user_id "
         "LEFT JOIN users au ON au.tg_id = t.assigned_admin_tg_id "
-        "WHERE t.status = 'waiting_admin' AND t.updated_at <= ?",
-        (older_than_iso,),
+        "WHERE t.id = ?",
+        (ticket_id,),
     )
+    return await cur.fetchone()
+
+
+async def schedule_task(
+    db: aiosqlite.Connection,
+    kind: str,
+    entity_id: int,
+    due_at: float,
+    payload: Optional[str] = None,
+) -> None:
+    await db.execute(
+        "INSERT INTO scheduled_tasks(kind, entity_id, due_at, payload, attempts, created_at) "
+        "VALUES(?, ?, ?, ?, 0, ?) "
+        "ON CONFLICT(kind, entity_id) DO UPDATE SET due_at = excluded.due_at, payload = excluded.payload, attempts = 0",
+        (kind, entity_id, due_at, payload, now_iso()),
+    )
+    await db.commit()
+
+
+async def cancel_task(db: aiosqlite.Connection, kind: str, entity_id: int) -> None:
+    await db.execute("DELETE FROM scheduled_tasks WHERE kind = ? AND entity_id = ?", (kind, entity_id))
+    await db.commit()
+
+
+async def get_scheduled_task(db: aiosqlite.Connection, kind: str, entity_id: int) -> Optional[aiosqlite.Row]:
+    cur = await db.execute("SELECT * FROM scheduled_tasks WHERE kind = ? AND entity_id = ?", (kind, entity_id))
+    return await cur.fetchone()
+
+
+async def list_scheduled_tasks_until(
+    db: aiosqlite.Connection, until: float, limit: int, kind: Optional[str] = None
+) -> List[aiosqlite.Row]:
+    if kind is None:
+        cur = await db.execute(
+            "SELECT * FROM scheduled_tasks WHERE due_at <= ? ORDER BY due_at LIMIT ?",
+            (until, limit),
+        )
+    else:
+        cur = await db.execute(
+            "SELECT * FROM scheduled_tasks WHERE due_at <= ? AND kind = ? ORDER BY due_at LIMIT ?",
+            (until, kind, limit),
+        )
     return await cur.fetchall()
 
 
+async def finish_scheduled_task(db: aiosqlite.Connection, task_id: int, due_at: float) -> None:
+    # A handler (or another worker) that rescheduled the task moved due_at, so this leaves it alone.
+    await db.execute("DELETE FROM scheduled_tasks WHERE id = ? AND due_at = ?", (task_id, due_at))
+    await db.commit()
+
+
+async def retry_scheduled_task(
+    db: aiosqlite.Connection, task_id: int, due_at: float, retry_at: float
+) -> None:
+    await db.execute(
+        "UPDATE scheduled_tasks SET due_at = ?, attempts = attempts + 1 WHERE id = ? AND due_at = ?",
+        (retry_at, task_id, due_at),
+    )
+    await db.commit()
+
+
+async def backfill_scheduled_tasks(db: aiosqlite.Connection, due_at: float) -> None:
+    """Registers deadlines for rows that predate the scheduler; handlers settle the real due time."""
+    await db.execute(
+        "INSERT OR IGNORE INTO scheduled_tasks(kind, entity_id, due_at, created_at) "
+        "SELECT 'freekassa_poll', id, ?, ? FROM payments WHERE status = 'pending' AND provider = 'freekassa'",
+        (due_at, now_iso()),
+    )
+    await db.execute(
+        "INSERT OR IGNORE INTO scheduled_tasks(kind, entity_id, due_at, created_at) "
+        "SELECT 'support_sla', id, ?, ? FROM support_tickets WHERE status = 'waiting_admin'",
+        (due_at, now_iso()),
+    )
+    await db.commit()
+
+
 async def insert_processed_update(db: aiosqlite.Connection, update_id: int) -> bool:
     cur = await db.execute(
         "INSERT OR IGNORE INTO processed_updates(update_id, created_at) VALUES(?, ?)",
@@ -553,6 +1052,10 @@ async def create_referral_event(
 
 
 async def record_referral_click(db: aiosqlite.Connection, link_code: str, tg_id: int) -> None:
+    if runtime.write_behind:
+        # First click wins, as with INSERT OR IGNORE.
+        _pending_clicks.setdefault((link_code, tg_id), now_iso())
+        return
     await db.execute(
         "INSERT OR IGNORE INTO referral_clicks(link_code, tg_id, created_at) VALUES(?, ?, ?)",
         (link_code, tg_id, now_iso()),
@@ -561,6 +1064,9 @@ async def record_referral_click(db: aiosqlite.Connection, link_code: str, tg_id:
 
 
 async def get_referral_clicks_count(db: aiosqlite.Connection, link_code: str) -> int:
+    if _pending_clicks:
+        # Clicks are unique per (code, tg_id) in the table, so pending ones are counted by flushing them first.
+        await sync_pending_writes()
     cur = await db.execute(
         "SELECT COUNT(*) AS cnt FROM referral_clicks WHERE link_code = ?",
         (link_code,),
@@ -571,9 +1077,12 @@ async def get_referral_clicks_count(db: aiosqlite.Connection, link_code: str) ->
 
 async def get_referral_paid_sum_by_code(db: aiosqlite.Connection, link_code: str) -> int:
     cur = await db.execute(
-        "SELECT COALESCE(SUM(p.amount), 0) AS total "
-        "FROM payments p JOIN users u ON u.id = p.user_id "
-        "WHERE p.status = 'paid' AND u.referred_by = ?",
+        "SELECT COALESCE(SUM(p.amount), 0) AS total FROM ("
+        "SELECT user_id, amount FROM payments WHERE status = 'paid' "
+        "UNION ALL "
+        "SELECT user_id, amount FROM payments_archive WHERE status = 'paid'"
+        ") p JOIN users u ON u.id = p.user_id "
+        "WHERE u.referred_by = ?",
         (link_code,),
     )
     row = await cur.fetchone()
@@ -636,3 +1145,36 @@ async def create_admin_audit_log(
     )
     await db.commit()
     return int(cur.lastrowid)
+
+
+async def try_acquire_lease(db: aiosqlite.Connection, name: str, holder: str, ttl_sec: float) -> bool:
+    # Single upsert: take the lease if it is free, expired or already ours (renewal).
+    now = time.time()
+    await db.execute(
+        """
+        INSERT INTO leader_lease(name, holder, expires_at, acquired_at) VALUES(?, ?, ?, ?)
+        ON CONFLICT(name) DO UPDATE SET
+            holder = excluded.holder,
+            expires_at = excluded.expires_at,
+            acquired_at = CASE
+                WHEN leader_lease.holder = excluded.holder THEN leader_lease.acquired_at
+                ELSE excluded.acquired_at
+            END
+        WHERE leader_lease.holder = excluded.holder OR leader_lease.expires_at < ?
+        """,
+        (name, holder, now + ttl_sec, now, now),
+    )
+    await db.commit()
+    cur = await db.execute("SELECT holder FROM leader_lease WHERE name = ?", (name,))
+    row = await cur.fetchone()
+    return bool(row and row["holder"] == holder)
+
+
+async def release_lease(db: aiosqlite.Connection, name: str, holder: str) -> None:
+    await db.execute("DELETE FROM leader_lease WHERE name = ? AND holder = ?", (name, holder))
+    await db.commit()
+
+
+async def get_lease(db: aiosqlite.Connection, name: str) -> Optional[aiosqlite.Row]:
+    cur = await db.execute("SELECT * FROM leader_lease WHERE name = ?", (name,))
+    return await cur.fetchone()
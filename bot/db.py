@@ -1,8 +1,18 @@
 from __future__ import annotations
 
 import aiosqlite
+import asyncio
 import os
-from typing import Any, Dict
+import re
+import sqlite3
+import time
+from dataclasses import dataclass
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from bot.runtime import runtime
+from bot.services.db_profiler import db_profiler
+from bot.services.metrics import DB_STATEMENT_SECONDS
 
 DEFAULT_SETTINGS: Dict[str, str] = {
     "proxy_create_price": "100",
@@ -29,192 +39,643 @@ DEFAULT_SETTINGS: Dict[str, str] = {
     "offer_url": "",
     "policy_url": "",
     "support_sla_minutes": "30",
+    "flood_user_budget_per_min": "30",
+    "flood_global_per_sec": "50",
+    "payment_pending_ttl_hours": "48",
+    "payment_expiry_notify": "1",
+    "payment_archive_days": "90",
+    "retention_days": "processed_updates=7,admin_audit_log=365,support_messages=180,referral_clicks=365,proxies=30",
+    "flood_costs": (
+        "proxy:buy=5,proxy:delete_confirm:=3,menu:check=3,fk:pay:=10,fk:check:=5,"
+        "topup:method:=3,admin_export:=10,broadcast:=5,/start=2"
+    ),
+}
+
+
+# Existing balances enter the ledger once, as opening entries, when the ledger table is first created.
+OPENING_LEDGER_SQL = """
+    INSERT OR IGNORE INTO balance_ledger (user_id, kind, delta, idempotency_key, created_at)
+    SELECT id, 'opening', balance, 'opening:' || id, strftime('%Y-%m-%dT%H:%M:%SZ', 'now')
+    FROM users
+    WHERE balance != 0
+"""
+
+
+# Proxies without a due time (pre-existing rows, bulk seeds) are due the midnight after their last charge.
+BACKFILL_NEXT_BILL_SQL = """
+    UPDATE proxies
+    SET next_bill_at = COALESCE(
+        CAST(strftime('%s', date(substr(last_billed_at, 1, 10), '+1 day')) AS INTEGER), 0
+    )
+    WHERE next_bill_at IS NULL
+"""
+
+
+# Payments created before the provider column existed: FreeKassa orders carry a "freekassa:" payload, the rest are Stars.
+BACKFILL_PAYMENT_PROVIDER_SQL = """
+    UPDATE payments
+    SET provider = CASE WHEN payload LIKE 'freekassa:%' THEN 'freekassa' ELSE 'stars' END
+    WHERE provider IS NULL
+"""
+
+
+# Integer epoch shadows of ISO text columns: (table, ISO column, epoch column). New writes set both; rows written
+# before the shadows existed are filled in the background by backfill_epoch_columns, after which range scans
+# switch to the compact integer indexes (runtime.epoch_ts_ready).
+EPOCH_COLUMNS: Tuple[Tuple[str, str, str], ...] = (
+    ("users", "created_at", "created_ts"),
+    ("users", "last_seen_at", "last_seen_ts"),
+    ("proxies", "last_billed_at", "last_billed_ts"),
+    ("payments", "created_at", "created_ts"),
+    ("payments_archive", "created_at", "created_ts"),
+    ("support_tickets", "updated_at", "updated_ts"),
+    ("support_tickets", "last_sla_alert_at", "last_sla_alert_ts"),
+)
+EPOCH_BACKFILL_SETTING = "epoch_ts_backfilled"
+
+
+def epoch_backfill_sql(table: str, where: str = "") -> str:
+    """One UPDATE filling every missing epoch column of `table`; `where` narrows it (e.g. to a rowid range)."""
+    pairs = [(iso, ts) for name, iso, ts in EPOCH_COLUMNS if name == table]
+    assignments = ", ".join(f"{ts} = COALESCE({ts}, CAST(strftime('%s', {iso}) AS INTEGER))" for iso, ts in pairs)
+    missing = " OR ".join(f"({ts} IS NULL AND {iso} IS NOT NULL)" for iso, ts in pairs)
+    return f"UPDATE {table} SET {assignments} WHERE ({missing})" + (f" AND {where}" if where else "")
+
+
+# Whole-table form for offline bulk loads (bench seeders), followed by the done marker.
+EPOCH_BACKFILL_SQL: Tuple[str, ...] = tuple(
+    epoch_backfill_sql(table) for table in dict.fromkeys(name for name, _, _ in EPOCH_COLUMNS)
+)
+EPOCH_BACKFILL_DONE_SQL = f"INSERT OR REPLACE INTO settings(key, value) VALUES('{EPOCH_BACKFILL_SETTING}', '1')"
+
+
+# Applied once when a connection is opened (pooled connections keep them). "safe" is the default because a
+# payment is acknowledged to the provider right after its commit.
+SQLITE_PROFILES: Dict[str, Dict[str, str]] = {
+    # fsync on every commit: a committed transaction survives power loss.
+    "safe": {
+        "synchronous": "FULL",
+        "cache_size": "-16000",
+        "mmap_size": "134217728",
+        "temp_store": "MEMORY",
+        "busy_timeout": "5000",
+        "wal_autocheckpoint": "1000",
+    },
+    # WAL + NORMAL: never corrupts, but the last commits before a power loss may roll back.
+    "balanced": {
+        "synchronous": "NORMAL",
+        "cache_size": "-16000",
+        "mmap_size": "134217728",
+        "temp_store": "MEMORY",
+        "busy_timeout": "5000",
+        "wal_autocheckpoint": "1000",
+    },
+    # No fsync: an OS crash or power loss can corrupt the file. Benchmarks and disposable data only.
+    "fast": {
+        "synchronous": "OFF",
+        "cache_size": "-65536",
+        "mmap_size": "268435456",
+        "temp_store": "MEMORY",
+        "busy_timeout": "10000",
+        "wal_autocheckpoint": "10000",
+    },
 }
+_PRAGMA_KEYS = {"synchronous", "cache_size", "mmap_size", "temp_store", "busy_timeout", "wal_autocheckpoint", "journal_size_limit"}
+_PRAGMA_VALUE = re.compile(r"^-?[A-Za-z0-9]+$")
+
+
+def parse_pragmas(raw: str) -> Dict[str, str]:
+    pragmas: Dict[str, str] = {}
+    for item in (raw or "").split(","):
+        key, sep, value = item.strip().partition("=")
+        key, value = key.strip().lower(), value.strip()
+        if sep and key in _PRAGMA_KEYS and _PRAGMA_VALUE.match(value):
+            pragmas[key] = value
+    return pragmas
+
+
+def sqlite_pragmas() -> Dict[str, str]:
+    config = runtime.config
+    profile = config.sqlite_profile if config else os.getenv("SQLITE_PROFILE", "safe")
+    overrides = config.sqlite_pragmas if config else os.getenv("SQLITE_PRAGMAS", "")
+    pragmas = dict(SQLITE_PROFILES.get(profile, SQLITE_PROFILES["safe"]))
+    pragmas.update(parse_pragmas(overrides))
+    return pragmas
+
+
+def _pool_size() -> int:
+    config = runtime.config
+    return max(0, config.sqlite_pool_size if config else int(os.getenv("SQLITE_POOL_SIZE", "8")))
+
+
+_STATEMENT_KINDS = ("SELECT", "INSERT", "UPDATE", "DELETE", "PRAGMA", "CREATE", "ALTER")
+_kind_cache: Dict[str, str] = {}
+_FETCH_CALLS = {"fetchone", "fetchmany", "fetchall"}
+
+
+def _statement_kind(sql: str) -> str:
+    kind = _kind_cache.get(sql)
+    if kind is not None:
+        return kind
+    head = sql.lstrip()[:6].upper()
+    kind = next((item.lower() for item in _STATEMENT_KINDS if head.startswith(item[:6])), "other")
+    if len(_kind_cache) < 1024:
+        _kind_cache[sql] = kind
+    return kind
+
+
+class TimedConnection(aiosqlite.Connection):
+    """aiosqlite connection that reports every call on its worker thread to metrics.
+
+    Opened through get_db it is pooled: close() hands it back to the idle list instead of closing.
+    """
+
+    _last_record = None
+    _pool_key: Optional[str] = None
+    _idle = False
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        # Idle pooled connections must not keep the process alive at exit.
+        self._thread.daemon = True
+
+    async def close(self) -> None:
+        if self._idle:
+            return
+        if self._pool_key is not None and self._connection is not None and await _release(self):
+            return
+        await super().close()
+
+    async def _execute(self, fn, *args, **kwargs):
+        start = time.perf_counter()
+        sql = args[0] if args and isinstance(args[0], str) else None
+        result = None
+        try:
+            result = await super()._execute(fn, *args, **kwargs)
+            return result
+        finally:
+            elapsed = time.perf_counter() - start
+            if sql is not None:
+                DB_STATEMENT_SECONDS.observe(elapsed, _statement_kind(sql))
+                self._last_record = db_profiler.record(sql, elapsed)
+            else:
+                name = getattr(fn, "__name__", "other")
+                DB_STATEMENT_SECONDS.observe(elapsed, name)
+                if name in _FETCH_CALLS and result is not None:
+                    rows = len(result) if isinstance(result, list) else 1
+                    db_profiler.record_rows(self._last_record, rows)
+
+
+_idle_connections: Dict[str, List[TimedConnection]] = {}
+
+
+async def _release(db: TimedConnection) -> bool:
+    idle = _idle_connections.setdefault(db._pool_key, [])
+    if len(idle) >= _pool_size():
+        return False
+    try:
+        if db.in_transaction:
+            await db.rollback()
+    except Exception:
+        return False
+    db.row_factory = aiosqlite.Row
+    db._idle = True
+    idle.append(db)
+    return True
 
 
 async def get_db(db_path: str) -> aiosqlite.Connection:
+    idle = _idle_connections.get(db_path)
+    while idle:
+        db = idle.pop()
+        if db._connection is not None and db._running:
+            db._idle = False
+            return db
     dir_name = os.path.dirname(db_path)
     if dir_name:
         os.makedirs(dir_name, exist_ok=True)
-    db = await aiosqlite.connect(db_path)
+    # uri=True lets ATTACH take "file:...?mode=ro" (read-only archives); plain paths open as before.
+    db = await TimedConnection(partial(sqlite3.connect, db_path, uri=True), 64)
     db.row_factory = aiosqlite.Row
     await db.execute("PRAGMA foreign_keys = ON;")
+    # Must precede the first write to take effect on a new file; existing DBs switch on their next VACUUM
+    # (scripts/db_retention.py vacuum).
+    await db.execute("PRAGMA auto_vacuum = INCREMENTAL;")
     await db.execute("PRAGMA journal_mode = WAL;")
+    for key, value in sqlite_pragmas().items():
+        await db.execute(f"PRAGMA {key} = {value};")
+    if _pool_size() > 0:
+        db._pool_key = db_path
     return db
 
 
-async def init_db(db: aiosqlite.Connection) -> None:
-    await db.executescript(
-        """
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY,
-            tg_id INTEGER UNIQUE NOT NULL,
-            username TEXT,
-            ref_code TEXT,
-            balance INTEGER NOT NULL DEFAULT 0,
-            created_at TEXT NOT NULL,
-            last_seen_at TEXT,
-            last_menu_message_id INTEGER,
-            last_low_balance_warn_at TEXT,
-            referred_by TEXT,
-            blocked_at TEXT,
-            deleted_at TEXT
-        );
-
-        CREATE TABLE IF NOT EXISTS proxies (
-            id INTEGER PRIMARY KEY,
-            user_id INTEGER NOT NULL,
-            login TEXT NOT NULL UNIQUE,
-            password TEXT NOT NULL,
-            ip TEXT NOT NULL,
-            port INTEGER NOT NULL,
-            status TEXT NOT NULL,
-            is_free INTEGER NOT NULL DEFAULT 0,
-            mtproto_secret TEXT,
-            created_at TEXT NOT NULL,
-            last_billed_at TEXT,
-            deleted_at TEXT,
-            FOREIGN KEY(user_id) REFERENCES users(id)
-        );
-
-        CREATE TABLE IF NOT EXISTS payments (
-            id INTEGER PRIMARY KEY,
-            user_id INTEGER NOT NULL,
-            amount INTEGER NOT NULL,
-            status TEXT NOT NULL,
-            provider_payment_id TEXT,
-            payload TEXT,
-            created_at TEXT NOT NULL,
-            FOREIGN KEY(user_id) REFERENCES users(id)
-        );
-
-        CREATE TABLE IF NOT EXISTS referral_links (
-            id INTEGER PRIMARY KEY,
-            code TEXT UNIQUE NOT NULL,
-            name TEXT,
-            owner_user_id INTEGER,
-            bonus_inviter INTEGER NOT NULL DEFAULT 0,
-            bonus_invited INTEGER NOT NULL DEFAULT 0,
-            limit_total INTEGER,
-            limit_per_user INTEGER,
-            created_at TEXT NOT NULL,
-            disabled_at TEXT,
-            FOREIGN KEY(owner_user_id) REFERENCES users(id)
-        );
-
-        CREATE TABLE IF NOT EXISTS referral_events (
-            id INTEGER PRIMARY KEY,
-            inviter_user_id INTEGER NOT NULL,
-            invited_user_id INTEGER NOT NULL,
-            link_code TEXT NOT NULL,
-            bonus_inviter INTEGER NOT NULL,
-            bonus_invited INTEGER NOT NULL,
-            created_at TEXT NOT NULL,
-            FOREIGN KEY(inviter_user_id) REFERENCES users(id),
-            FOREIGN KEY(invited_user_id) REFERENCES users(id)
-        );
-
-        CREATE TABLE IF NOT EXISTS referral_clicks (
-            id INTEGER PRIMARY KEY,
-            link_code TEXT NOT NULL,
-            tg_id INTEGER NOT NULL,
-            created_at TEXT NOT NULL,
-            UNIQUE(link_code, tg_id)
-        );
-
-        CREATE TABLE IF NOT EXISTS support_tickets (
-            id INTEGER PRIMARY KEY,
-            user_id INTEGER NOT NULL,
-            status TEXT NOT NULL,
-            assigned_admin_tg_id INTEGER,
-            last_sla_alert_at TEXT,
-            created_at TEXT NOT NULL,
-            updated_at TEXT NOT NULL,
-            FOREIGN KEY(user_id) REFERENCES users(id)
-        );
-
-        CREATE TABLE IF NOT EXISTS support_messages (
-            id INTEGER PRIMARY KEY,
-            ticket_id INTEGER NOT NULL,
-            sender_role TEXT NOT NULL,
-            sender_id INTEGER NOT NULL,
-            message TEXT NOT NULL,
-            created_at TEXT NOT NULL,
-            FOREIGN KEY(ticket_id) REFERENCES support_tickets(id)
-        );
-
-        CREATE TABLE IF NOT EXISTS settings (
-            key TEXT PRIMARY KEY,
-            value TEXT NOT NULL
-        );
-
-        CREATE TABLE IF NOT EXISTS processed_updates (
-            id INTEGER PRIMARY KEY,
-            update_id INTEGER UNIQUE NOT NULL,
-            created_at TEXT NOT NULL
-        );
-
-        CREATE TABLE IF NOT EXISTS admin_audit_log (
-            id INTEGER PRIMARY KEY,
-            admin_tg_id INTEGER NOT NULL,
-            action TEXT NOT NULL,
-            target_type TEXT,
-            target_id TEXT,
-            details TEXT,
-            created_at TEXT NOT NULL
-        );
-
-        CREATE INDEX IF NOT EXISTS idx_users_tg_id ON users(tg_id);
-        CREATE UNIQUE INDEX IF NOT EXISTS idx_users_ref_code ON users(ref_code);
-        CREATE INDEX IF NOT EXISTS idx_proxies_user_id ON proxies(user_id);
-        CREATE INDEX IF NOT EXISTS idx_payments_user_id ON payments(user_id);
-        CREATE INDEX IF NOT EXISTS idx_referral_events_inviter ON referral_events(inviter_user_id);
-        CREATE INDEX IF NOT EXISTS idx_referral_events_invited ON referral_events(invited_user_id);
-        CREATE INDEX IF NOT EXISTS idx_referral_links_code ON referral_links(code);
-        CREATE INDEX IF NOT EXISTS idx_referral_clicks_code ON referral_clicks(link_code);
-        CREATE INDEX IF NOT EXISTS idx_admin_audit_created ON admin_audit_log(created_at);
-        CREATE INDEX IF NOT EXISTS idx_support_tickets_user ON support_tickets(user_id);
-        CREATE INDEX IF NOT EXISTS idx_support_tickets_status ON support_tickets(status);
-        CREATE INDEX IF NOT EXISTS idx_support_messages_ticket ON support_messages(ticket_id);
-        """
-    )
-    await db.commit()
+async def close_pool() -> None:
+    for idle in _idle_connections.values():
+        while idle:
+            db = idle.pop()
+            db._idle = False
+            db._pool_key = None
+            await db.close()
+
+
+async def checkpoint_wal(db: aiosqlite.Connection, mode: str = "PASSIVE") -> Tuple[int, int, int]:
+    """Returns (busy, wal frames, frames checkpointed) from PRAGMA wal_checkpoint."""
+    cur = await db.execute(f"PRAGMA wal_checkpoint({mode});")
+    row = await cur.fetchone()
+    return int(row[0]), int(row[1]), int(row[2])
+
+
+# Schema as of migration 1 for a fresh file (later columns included); existing files get the ALTERs below.
+BASE_SCHEMA_SQL = """
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY,
+        tg_id INTEGER UNIQUE NOT NULL,
+        username TEXT,
+        ref_code TEXT,
+        balance INTEGER NOT NULL DEFAULT 0,
+        created_at TEXT NOT NULL,
+        last_seen_at TEXT,
+        created_ts INTEGER,
+        last_seen_ts INTEGER,
+        last_menu_message_id INTEGER,
+        last_low_balance_warn_at TEXT,
+        referred_by TEXT,
+        blocked_at TEXT,
+        deleted_at TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS proxies (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        login TEXT NOT NULL UNIQUE,
+        password TEXT NOT NULL,
+        ip TEXT NOT NULL,
+        port INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        is_free INTEGER NOT NULL DEFAULT 0,
+        mtproto_secret TEXT,
+        created_at TEXT NOT NULL,
+        last_billed_at TEXT,
+        last_billed_ts INTEGER,
+        next_bill_at INTEGER,
+        deleted_at TEXT,
+        FOREIGN KEY(user_id) REFERENCES users(id)
+    );
+
+    CREATE TABLE IF NOT EXISTS payments (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        amount INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        provider TEXT,
+        provider_payment_id TEXT,
+        payload TEXT,
+        created_at TEXT NOT NULL,
+        created_ts INTEGER,
+        FOREIGN KEY(user_id) REFERENCES users(id)
+    );
+
+    CREATE TABLE IF NOT EXISTS payments_archive (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        amount INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        provider TEXT,
+        provider_payment_id TEXT,
+        payload TEXT,
+        created_at TEXT NOT NULL,
+        created_ts INTEGER,
+        archived_at TEXT NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS referral_links (
+        id INTEGER PRIMARY KEY,
+        code TEXT UNIQUE NOT NULL,
+        name TEXT,
+        owner_user_id INTEGER,
+        bonus_inviter INTEGER NOT NULL DEFAULT 0,
+        bonus_invited INTEGER NOT NULL DEFAULT 0,
+        limit_total INTEGER,
+        limit_per_user INTEGER,
+        created_at TEXT NOT NULL,
+        disabled_at TEXT,
+        FOREIGN KEY(owner_user_id) REFERENCES users(id)
+    );
+
+    CREATE TABLE IF NOT EXISTS referral_events (
+        id INTEGER PRIMARY KEY,
+        inviter_user_id INTEGER NOT NULL,
+        invited_user_id INTEGER NOT NULL,
+        link_code TEXT NOT NULL,
+        bonus_inviter INTEGER NOT NULL,
+        bonus_invited INTEGER NOT NULL,
+        created_at TEXT NOT NULL,
+        FOREIGN KEY(inviter_user_id) REFERENCES users(id),
+        FOREIGN KEY(invited_user_id) REFERENCES users(id)
+    );
+
+    CREATE TABLE IF NOT EXISTS referral_clicks (
+        id INTEGER PRIMARY KEY,
+        link_code TEXT NOT NULL,
+        tg_id INTEGER NOT NULL,
+        created_at TEXT NOT NULL,
+        UNIQUE(link_code, tg_id)
+    );
+
+    CREATE TABLE IF NOT EXISTS support_tickets (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        assigned_admin_tg_id INTEGER,
+        last_sla_alert_at TEXT,
+        created_at TEXT NOT NULL,
+        updated_at TEXT NOT NULL,
+        updated_ts INTEGER,
+        last_sla_alert_ts INTEGER,
+        FOREIGN KEY(user_id) REFERENCES users(id)
+    );
+
+    CREATE TABLE IF NOT EXISTS support_messages (
+        id INTEGER PRIMARY KEY,
+        ticket_id INTEGER NOT NULL,
+        sender_role TEXT NOT NULL,
+        sender_id INTEGER NOT NULL,
+        message TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        FOREIGN KEY(ticket_id) REFERENCES support_tickets(id)
+    );
+
+    CREATE TABLE IF NOT EXISTS settings (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS processed_updates (
+        id INTEGER PRIMARY KEY,
+        update_id INTEGER UNIQUE NOT NULL,
+        created_at TEXT NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS admin_audit_log (
+        id INTEGER PRIMARY KEY,
+        admin_tg_id INTEGER NOT NULL,
+        action TEXT NOT NULL,
+        target_type TEXT,
+        target_id TEXT,
+        details TEXT,
+        created_at TEXT NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS leader_lease (
+        name TEXT PRIMARY KEY,
+        holder TEXT NOT NULL,
+        expires_at REAL NOT NULL,
+        acquired_at REAL NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS balance_ledger (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        delta INTEGER NOT NULL,
+        idempotency_key TEXT UNIQUE,
+        ref TEXT,
+        created_at TEXT NOT NULL,
+        FOREIGN KEY(user_id) REFERENCES users(id)
+    );
+
+    CREATE TABLE IF NOT EXISTS scheduled_tasks (
+        id INTEGER PRIMARY KEY,
+        kind TEXT NOT NULL,
+        entity_id INTEGER NOT NULL,
+        due_at REAL NOT NULL,
+        payload TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        created_at TEXT NOT NULL,
+        UNIQUE(kind, entity_id)
+    );
+
+    CREATE TABLE IF NOT EXISTS balance_checkpoints (
+        user_id INTEGER PRIMARY KEY,
+        balance INTEGER NOT NULL,
+        checked_at TEXT NOT NULL
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_users_tg_id ON users(tg_id);
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_users_ref_code ON users(ref_code);
+    CREATE INDEX IF NOT EXISTS idx_proxies_user_id ON proxies(user_id);
+    CREATE INDEX IF NOT EXISTS idx_payments_user_id ON payments(user_id);
+    CREATE INDEX IF NOT EXISTS idx_payments_archive_user ON payments_archive(user_id);
+    CREATE INDEX IF NOT EXISTS idx_payments_archive_created ON payments_archive(created_at);
+    CREATE INDEX IF NOT EXISTS idx_payments_archive_provider_id ON payments_archive(provider_payment_id);
+    CREATE INDEX IF NOT EXISTS idx_referral_events_inviter ON referral_events(inviter_user_id);
+    CREATE INDEX IF NOT EXISTS idx_referral_events_invited ON referral_events(invited_user_id);
+    CREATE INDEX IF NOT EXISTS idx_referral_links_code ON referral_links(code);
+    CREATE INDEX IF NOT EXISTS idx_referral_clicks_code ON referral_clicks(link_code);
+    CREATE INDEX IF NOT EXISTS idx_admin_audit_created ON admin_audit_log(created_at);
+    CREATE INDEX IF NOT EXISTS idx_processed_updates_created ON processed_updates(created_at);
+    CREATE INDEX IF NOT EXISTS idx_referral_clicks_created ON referral_clicks(created_at);
+    CREATE INDEX IF NOT EXISTS idx_proxies_deleted ON proxies(deleted_at) WHERE deleted_at IS NOT NULL;
+    CREATE INDEX IF NOT EXISTS idx_support_tickets_user ON support_tickets(user_id);
+    CREATE INDEX IF NOT EXISTS idx_support_tickets_status ON support_tickets(status);
+    CREATE INDEX IF NOT EXISTS idx_support_messages_ticket ON support_messages(ticket_id);
+    CREATE INDEX IF NOT EXISTS idx_balance_ledger_user ON balance_ledger(user_id, id);
+    CREATE INDEX IF NOT EXISTS idx_scheduled_tasks_due ON scheduled_tasks(due_at);
+"""
+
+EPOCH_INDEX_SQL: Tuple[str, ...] = (
+    "CREATE INDEX IF NOT EXISTS idx_users_created_ts ON users(created_ts)",
+    "CREATE INDEX IF NOT EXISTS idx_users_last_seen_ts ON users(last_seen_ts)",
+    "CREATE INDEX IF NOT EXISTS idx_payments_created_ts ON payments(created_ts)",
+    "CREATE INDEX IF NOT EXISTS idx_payments_pending_ts ON payments(created_ts) WHERE status = 'pending'",
+    "CREATE INDEX IF NOT EXISTS idx_payments_archive_created_ts ON payments_archive(created_ts)",
+)
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    apply: Callable[[aiosqlite.Connection], Awaitable[Any]]
+
+
+async def _migrate_base_schema(db: aiosqlite.Connection) -> None:
+    cur = await db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'balance_ledger'")
+    ledger_exists = await cur.fetchone() is not None
+    # executescript() would commit mid-migration, so the statements go one by one (the schema has no ';' inside).
+    for statement in BASE_SCHEMA_SQL.split(";"):
+        if statement.strip():
+            await db.execute(statement)
+    if not ledger_exists:
+        await db.execute(OPENING_LEDGER_SQL)
+
+
+async def _migrate_added_columns(db: aiosqlite.Connection) -> None:
     await _ensure_column(db, "users", "last_menu_message_id", "last_menu_message_id INTEGER")
     await _ensure_column(db, "users", "last_low_balance_warn_at", "last_low_balance_warn_at TEXT")
     await _ensure_column(db, "users", "last_warn_24h_at", "last_warn_24h_at TEXT")
     await _ensure_column(db, "users", "last_warn_6h_at", "last_warn_6h_at TEXT")
     await _ensure_column(db, "proxies", "mtproto_secret", "mtproto_secret TEXT")
-    await _ensure_column(
-        db,
-        "support_tickets",
-        "assigned_admin_tg_id",
-        "assigned_admin_tg_id INTEGER",
+    await _ensure_column(db, "support_tickets", "assigned_admin_tg_id", "assigned_admin_tg_id INTEGER")
+    await _ensure_column(db, "support_tickets", "last_sla_alert_at", "last_sla_alert_at TEXT")
+
+
+async def _migrate_next_bill_at(db: aiosqlite.Connection) -> None:
+    if await _ensure_column(db, "proxies", "next_bill_at", "next_bill_at INTEGER"):
+        await db.execute(BACKFILL_NEXT_BILL_SQL)
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_proxies_next_bill ON proxies(next_bill_at) "
+        "WHERE status = 'active' AND deleted_at IS NULL"
     )
-    await _ensure_column(
-        db,
-        "support_tickets",
-        "last_sla_alert_at",
-        "last_sla_alert_at TEXT",
+
+
+async def _migrate_payment_provider(db: aiosqlite.Connection) -> None:
+    if await _ensure_column(db, "payments", "provider", "provider TEXT"):
+        await db.execute(BACKFILL_PAYMENT_PROVIDER_SQL)
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_payments_pending ON payments(provider, created_at) "
+        "WHERE status = 'pending'"
     )
 
 
+async def _migrate_epoch_columns(db: aiosqlite.Connection) -> None:
+    added = [await _ensure_column(db, table, column, f"{column} INTEGER") for table, _, column in EPOCH_COLUMNS]
+    if any(added):
+        # A new shadow column starts empty: integer range scans wait for the next backfill pass.
+        await db.execute("DELETE FROM settings WHERE key = ?", (EPOCH_BACKFILL_SETTING,))
+
+
+async def _migrate_drop_legacy_settings(db: aiosqlite.Connection) -> None:
+    await db.execute("DELETE FROM settings WHERE key IN ('mtproto_secret', 'socks_enabled')")
+
+
+# Applied in order at startup, each in its own transaction together with PRAGMA user_version. Every step must
+# stay cheap (DDL, small UPDATEs): databases from before versioning start at 0 and replay all of them, which
+# is why the steps are idempotent. Append new ones; never renumber or edit applied ones.
+MIGRATIONS: Tuple[Migration, ...] = (
+    Migration(1, "base_schema", _migrate_base_schema),
+    Migration(2, "added_columns", _migrate_added_columns),
+    Migration(3, "proxies_next_bill_at", _migrate_next_bill_at),
+    Migration(4, "payments_provider", _migrate_payment_provider),
+    Migration(5, "epoch_columns", _migrate_epoch_columns),
+    Migration(6, "drop_legacy_settings", _migrate_drop_legacy_settings),
+)
+SCHEMA_VERSION = MIGRATIONS[-1].version
+
+
+async def epoch_backfill_done(db: aiosqlite.Connection) -> bool:
+    cur = await db.execute("SELECT value FROM settings WHERE key = ?", (EPOCH_BACKFILL_SETTING,))
+    row = await cur.fetchone()
+    return row is not None and row["value"] == "1"
+
+
+async def backfill_epoch_columns(db: aiosqlite.Connection, batch: int = 5000, pause: float = 0.02) -> int:
+    """Fills missing epoch columns in short rowid-range transactions so live writers keep getting the lock.
+
+    Rows past the starting max rowid are written with both columns, so one pass finishes the job; an
+    interrupted pass is simply repeated (already filled rows are skipped). Returns the rows updated.
+    """
+    updated = 0
+    for table in dict.fromkeys(name for name, _, _ in EPOCH_COLUMNS):
+        cur = await db.execute(f"SELECT COALESCE(MAX(rowid), 0) FROM {table}")
+        max_rowid = (await cur.fetchone())[0]
+        sql = epoch_backfill_sql(table, "rowid > ? AND rowid <= ?")
+        for start in range(0, max_rowid, batch):
+            cur = await db.execute(sql, (start, start + batch))
+            updated += cur.rowcount
+            await db.commit()
+            if pause:
+                await asyncio.sleep(pause)
+    await db.execute(EPOCH_BACKFILL_DONE_SQL)
+    await db.commit()
+    runtime.epoch_ts_ready = True
+    return updated
+
+
+async def _create_epoch_indexes(db: aiosqlite.Connection) -> None:
+    for statement in EPOCH_INDEX_SQL:
+        await db.execute(statement)
+        await db.commit()
+
+
+# Index builds and backfills on big tables: run by the leader after startup (run_deferred_migrations), each
+# managing its own short transactions. Progress is kept in settings[DEFERRED_VERSION_SETTING].
+DEFERRED_MIGRATIONS: Tuple[Migration, ...] = (
+    Migration(1, "epoch_ts_indexes", _create_epoch_indexes),
+    Migration(2, "epoch_ts_backfill", backfill_epoch_columns),
+)
+DEFERRED_VERSION = DEFERRED_MIGRATIONS[-1].version
+DEFERRED_VERSION_SETTING = "schema_deferred_version"
+
+
+async def schema_version(db: aiosqlite.Connection) -> int:
+    cur = await db.execute("PRAGMA user_version")
+    return int((await cur.fetchone())[0])
+
+
+async def init_db(db: aiosqlite.Connection) -> List[str]:
+    """Applies pending MIGRATIONS; on an up-to-date file this is a single PRAGMA read. Returns applied names."""
+    if await schema_version(db) >= SCHEMA_VERSION:
+        return []
+    applied: List[str] = []
+    for migration in MIGRATIONS:
+        if db.in_transaction:
+            await db.commit()
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            # Re-read under the write lock: another worker starting at the same time may have applied it.
+            if await schema_version(db) >= migration.version:
+                await db.rollback()
+                continue
+            await migration.apply(db)
+            await db.execute(f"PRAGMA user_version = {migration.version}")
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+        applied.append(migration.name)
+    return applied
+
+
 async def _ensure_column(
     db: aiosqlite.Connection, table: str, column: str, ddl: str
-) -> None:
+) -> bool:
     cur = await db.execute(f"PRAGMA table_info({table})")
     rows = await cur.fetchall()
     cols = {row["name"] for row in rows}
     if column in cols:
-        return
+        return False
     await db.execute(f"ALTER TABLE {table} ADD COLUMN {ddl}")
-    await db.commit()
+    return True
 
 
-async def ensure_default_settings(db: aiosqlite.Connection) -> None:
-    await db.execute("DELETE FROM settings WHERE key IN ('mtproto_secret', 'socks_enabled')")
-    for key, value in DEFAULT_SETTINGS.items():
+async def deferred_version(db: aiosqlite.Connection) -> int:
+    cur = await db.execute("SELECT value FROM settings WHERE key = ?", (DEFERRED_VERSION_SETTING,))
+    row = await cur.fetchone()
+    try:
+        return int(row["value"]) if row else 0
+    except ValueError:
+        return 0
+
+
+async def run_deferred_migrations(db: aiosqlite.Connection) -> List[str]:
+    applied: List[str] = []
+    for migration in DEFERRED_MIGRATIONS:
+        if await deferred_version(db) >= migration.version:
+            continue
+        await migration.apply(db)
         await db.execute(
-            "INSERT OR IGNORE INTO settings(key, value) VALUES(?, ?)",
-            (key, value),
+            "INSERT INTO settings(key, value) VALUES(?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (DEFERRED_VERSION_SETTING, str(migration.version)),
         )
+        await db.commit()
+        applied.append(migration.name)
+    return applied
+
+
+async def ensure_default_settings(db: aiosqlite.Connection) -> None:
+    await db.executemany(
+        "INSERT OR IGNORE INTO settings(key, value) VALUES(?, ?)",
+        list(DEFAULT_SETTINGS.items()),
+    )
     await db.commit()
@@ -2,18 +2,19 @@ from __future__ import annotations
 
 import csv
 import io
-from datetime import datetime, timedelta
 import asyncio
 import os
 import re
+import time
 from pathlib import Path
 
 from aiogram import Router, F
-from aiogram.filters import Command, StateFilter
+from aiogram.filters import Command, CommandObject, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.types import Message, CallbackQuery, BufferedInputFile
 
 from bot import dao
+from bot.callback_routes import CallbackRoutes
 from bot.db import get_db
 from bot.handlers.states import AdminStates
 from bot.keyboards import (
@@ -27,6 +28,7 @@ from bot.keyboards import (
     admin_ref_delete_confirm_kb,
     mtproxy_status_kb,
     freekassa_status_kb,
+    perf_report_kb,
     admin_users_kb,
     admin_users_list_kb,
     admin_export_kb,
@@ -37,12 +39,19 @@ from bot.keyboards import (
     support_user_close_kb,
 )
 from bot.runtime import runtime
-from bot.ui import send_or_edit_bg_message, send_bg_to_user
+from bot.ui import get_bot_info, send_or_edit_bg_message, send_bg_to_user
 from bot.services.mtproto import sync_mtproto_secrets, reenable_proxies_for_user
 from bot.services.freekassa import get_currencies
+from bot.services.flood_control import SETTING_KEYS as FLOOD_SETTING_KEYS, reload_policy
+from bot.services.db_profiler import db_profiler
+from bot.services.forecast import FORECAST_SETTINGS, Forecast, load_book, load_params, simulate
+from bot.services.loop_monitor import loop_monitor
+from bot.services.scheduler import SUPPORT_SLA, scheduler
+from bot.services.metrics import LOOP_LAG_SECONDS
 from bot.services.settings import get_int_setting
 
 router = Router()
+callbacks = CallbackRoutes(router)
 
 
 def _is_admin(user_id: int) -> bool:
@@ -66,6 +75,7 @@ async def _safe_edit(call: CallbackQuery, text: str, reply_markup=None, parse_mo
         reply_markup=reply_markup,
         parse_mode=parse_mode,
         message_id=call.message.message_id,
+        current=call.message,
     )
 
 
@@ -123,6 +133,13 @@ def _settings_text(settings_map: dict[str, str]) -> str:
         f"MTProto: {onoff('mtproto_enabled', '1')}",
         f"MTProto host: {val('mtproto_host', '') or '—'}",
         f"MTProto port: {val('mtproto_port', '9443')}",
+        f"Антифлуд: {val('flood_user_budget_per_min', '30')} ед./мин на пользователя, "
+        f"{val('flood_global_per_sec', '50')} апдейтов/с всего",
+        f"Веса действий: {val('flood_costs', '') or '—'}",
+        f"Срок неоплаченного платежа: {val('payment_pending_ttl_hours', '48')} ч",
+        f"Уведомлять об истечении: {onoff('payment_expiry_notify', '1')}",
+        f"Архив платежей старше: {val('payment_archive_days', '90')} дн.",
+        f"Хранение (дней): {val('retention_days', '') or '—'}",
     ]
     return "\n".join(lines)
 
@@ -346,7 +363,7 @@ async def admin_start(message: Message, state: FSMContext) -> None:
     await _admin_send_or_edit(message, "Админка", reply_markup=admin_menu_inline_kb())
 
 
-@router.callback_query(F.data == "menu:admin")
+@callbacks.exact("menu:admin")
 async def admin_menu(call: CallbackQuery, state: FSMContext) -> None:
     if not _is_admin(call.from_user.id):
         return
@@ -355,7 +372,46 @@ async def admin_menu(call: CallbackQuery, state: FSMContext) -> None:
     await _safe_edit(call, "Админка", reply_markup=admin_menu_inline_kb())
 
 
-@router.callback_query(F.data == "admin:stats")
+async def _admin_stats_text(db) -> str:
+    total_users = await dao.count_users(db)
+    active_7 = await dao.count_active_users(db, 7)
+    active_proxies = await dao.count_active_proxies(db)
+
+    now = time.time()
+    sum_day = await dao.get_payments_sum(db, now - 86400)
+    sum_week = await dao.get_payments_sum(db, now - 7 * 86400)
+    sum_month = await dao.get_payments_sum(db, now - 30 * 86400)
+
+    avg_balance = 0
+    cur = await db.execute("SELECT AVG(balance) AS avg_balance FROM users WHERE deleted_at IS NULL")
+    row = await cur.fetchone()
+    if row and row["avg_balance"] is not None:
+        avg_balance = int(row["avg_balance"])
+
+    cur = await db.execute(
+        "SELECT COUNT(*) AS cnt FROM proxies WHERE status = 'disabled' AND deleted_at IS NULL"
+    )
+    row = await cur.fetchone()
+    disabled_count = int(row["cnt"])
+    cur = await db.execute(
+        "SELECT COUNT(DISTINCT user_id) AS cnt FROM proxies WHERE status = 'active' AND deleted_at IS NULL"
+    )
+    row = await cur.fetchone()
+    users_with_active = int(row["cnt"])
+
+    return (
+        "Статистика:\n"
+        f"Всего пользователей: {total_users}\n"
+        f"Активные за 7 дней: {active_7}\n"
+        f"Пользователи с активными прокси: {users_with_active}\n"
+        f"Активных прокси: {active_proxies}\n"
+        f"Отключённых прокси: {disabled_count}\n"
+        f"Средний баланс: {avg_balance} ₽\n\n"
+        f"Пополнения: день {sum_day} ₽, неделя {sum_week} ₽, месяц {sum_month} ₽"
+    )
+
+
+@callbacks.exact("admin:stats")
 async def admin_stats(call: CallbackQuery) -> None:
     if not _is_admin(call.from_user.id):
         return
@@ -367,52 +423,109 @@ async def admin_stats(call: CallbackQuery) -> None:
 
     db = await get_db(config.db_path)
     try:
-        total_users = await dao.count_users(db)
-        active_7 = await dao.count_active_users(db, 7)
-        active_proxies = await dao.count_active_proxies(db)
+        text = await _admin_stats_text(db)
+        await _safe_edit(call, text, reply_markup=admin_menu_inline_kb())
+    finally:
+        await db.close()
 
-        since_day = (datetime.utcnow() - timedelta(days=1)).replace(microsecond=0).isoformat() + "Z"
-        since_week = (datetime.utcnow() - timedelta(days=7)).replace(microsecond=0).isoformat() + "Z"
-        since_month = (datetime.utcnow() - timedelta(days=30)).replace(microsecond=0).isoformat() + "Z"
 
-        sum_day = await dao.get_payments_sum(db, since_day)
-        sum_week = await dao.get_payments_sum(db, since_week)
-        sum_month = await dao.get_payments_sum(db, since_month)
+FORECAST_USAGE = (
+    "Прогноз биллинга: /forecast [дней] [ключ=значение ...]\n"
+    f"Ключи: {', '.join(FORECAST_SETTINGS)}\n"
+    "Пример: /forecast 30 proxy_day_price=15 free_credit=30"
+)
 
-        avg_balance = 0
-        cur = await db.execute("SELECT AVG(balance) AS avg_balance FROM users WHERE deleted_at IS NULL")
-        row = await cur.fetchone()
-        if row and row["avg_balance"] is not None:
-            avg_balance = int(row["avg_balance"])
 
-        cur = await db.execute(
-            "SELECT COUNT(*) AS cnt FROM proxies WHERE status = 'disabled' AND deleted_at IS NULL"
-        )
-        row = await cur.fetchone()
-        disabled_count = int(row["cnt"])
-        cur = await db.execute(
-            "SELECT COUNT(DISTINCT user_id) AS cnt FROM proxies WHERE status = 'active' AND deleted_at IS NULL"
-        )
-        row = await cur.fetchone()
-        users_with_active = int(row["cnt"])
+def _forecast_text(current: Forecast, proposed: Forecast | None = None) -> str:
+    def pair(before: float, after: float | None) -> str:
+        if after is None or after == before:
+            return f"{before:,}".replace(",", " ")
+        return f"{before:,} → {after:,}".replace(",", " ")
 
-        await _safe_edit(
-            call,
-            "Статистика:\n"
-            f"Всего пользователей: {total_users}\n"
-            f"Активные за 7 дней: {active_7}\n"
-            f"Пользователи с активными прокси: {users_with_active}\n"
-            f"Активных прокси: {active_proxies}\n"
-            f"Отключённых прокси: {disabled_count}\n"
-            f"Средний баланс: {avg_balance} ₽\n\n"
-            f"Пополнения: день {sum_day} ₽, неделя {sum_week} ₽, месяц {sum_month} ₽",
-            reply_markup=admin_menu_inline_kb(),
+    other = proposed.params if proposed else None
+    lines = [
+        f"Прогноз на {current.days} дн. (без пополнений):",
+        f"Цена/день: {pair(current.params.proxy_day_price, other and other.proxy_day_price)} ₽",
+        f"Free credit: {pair(current.params.free_credit, other and other.free_credit)} ₽",
+        f"Лимит прокси: {pair(current.params.max_active_proxies, other and other.max_active_proxies)}"
+        " (уже активные прокси не урезает)",
+        f"Регистраций в день: {current.params.signups_per_day:.1f}",
+        "",
+        f"Выручка: {pair(current.total_revenue, proposed and proposed.total_revenue)} ₽",
+        f"Отключений прокси: {pair(current.total_disabled, proposed and proposed.total_disabled)}",
+        f"Предупреждений: {pair(current.total_warnings, proposed and proposed.total_warnings)}",
+        "",
+    ]
+    # Weeks, or wider windows on long horizons so the report still fits in a caption.
+    size = max(7, -(-current.days // 6))
+    windows = current.windows(size)
+    proposed_windows = proposed.windows(size) if proposed else [None] * len(windows)
+    for window, other_window in zip(windows, proposed_windows):
+        first, last, revenue, disabled, warnings = window
+        _, _, revenue_p, disabled_p, warnings_p = other_window or (None,) * 5
+        lines.append(
+            f"Дни {first}–{last}: {pair(revenue, revenue_p)} ₽ · откл. {pair(disabled, disabled_p)}"
+            f" · пред. {pair(warnings, warnings_p)}"
         )
+    return "\n".join(lines)
+
+
+async def _run_forecast(db, days: int, overrides: dict[str, int] | None = None) -> str:
+    book = await load_book(db)
+    params = await load_params(db)
+    current = simulate(book, params, days)
+    proposed = simulate(book, await load_params(db, overrides), days) if overrides else None
+    return _forecast_text(current, proposed)
+
+
+@callbacks.exact("admin:forecast")
+async def admin_forecast(call: CallbackQuery, state: FSMContext) -> None:
+    if not _is_admin(call.from_user.id):
+        return
+    await call.answer()
+    await state.clear()
+    config = runtime.config
+    if config is None:
+        return
+    db = await get_db(config.db_path)
+    try:
+        text = await _run_forecast(db, 30)
+        await _safe_edit(call, f"{text}\n\nСравнить с другими настройками: /forecast", reply_markup=admin_menu_inline_kb())
     finally:
         await db.close()
 
 
-@router.callback_query(F.data == "admin:users")
+@router.message(Command("forecast"))
+async def admin_forecast_command(message: Message, command: CommandObject, state: FSMContext) -> None:
+    if not _require_admin(message):
+        return
+    await state.clear()
+    days = 30
+    overrides: dict[str, int] = {}
+    for part in (command.args or "").split():
+        key, sep, value = part.partition("=")
+        try:
+            if not sep:
+                days = min(365, max(1, int(part)))
+            elif key in FORECAST_SETTINGS:
+                overrides[key] = max(0, int(value))
+            else:
+                raise ValueError(key)
+        except ValueError:
+            await _admin_send_or_edit(message, FORECAST_USAGE, reply_markup=admin_menu_inline_kb())
+            return
+    config = runtime.config
+    if config is None:
+        return
+    db = await get_db(config.db_path)
+    try:
+        text = await _run_forecast(db, days, overrides)
+    finally:
+        await db.close()
+    await _admin_send_or_edit(message, text, reply_markup=admin_menu_inline_kb())
+
+
+@callbacks.exact("admin:users")
 async def admin_users(call: CallbackQuery, state: FSMContext) -> None:
     if not _is_admin(call.from_user.id):
         return
@@ -421,7 +534,7 @@ async def admin_users(call: CallbackQuery, state: FSMContext) -> None:
     await _safe_edit(call, "Пользователи: выберите фильтр или поиск.", reply_markup=admin_users_kb())
 
 
-@router.callback_query(F.data == "admin_users:search")
+@callbacks.exact("admin_users:search")
 async def admin_users_search(call: CallbackQuery, state: FSMContext) -> None:
     if not _is_admin(call.from_user.id):
         return
@@ -440,7 +553,7 @@ async def _render_users_list(db, users) -> list[dict]:
     return result
 
 
-@router.callback_query(F.data.startswith("admin_users:"))
+@callbacks.prefix("admin_users:")
 async def admin_users_filters(call: CallbackQuery) -> None:
     if not _is_admin(call.from_user.id):
         return
@@ -453,6 +566,7 @@ async def admin_users_filters(call: CallbackQuery) -> None:
         return
     db = await get_db(config.db_path)
     try:
+        await dao.sync_pending_writes()
         users = []
         if action == "active_proxies":
             cur = await db.execute(
@@ -476,9 +590,9 @@ async def admin_users_filters(call: CallbackQuery) -> None:
             )
             users = await cur.fetchall()
         elif action == "new24":
-            since = (datetime.utcnow() - timedelta(days=1)).replace(microsecond=0).isoformat() + "Z"
+            column, since = dao.epoch_bound("created", time.time() - 86400)
             cur = await db.execute(
-                "SELECT * FROM users WHERE deleted_at IS NULL AND created_at >= ? ORDER BY created_at DESC LIMIT 20",
+                f"SELECT * FROM users WHERE deleted_at IS NULL AND {column} >= ? ORDER BY {column} DESC LIMIT 20",
                 (since,),
             )
             users = await cur.fetchall()
@@ -560,7 +674,7 @@ async def admin_user_actions(message: Message, state: FSMContext) -> None:
             except Exception:
                 await _admin_send_or_edit(message, "Неверный формат суммы.")
                 return
-            await dao.add_user_balance(db, user_id, delta)
+            await dao.add_user_balance(db, user_id, delta, kind="admin", ref=f"admin:{message.from_user.id}")
             await _audit(
                 db,
                 message.from_user.id,
@@ -590,6 +704,8 @@ async def admin_user_actions(message: Message, state: FSMContext) -> None:
 
         if text == "block":
             await dao.block_user(db, user_id)
+            await dao.set_proxies_status_by_user(db, user_id, "disabled")
+            await sync_mtproto_secrets(db)
             await _audit(db, message.from_user.id, "user_block", target_type="user", target_id=str(user_id))
             await _admin_send_or_edit(message, "Пользователь заблокирован.")
             return
@@ -627,7 +743,7 @@ async def _admin_user_profile(db, user_id: int) -> str:
     )
 
 
-@router.callback_query(F.data.startswith("admin_user:"))
+@callbacks.prefix("admin_user:")
 async def admin_user_inline(call: CallbackQuery, state: FSMContext) -> None:
     if not _is_admin(call.from_user.id):
         return
@@ -645,7 +761,7 @@ async def admin_user_inline(call: CallbackQuery, state: FSMContext) -> None:
     try:
         if action == "delta" and len(parts) == 4:
             delta = int(parts[3])
-            await dao.add_user_balance(db, user_id, delta)
+            await dao.add_user_balance(db, user_id, delta, kind="admin", ref=f"admin:{call.from_user.id}")
             await _audit(
                 db,
                 call.from_user.id,
@@ -676,7 +792,7 @@ async def admin_user_inline(call: CallbackQuery, state: FSMContext) -> None:
             await _safe_edit(call, "Введите сумму (можно со знаком -):")
             return
         elif action == "reset":
-            await dao.set_user_balance(db, user_id, 0)
+            await dao.set_user_balance(db, user_id, 0, kind="admin_reset", ref=f"admin:{call.from_user.id}")
             await _audit(db, call.from_user.id, "user_balance_reset", target_type="user", target_id=str(user_id))
         elif action == "block":
             user = await dao.get_user_by_id(db, user_id)
@@ -685,6 +801,9 @@ async def admin_user_inline(call: CallbackQuery, state: FSMContext) -> None:
                 await _audit(db, call.from_user.id, "user_unblock", target_type="user", target_id=str(user_id))
             else:
                 await dao.block_user(db, user_id)
+                # Billing only visits due proxies now, so switch them off here rather than at the next charge.
+                await dao.set_proxies_status_by_user(db, user_id, "disabled")
+                await sync_mtproto_secrets(db)
                 await _audit(db, call.from_user.id, "user_block", target_type="user", target_id=str(user_id))
         elif action == "delete":
             await dao.delete_user(db, user_id)
@@ -722,7 +841,7 @@ async def admin_user_inline(call: CallbackQuery, state: FSMContext) -> None:
         await db.close()
 
 
-@router.callback_query(F.data.startswith("admin_proxy:"))
+@callbacks.prefix("admin_proxy:")
 async def admin_proxy_inline(call: CallbackQuery) -> None:
     if not _is_admin(call.from_user.id):
         return
@@ -786,7 +905,7 @@ async def admin_user_custom_delta(message: Message, state: FSMContext) -> None:
         return
     db = await get_db(config.db_path)
     try:
-        await dao.add_user_balance(db, user_id, delta)
+        await dao.add_user_balance(db, user_id, delta, kind="admin", ref=f"admin:{message.from_user.id}")
         await _audit(
             db,
             message.from_user.id,
@@ -824,7 +943,7 @@ async def admin_user_custom_delta(message: Message, state: FSMContext) -> None:
         await db.close()
 
 
-@router.callback_query(F.data == "admin:proxies")
+@callbacks.exact("admin:proxies")
 async def admin_proxies(call: CallbackQuery, state: FSMContext) -> None:
     if not _is_admin(call.from_user.id):
         return
@@ -887,7 +1006,7 @@ async def admin_proxies_by_user(message: Message, state: FSMContext) -> None:
         await db.close()
 
 
-@router.callback_query(F.data == "admin:payments")
+@callbacks.exact("admin:payments")
 async def admin_payments(call: CallbackQuery) -> None:
     if not _is_admin(call.from_user.id):
         return
@@ -918,7 +1037,7 @@ async def admin_payments(call: CallbackQuery) -> None:
         await db.close()
 
 
-@router.callback_query(F.data == "admin:support")
+@callbacks.exact("admin:support")
 async def admin_support_list(call: CallbackQuery, state: FSMContext) -> None:
     if not _is_admin(call.from_user.id):
         return
@@ -954,7 +1073,7 @@ async def admin_support_list(call: CallbackQuery, state: FSMContext) -> None:
         await db.close()
 
 
-@router.callback_query(F.data.startswith("admin_support:open:"))
+@callbacks.prefix("admin_support:open:")
 async def admin_support_open(call: CallbackQuery, state: FSMContext) -> None:
     if not _is_admin(call.from_user.id):
         return
@@ -1013,7 +1132,7 @@ async def admin_support_open(call: CallbackQuery, state: FSMContext) -> None:
         await db.close()
 
 
-@router.callback_query(F.data == "admin:settings")
+@callbacks.exact("admin:settings")
 async def admin_settings(call: CallbackQuery, state: FSMContext) -> None:
     if not _is_admin(call.from_user.id):
         return
@@ -1029,14 +1148,14 @@ async def admin_settings(call: CallbackQuery, state: FSMContext) -> None:
         await _safe_edit(
             call,
             _settings_text(settings_map) + "\n\nЧтобы изменить значение, нажмите кнопку.",
-            reply_markup=admin_settings_kb(settings_map),
+            reply_markup=admin_settings_kb(settings_map, dao.settings_version()),
         )
         await state.set_state(AdminStates.waiting_setting_input)
     finally:
         await db.close()
 
 
-@router.callback_query(F.data == "admin:mtproxy")
+@callbacks.exact("admin:mtproxy")
 async def admin_mtproxy(call: CallbackQuery, state: FSMContext) -> None:
     if not _is_admin(call.from_user.id):
         return
@@ -1053,7 +1172,7 @@ async def admin_mtproxy(call: CallbackQuery, state: FSMContext) -> None:
         await db.close()
 
 
-@router.callback_query(F.data == "admin:freekassa")
+@callbacks.exact("admin:freekassa")
 async def admin_freekassa(call: CallbackQuery, state: FSMContext) -> None:
     if not _is_admin(call.from_user.id):
         return
@@ -1070,7 +1189,7 @@ async def admin_freekassa(call: CallbackQuery, state: FSMContext) -> None:
         await db.close()
 
 
-@router.callback_query(F.data == "admin:freekassa_refresh")
+@callbacks.exact("admin:freekassa_refresh")
 async def admin_freekassa_refresh(call: CallbackQuery) -> None:
     if not _is_admin(call.from_user.id):
         return
@@ -1086,7 +1205,99 @@ async def admin_freekassa_refresh(call: CallbackQuery) -> None:
         await db.close()
 
 
-@router.callback_query(F.data == "admin:mtproxy_refresh")
+def _perf_text() -> str:
+    lines = [
+        "Производительность event loop:",
+        f"Порог блокировки: {int(loop_monitor.threshold_sec * 1000)} мс",
+        f"Замеров лага: {LOOP_LAG_SECONDS.count()}",
+        "",
+    ]
+    offenders = loop_monitor.top(5)
+    if not offenders:
+        lines.append("Блокировок не зафиксировано.")
+    else:
+        lines.append("Топ блокировок (сумма / макс / раз):")
+        for item in offenders:
+            lines.append(
+                f"• {item.site}\n  {item.total_sec:.2f} с / {int(item.max_sec * 1000)} мс / {item.count}"
+            )
+    handlers = db_profiler.handler_summary()[:5]
+    if handlers:
+        lines.append("")
+        lines.append("SQL на апдейт (p50 / p99 / макс):")
+        for item in handlers:
+            lines.append(f"• {item['handler']}: {item['p50']} / {item['p99']} / {item['max']}")
+    return "\n".join(lines)
+
+
+@callbacks.exact("admin:perf", "admin:perf_refresh")
+async def admin_perf(call: CallbackQuery, state: FSMContext) -> None:
+    if not _is_admin(call.from_user.id):
+        return
+    await call.answer()
+    await state.clear()
+    await _safe_edit(call, _perf_text(), reply_markup=perf_report_kb())
+
+
+@callbacks.exact("admin:perf_reset")
+async def admin_perf_reset(call: CallbackQuery) -> None:
+    if not _is_admin(call.from_user.id):
+        return
+    loop_monitor.reset()
+    db_profiler.reset()
+    await call.answer("Сброшено")
+    await _safe_edit(call, _perf_text(), reply_markup=perf_report_kb())
+
+
+@callbacks.exact("admin:perf_stacks")
+async def admin_perf_stacks(call: CallbackQuery) -> None:
+    if not _is_admin(call.from_user.id):
+        return
+    offenders = loop_monitor.top(20)
+    if not offenders:
+        await call.answer("Блокировок не зафиксировано", show_alert=True)
+        return
+    await call.answer()
+    chunks = []
+    for item in offenders:
+        chunks.append(
+            f"== {item.site} | total={item.total_sec:.3f}s max={item.max_sec:.3f}s count={item.count}\n"
+            f"{item.stack}"
+        )
+    data = "\n".join(chunks).encode("utf-8")
+    await call.message.answer_document(BufferedInputFile(data, filename="loop_stalls.txt"))
+
+
+@callbacks.exact("admin:perf_sql")
+async def admin_perf_sql(call: CallbackQuery) -> None:
+    if not _is_admin(call.from_user.id):
+        return
+    handlers = db_profiler.handler_summary()
+    statements = db_profiler.top_statements(30)
+    if not handlers and not statements:
+        await call.answer("Нет данных", show_alert=True)
+        return
+    await call.answer()
+    lines = ["handler\tupdates\tp50\tp99\tmax"]
+    for item in handlers:
+        lines.append(f"{item['handler']}\t{item['updates']}\t{item['p50']}\t{item['p99']}\t{item['max']}")
+    lines.append("")
+    lines.append("count\ttotal_ms\tmax_ms\trows\tsql")
+    for stat in statements:
+        lines.append(
+            f"{stat.count}\t{stat.total_sec * 1000:.1f}\t{stat.max_sec * 1000:.1f}\t{stat.rows}\t{stat.sql}"
+        )
+    lines.append("")
+    lines.append("update_id\thandler\tms\trows\tsql")
+    for record in db_profiler.recent:
+        lines.append(
+            f"{record.update_id or '-'}\t{record.handler}\t{record.seconds * 1000:.2f}\t{record.rows}\t{record.sql}"
+        )
+    data = "\n".join(lines).encode("utf-8")
+    await call.message.answer_document(BufferedInputFile(data, filename="db_profile.tsv"))
+
+
+@callbacks.exact("admin:mtproxy_refresh")
 async def admin_mtproxy_refresh(call: CallbackQuery) -> None:
     if not _is_admin(call.from_user.id):
         return
@@ -1102,7 +1313,7 @@ async def admin_mtproxy_refresh(call: CallbackQuery) -> None:
         await db.close()
 
 
-@router.callback_query(F.data == "admin:mtproxy_logs")
+@callbacks.exact("admin:mtproxy_logs")
 async def admin_mtproxy_logs(call: CallbackQuery) -> None:
     if not _is_admin(call.from_user.id):
         return
@@ -1147,19 +1358,21 @@ async def admin_settings_set(message: Message, state: FSMContext) -> None:
         )
         if key == "mtproto_enabled":
             await sync_mtproto_secrets(db)
+        if key in FLOOD_SETTING_KEYS:
+            await reload_policy(db)
         settings_map = await dao.get_settings_map(db)
         await _admin_send_or_edit(message, "Настройка обновлена.")
         await _admin_send_or_edit(
             message,
             _settings_text(settings_map),
-            reply_markup=admin_settings_kb(settings_map),
+            reply_markup=admin_settings_kb(settings_map, dao.settings_version()),
         )
         await state.update_data(setting_key=None)
     finally:
         await db.close()
 
 
-@router.callback_query(F.data.startswith("admin_settings_edit:"))
+@callbacks.prefix("admin_settings_edit:")
 async def admin_settings_pick(call: CallbackQuery, state: FSMContext) -> None:
     if not _is_admin(call.from_user.id):
         return
@@ -1199,14 +1412,14 @@ async def admin_bg_image(message: Message, state: FSMContext) -> None:
         await _admin_send_or_edit(
             message,
             _settings_text(settings_map),
-            reply_markup=admin_settings_kb(settings_map),
+            reply_markup=admin_settings_kb(settings_map, dao.settings_version()),
         )
         await state.clear()
     finally:
         await db.close()
 
 
-@router.callback_query(F.data.startswith("admin_settings_toggle:"))
+@callbacks.prefix("admin_settings_toggle:")
 async def admin_settings_toggle(call: CallbackQuery, state: FSMContext) -> None:
     if not _is_admin(call.from_user.id):
         return
@@ -1233,13 +1446,13 @@ async def admin_settings_toggle(call: CallbackQuery, state: FSMContext) -> None:
         if key == "bg_enabled":
             runtime.bg_enabled = new_value == "1"
         settings_map = await dao.get_settings_map(db)
-        await _safe_edit(call, _settings_text(settings_map), reply_markup=admin_settings_kb(settings_map))
+        await _safe_edit(call, _settings_text(settings_map), reply_markup=admin_settings_kb(settings_map, dao.settings_version()))
         await state.update_data(setting_key=None)
     finally:
         await db.close()
 
 
-@router.callback_query(F.data.startswith("support:reply:"))
+@callbacks.prefix("support:reply:")
 async def admin_support_reply_pick(call: CallbackQuery, state: FSMContext) -> None:
     if not _is_admin(call.from_user.id):
         return
@@ -1272,7 +1485,7 @@ async def admin_support_reply_pick(call: CallbackQuery, state: FSMContext) -> No
     await state.set_state(AdminStates.waiting_support_reply)
 
 
-@router.callback_query(F.data.startswith("support:close:"))
+@callbacks.prefix("support:close:")
 async def admin_support_close(call: CallbackQuery, state: FSMContext) -> None:
     if not _is_admin(call.from_user.id):
         return
@@ -1291,6 +1504,7 @@ async def admin_support_close(call: CallbackQuery, state: FSMContext) -> None:
             await _safe_edit(call, "Тикет не найден.")
             return
         await dao.set_support_ticket_status(db, ticket_id, "closed")
+        await scheduler.cancel(db, SUPPORT_SLA, ticket_id)
         await _audit(
             db,
             call.from_user.id,
@@ -1318,7 +1532,7 @@ async def admin_support_close(call: CallbackQuery, state: FSMContext) -> None:
         await db.close()
 
 
-@router.callback_query(F.data == "support:reply_cancel")
+@callbacks.exact("support:reply_cancel")
 async def admin_support_reply_cancel(call: CallbackQuery, state: FSMContext) -> None:
     if not _is_admin(call.from_user.id):
         return
@@ -1354,7 +1568,8 @@ async def admin_support_reply_send(message: Message, state: FSMContext) -> None:
         await dao.add_support_message(db, int(ticket_id), "admin", message.from_user.id, text)
         await dao.set_support_ticket_assignee(db, int(ticket_id), message.from_user.id)
         await dao.set_support_ticket_status(db, int(ticket_id), "waiting_user")
-        await dao.update_support_ticket_sla_alert_at(db, int(ticket_id), "")
+        await dao.update_support_ticket_sla_alert_at(db, int(ticket_id), None)
+        await scheduler.cancel(db, SUPPORT_SLA, int(ticket_id))
         await _audit(
             db,
             message.from_user.id,
@@ -1385,7 +1600,7 @@ async def admin_support_reply_send(message: Message, state: FSMContext) -> None:
         await db.close()
 
 
-@router.callback_query(F.data == "admin:export")
+@callbacks.exact("admin:export")
 async def admin_export(call: CallbackQuery) -> None:
     if not _is_admin(call.from_user.id):
         return
@@ -1394,6 +1609,7 @@ async def admin_export(call: CallbackQuery) -> None:
 
 
 async def _send_export_csv(kind: str, message: Message | CallbackQuery, db) -> None:
+    await dao.sync_pending_writes()
     buffer = io.StringIO()
     writer = csv.writer(buffer)
 
@@ -1421,12 +1637,23 @@ async def _send_export_csv(kind: str, message: Message | CallbackQuery, db) -> N
 
     if kind == "payments":
         rows = await db.execute(
-            "SELECT id, user_id, amount, status, provider_payment_id, created_at FROM payments"
+            "SELECT id, user_id, amount, status, provider, provider_payment_id, created_at FROM payments "
+            "UNION ALL "
+            "SELECT id, user_id, amount, status, provider, provider_payment_id, created_at FROM payments_archive "
+            "ORDER BY id"
         )
-        writer.writerow(["id", "user_id", "amount", "status", "provider_payment_id", "created_at"])
+        writer.writerow(["id", "user_id", "amount", "status", "provider", "provider_payment_id", "created_at"])
         for row in await rows.fetchall():
             writer.writerow(
-                [row["id"], row["user_id"], row["amount"], row["status"], row["provider_payment_id"], row["created_at"]]
+                [
+                    row["id"],
+                    row["user_id"],
+                    row["amount"],
+                    row["status"],
+                    row["provider"],
+                    row["provider_payment_id"],
+                    row["created_at"],
+                ]
             )
 
     if kind == "referrals":
@@ -1493,7 +1720,7 @@ async def admin_export_csv(message: Message) -> None:
         await db.close()
 
 
-@router.callback_query(F.data.startswith("admin_export:"))
+@callbacks.prefix("admin_export:")
 async def admin_export_cb(call: CallbackQuery) -> None:
     if not _is_admin(call.from_user.id):
         return
@@ -1511,7 +1738,7 @@ async def admin_export_cb(call: CallbackQuery) -> None:
         await db.close()
 
 
-@router.callback_query(F.data == "admin:broadcast")
+@callbacks.exact("admin:broadcast")
 async def admin_broadcast_start(call: CallbackQuery, state: FSMContext) -> None:
     if not _is_admin(call.from_user.id):
         return
@@ -1528,7 +1755,30 @@ async def admin_broadcast_text(message: Message, state: FSMContext) -> None:
     await _admin_send_or_edit(message, "Выберите аудиторию:", reply_markup=broadcast_filters_kb())
 
 
-@router.callback_query(F.data.startswith("broadcast:"))
+async def _broadcast_audience(db, action: str) -> list:
+    # last_seen filters the audience and last_menu_message_id is where each message goes.
+    await dao.sync_pending_writes()
+    query = "SELECT * FROM users WHERE deleted_at IS NULL"
+    params = []
+
+    if action == "active7":
+        column, since = dao.epoch_bound("last_seen", time.time() - 7 * 86400)
+        query += f" AND {column} >= ?"
+        params.append(since)
+    elif action == "active_proxies":
+        query = (
+            "SELECT DISTINCT u.* FROM users u "
+            "JOIN proxies p ON p.user_id = u.id "
+            "WHERE u.deleted_at IS NULL AND p.status = 'active'"
+        )
+    elif action == "balance_pos":
+        query += " AND balance > 0"
+
+    cur = await db.execute(query, params)
+    return await cur.fetchall()
+
+
+@callbacks.prefix("broadcast:")
 async def admin_broadcast_send(call: CallbackQuery, state: FSMContext) -> None:
     if not _is_admin(call.from_user.id):
         return
@@ -1552,24 +1802,7 @@ async def admin_broadcast_send(call: CallbackQuery, state: FSMContext) -> None:
 
     db = await get_db(config.db_path)
     try:
-        query = "SELECT * FROM users WHERE deleted_at IS NULL"
-        params = []
-
-        if action == "active7":
-            since = (datetime.utcnow() - timedelta(days=7)).replace(microsecond=0).isoformat() + "Z"
-            query += " AND last_seen_at >= ?"
-            params.append(since)
-        elif action == "active_proxies":
-            query = (
-                "SELECT DISTINCT u.* FROM users u "
-                "JOIN proxies p ON p.user_id = u.id "
-                "WHERE u.deleted_at IS NULL AND p.status = 'active'"
-            )
-        elif action == "balance_pos":
-            query += " AND balance > 0"
-
-        cur = await db.execute(query, params)
-        rows = await cur.fetchall()
+        rows = await _broadcast_audience(db, action)
         await _audit(
             db,
             call.from_user.id,
@@ -1607,7 +1840,7 @@ async def admin_broadcast_send(call: CallbackQuery, state: FSMContext) -> None:
         await db.close()
 
 
-@router.callback_query(F.data == "admin:referrals")
+@callbacks.exact("admin:referrals")
 async def admin_referrals(call: CallbackQuery, state: FSMContext) -> None:
     if not _is_admin(call.from_user.id):
         return
@@ -1637,7 +1870,7 @@ async def admin_referrals(call: CallbackQuery, state: FSMContext) -> None:
             top_lines.append(f"{name} — {row['cnt']} приглашений, бонус {row['bonus']} ₽")
         if links:
             lines = []
-            bot_info = await call.bot.get_me()
+            bot_info = await get_bot_info(call.bot)
             total_clicks = 0
             total_revenue = 0
             for link in links:
@@ -1686,7 +1919,7 @@ async def admin_referrals(call: CallbackQuery, state: FSMContext) -> None:
         await db.close()
 
 
-@router.callback_query(F.data.startswith("admin_ref_del:"))
+@callbacks.prefix("admin_ref_del:")
 async def admin_ref_delete(call: CallbackQuery) -> None:
     if not _is_admin(call.from_user.id):
         return
@@ -1703,7 +1936,7 @@ async def admin_ref_delete(call: CallbackQuery) -> None:
     )
 
 
-@router.callback_query(F.data.startswith("admin_ref_del_confirm:"))
+@callbacks.prefix("admin_ref_del_confirm:")
 async def admin_ref_delete_confirm(call: CallbackQuery) -> None:
     if not _is_admin(call.from_user.id):
         return
@@ -1729,7 +1962,7 @@ async def admin_ref_delete_confirm(call: CallbackQuery) -> None:
     await _safe_edit(call, f"Ссылка `{code}` удалена.", reply_markup=admin_referrals_kb(), parse_mode=None)
 
 
-@router.callback_query(F.data == "admin:ref_create")
+@callbacks.exact("admin:ref_create")
 async def admin_ref_create(call: CallbackQuery, state: FSMContext) -> None:
     if not _is_admin(call.from_user.id):
         return
@@ -1821,7 +2054,7 @@ async def admin_ref_bonuses(message: Message, state: FSMContext) -> None:
             target_id=code,
             details=f"bonus_invited={bonus_invited};bonus_inviter={bonus_inviter}",
         )
-        bot_info = await message.bot.get_me()
+        bot_info = await get_bot_info(message.bot)
         link = f"https://t.me/{bot_info.username}?start={code}"
         await _admin_send_or_edit(message, "Ссылка создана.")
         await _admin_send_or_edit(message, f"Ссылка для распространения:\n{link}")
@@ -6,9 +6,11 @@ from aiogram.filters.state import StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.types import Message, CallbackQuery, LabeledPrice
 from html import escape as html_escape
-from datetime import datetime, timedelta
+from datetime import datetime
+import time
 
 from bot import dao
+from bot.callback_routes import CallbackRoutes
 from bot.db import get_db
 from bot.handlers.states import UserStates
 from bot.keyboards import (
@@ -33,7 +35,7 @@ from bot.keyboards import (
     referral_share_kb,
 )
 from bot.runtime import runtime
-from bot.ui import send_or_edit_bg_message, get_bg_file
+from bot.ui import get_bg_file, get_bot_info, send_bg_photo, send_or_edit_bg_message
 from bot.services.settings import (
     get_int_setting,
     get_decimal_setting,
@@ -43,6 +45,7 @@ from bot.services.settings import (
 from bot.services.mtproto import sync_mtproto_secrets, ensure_proxy_mtproto_secret, reenable_proxies_for_user
 from bot.services.freekassa import create_order
 from bot.services.rate_limit import is_allowed
+from bot.services.scheduler import FREEKASSA_POLL, SUPPORT_SLA, scheduler
 
 FREEKASSA_METHOD_RULES = {
     44: {"percent": 7.0, "min_amount": 10},   # СБП
@@ -63,6 +66,7 @@ from bot.utils import (
 )
 
 router = Router()
+callbacks = CallbackRoutes(router)
 
 
 async def _ensure_unique_ref_code(db, length: int = 8) -> str:
@@ -200,6 +204,7 @@ async def _safe_edit(call: CallbackQuery, text: str, reply_markup=None, parse_mo
         reply_markup=reply_markup,
         parse_mode=parse_mode,
         message_id=call.message.message_id,
+        current=call.message,
     )
     await _remember_menu_message(call.from_user.id, msg_id)
 
@@ -208,6 +213,10 @@ async def _remember_menu_message(tg_id: int, message_id: int) -> None:
     config = runtime.config
     if config is None:
         return
+    if runtime.write_behind:
+        # Only buffered until the next flush, so there is no need to take a connection for it.
+        await dao.update_user_last_menu_message_id(None, tg_id, message_id)
+        return
     db = await get_db(config.db_path)
     try:
         await dao.update_user_last_menu_message_id(db, tg_id, message_id)
@@ -289,9 +298,23 @@ async def _apply_referral(db, ref_arg: str | None, user_id: int) -> None:
 
     if inviter_user_id and inviter_user_id != user_id:
         if bonus_inviter:
-            await dao.add_user_balance(db, inviter_user_id, bonus_inviter)
+            await dao.add_user_balance(
+                db,
+                inviter_user_id,
+                bonus_inviter,
+                kind="referral",
+                idempotency_key=f"referral:{user_id}:inviter",
+                ref=f"user:{user_id}",
+            )
         if bonus_invited:
-            await dao.add_user_balance(db, user_id, bonus_invited)
+            await dao.add_user_balance(
+                db,
+                user_id,
+                bonus_invited,
+                kind="referral",
+                idempotency_key=f"referral:{user_id}:invited",
+                ref=f"user:{inviter_user_id}",
+            )
         await dao.create_referral_event(
             db,
             inviter_user_id=inviter_user_id,
@@ -333,15 +356,6 @@ async def _build_proxy_links_text(db, proxy) -> str:
     return "\n\n".join(lines)
 
 
-def _parse_date(value: str | None) -> datetime.date | None:
-    if not value:
-        return None
-    try:
-        return datetime.fromisoformat(value.replace("Z", "")).date()
-    except Exception:
-        return None
-
-
 def _fk_fee_amount(amount: int, method: int) -> str:
     rule = FREEKASSA_METHOD_RULES.get(method, FREEKASSA_METHOD_RULES[43])
     fee = amount * (rule["percent"] / 100.0)
@@ -360,7 +374,9 @@ async def _issue_invoice(bot: Bot, chat_id: int, db, user_id: int, rub: int) ->
     rate = await get_decimal_setting(db, "stars_rate", "1")
     stars = convert_rub_to_stars(rub, rate)
     payload = f"topup:{user_id}:{rub}:{stars}"
-    payment_id = await dao.create_payment(db, user_id=user_id, amount=rub, status="pending", payload=payload)
+    payment_id = await dao.create_payment(
+        db, user_id=user_id, amount=rub, status="pending", payload=payload, provider="stars"
+    )
     payload = f"{payload}:{payment_id}"
     await dao.update_payment_payload(db, payment_id, payload)
 
@@ -392,6 +408,7 @@ async def _start_freekassa_payment(db, user_id: int, tg_id: int, rub: int, metho
         amount=rub,
         status="pending",
         payload=f"freekassa:{user_id}:{rub}",
+        provider="freekassa",
     )
     result = await create_order(
         api_base=config.freekassa_api_base,
@@ -411,6 +428,8 @@ async def _start_freekassa_payment(db, user_id: int, tg_id: int, rub: int, metho
     if not pay_url:
         await dao.update_payment_status(db, payment_id, "failed", provider_payment_id=f"freekassa:{payment_id}")
         return {"error": "Ошибка FreeKassa: не получена ссылка на оплату.", "payment_id": payment_id}
+    poll_delay = max(30, int(config.freekassa_reconcile_interval_sec))
+    await scheduler.schedule(db, FREEKASSA_POLL, payment_id, time.time() + poll_delay)
     return {"payment_id": payment_id, "pay_url": pay_url}
 
 
@@ -470,11 +489,7 @@ async def cmd_start(message: Message, state: FSMContext) -> None:
                     force_new=True,
                 )
                 return
-            await db.execute(
-                "UPDATE users SET username = ? WHERE tg_id = ?",
-                (message.from_user.username, message.from_user.id),
-            )
-            await db.commit()
+            await dao.update_user_username(db, message.from_user.id, message.from_user.username)
             await dao.update_user_last_seen(db, message.from_user.id)
             _, header = await _get_user_and_header(db, message.from_user.id)
             text = f"{header}\n\nГлавное меню" if header else "Главное меню"
@@ -559,7 +574,7 @@ async def cmd_menu(message: Message, state: FSMContext) -> None:
         await db.close()
 
 
-@router.callback_query(F.data == "menu:main")
+@callbacks.exact("menu:main")
 async def menu_main(call: CallbackQuery) -> None:
     await call.answer()
     config = runtime.config
@@ -601,7 +616,7 @@ async def cmd_help(message: Message) -> None:
         await db.close()
 
 
-@router.callback_query(F.data == "menu:help")
+@callbacks.exact("menu:help")
 async def menu_help(call: CallbackQuery) -> None:
     await call.answer()
     config = runtime.config
@@ -626,7 +641,7 @@ async def menu_help(call: CallbackQuery) -> None:
         await db.close()
 
 
-@router.callback_query(F.data == "menu:support")
+@callbacks.exact("menu:support")
 async def menu_support(call: CallbackQuery, state: FSMContext) -> None:
     await call.answer()
     config = runtime.config
@@ -669,7 +684,7 @@ async def menu_support(call: CallbackQuery, state: FSMContext) -> None:
         await db.close()
 
 
-@router.callback_query(F.data.startswith("help:"))
+@callbacks.prefix("help:")
 async def help_detail(call: CallbackQuery) -> None:
     await call.answer()
     config = runtime.config
@@ -719,7 +734,7 @@ async def help_detail(call: CallbackQuery) -> None:
         await db.close()
 
 
-@router.callback_query(F.data == "menu:check")
+@callbacks.exact("menu:check")
 async def menu_check(call: CallbackQuery) -> None:
     await call.answer()
     config = runtime.config
@@ -744,9 +759,8 @@ async def menu_check(call: CallbackQuery) -> None:
             status = "активен" if p["status"] == "active" else "отключён"
             next_charge = "не списывается"
             if p["status"] == "active" and day_price > 0:
-                last_billed = _parse_date(p["last_billed_at"])
-                if last_billed:
-                    next_charge = (last_billed + timedelta(days=1)).isoformat()
+                if p["next_bill_at"]:
+                    next_charge = max(today, datetime.utcfromtimestamp(p["next_bill_at"]).date()).isoformat()
                 else:
                     next_charge = today.isoformat()
             lines.append(f"{p['login']} — {status}, списание: {next_charge}")
@@ -755,7 +769,7 @@ async def menu_check(call: CallbackQuery) -> None:
         await db.close()
 
 
-@router.callback_query(F.data == "menu:proxies")
+@callbacks.exact("menu:proxies")
 async def my_proxies(call: CallbackQuery) -> None:
     await call.answer()
     config = runtime.config
@@ -785,13 +799,13 @@ async def my_proxies(call: CallbackQuery) -> None:
         await db.close()
 
 
-@router.callback_query(F.data == "proxy:list")
+@callbacks.exact("proxy:list")
 async def proxy_list_cb(call: CallbackQuery) -> None:
     await call.answer()
     await my_proxies(call)
 
 
-@router.callback_query(F.data == "proxy:buy")
+@callbacks.exact("proxy:buy")
 async def proxy_buy_cb(call: CallbackQuery) -> None:
     await call.answer()
     config = runtime.config
@@ -818,7 +832,7 @@ async def proxy_buy_cb(call: CallbackQuery) -> None:
             await _safe_edit(call, "Недостаточно средств. Пополните баланс.")
             return
 
-        await dao.add_user_balance(db, user["id"], -price)
+        await dao.add_user_balance(db, user["id"], -price, kind="purchase")
         proxy = await _create_proxy_for_user(db, user["id"], is_free=0)
         await sync_mtproto_secrets(db)
         links_text = await _build_proxy_links_text(db, proxy)
@@ -833,7 +847,7 @@ async def proxy_buy_cb(call: CallbackQuery) -> None:
     finally:
         await db.close()
 
-@router.callback_query(F.data.startswith("proxy:show:"))
+@callbacks.prefix("proxy:show:")
 async def proxy_show(call: CallbackQuery) -> None:
     await call.answer()
     config = runtime.config
@@ -859,7 +873,7 @@ async def proxy_show(call: CallbackQuery) -> None:
     finally:
         await db.close()
 
-@router.callback_query(F.data.startswith("proxy:delete:"))
+@callbacks.prefix("proxy:delete:")
 async def proxy_delete_prepare(call: CallbackQuery) -> None:
     await call.answer()
     config = runtime.config
@@ -884,7 +898,7 @@ async def proxy_delete_prepare(call: CallbackQuery) -> None:
         await db.close()
 
 
-@router.callback_query(F.data.startswith("proxy:delete_confirm:"))
+@callbacks.prefix("proxy:delete_confirm:")
 async def proxy_delete_apply(call: CallbackQuery) -> None:
     await call.answer()
     config = runtime.config
@@ -905,7 +919,7 @@ async def proxy_delete_apply(call: CallbackQuery) -> None:
         await db.close()
 
 
-@router.callback_query(F.data == "menu:referrals")
+@callbacks.exact("menu:referrals")
 async def referral_info(call: CallbackQuery) -> None:
     await call.answer("Карточка для пересылки отправлена")
     config = runtime.config
@@ -918,7 +932,7 @@ async def referral_info(call: CallbackQuery) -> None:
             await _safe_edit(call, "Нажмите /start", reply_markup=main_menu_inline_kb(_is_admin(call.from_user.id)))
             return
         _, header = await _get_user_and_header(db, call.from_user.id)
-        ref_url = f"https://t.me/{(await call.bot.get_me()).username}?start=ref_{user['ref_code']}"
+        ref_url = f"https://t.me/{(await get_bot_info(call.bot)).username}?start=ref_{user['ref_code']}"
         text = (
             "Подключить прокси для Telegram\n\n"
             "Нажмите кнопку ниже и получите прокси автоматически.\n"
@@ -926,9 +940,10 @@ async def referral_info(call: CallbackQuery) -> None:
         )
         bg = get_bg_file()
         if bg:
-            await call.message.bot.send_photo(
-                chat_id=call.from_user.id,
-                photo=bg,
+            await send_bg_photo(
+                call.message.bot,
+                call.from_user.id,
+                bg,
                 caption=text,
                 reply_markup=referral_share_kb(ref_url),
             )
@@ -950,7 +965,7 @@ async def referral_info(call: CallbackQuery) -> None:
         await db.close()
 
 
-@router.callback_query(F.data == "menu:topup")
+@callbacks.exact("menu:topup")
 async def topup_start(call: CallbackQuery, state: FSMContext) -> None:
     await call.answer()
     config = runtime.config
@@ -1010,7 +1025,7 @@ async def topup_start(call: CallbackQuery, state: FSMContext) -> None:
         await db.close()
 
 
-@router.callback_query(F.data.startswith("topup:method:"))
+@callbacks.prefix("topup:method:")
 async def topup_method_select(call: CallbackQuery, state: FSMContext) -> None:
     await call.answer()
     parts = call.data.split(":")
@@ -1094,7 +1109,7 @@ async def topup_method_select(call: CallbackQuery, state: FSMContext) -> None:
         await db.close()
 
 
-@router.callback_query(F.data.startswith("topup:rec:"))
+@callbacks.prefix("topup:rec:")
 async def topup_recommend_days(call: CallbackQuery, state: FSMContext) -> None:
     await call.answer()
     parts = call.data.split(":")
@@ -1186,7 +1201,7 @@ async def topup_recommend_days(call: CallbackQuery, state: FSMContext) -> None:
         await db.close()
 
 
-@router.callback_query(F.data == "fk:amounts_back")
+@callbacks.exact("fk:amounts_back")
 async def freekassa_amounts_back(call: CallbackQuery, state: FSMContext) -> None:
     await call.answer()
     config = runtime.config
@@ -1209,7 +1224,7 @@ async def freekassa_amounts_back(call: CallbackQuery, state: FSMContext) -> None
         await db.close()
 
 
-@router.callback_query(F.data.startswith("fk:pay:"))
+@callbacks.prefix("fk:pay:")
 async def freekassa_pay(call: CallbackQuery, state: FSMContext) -> None:
     await call.answer()
     parts = call.data.split(":")
@@ -1344,7 +1359,7 @@ async def freekassa_pay(call: CallbackQuery, state: FSMContext) -> None:
         await db.close()
 
 
-@router.callback_query(F.data.startswith("topup:custom"))
+@callbacks.prefix("topup:custom")
 async def topup_custom(call: CallbackQuery, state: FSMContext) -> None:
     await call.answer()
     await state.update_data(topup_method="stars", fk_amount=None, fk_note=None)
@@ -1356,7 +1371,7 @@ async def topup_custom(call: CallbackQuery, state: FSMContext) -> None:
     )
 
 
-@router.callback_query(F.data.startswith("topup:amount:"))
+@callbacks.prefix("topup:amount:")
 async def topup_quick_amount(call: CallbackQuery, state: FSMContext) -> None:
     await call.answer()
     parts = call.data.split(":")
@@ -1427,7 +1442,7 @@ async def topup_quick_amount(call: CallbackQuery, state: FSMContext) -> None:
         await db.close()
 
 
-@router.callback_query(F.data.startswith("topup:days:"))
+@callbacks.prefix("topup:days:")
 async def topup_days(call: CallbackQuery, state: FSMContext) -> None:
     await call.answer()
     parts = call.data.split(":")
@@ -1708,7 +1723,9 @@ async def support_message(message: Message, state: FSMContext) -> None:
 
         await dao.add_support_message(db, ticket_id, "user", message.from_user.id, text)
         await dao.set_support_ticket_status(db, ticket_id, "waiting_admin")
-        await dao.update_support_ticket_sla_alert_at(db, ticket_id, "")
+        await dao.update_support_ticket_sla_alert_at(db, ticket_id, None)
+        sla_minutes = max(5, await get_int_setting(db, "support_sla_minutes", 30))
+        await scheduler.schedule(db, SUPPORT_SLA, ticket_id, time.time() + sla_minutes * 60)
 
         # notify admins
         admin_ids = runtime.config.admin_tg_ids if runtime.config else []
@@ -1740,7 +1757,7 @@ async def support_message(message: Message, state: FSMContext) -> None:
         await db.close()
 
 
-@router.callback_query(F.data.startswith("support:close_user:"))
+@callbacks.prefix("support:close_user:")
 async def support_close_user(call: CallbackQuery, state: FSMContext) -> None:
     await call.answer()
     parts = call.data.split(":")
@@ -1761,6 +1778,7 @@ async def support_close_user(call: CallbackQuery, state: FSMContext) -> None:
             await _safe_edit(call, "Тикет не найден.")
             return
         await dao.set_support_ticket_status(db, ticket_id, "closed")
+        await scheduler.cancel(db, SUPPORT_SLA, ticket_id)
         for admin_id in (runtime.config.admin_tg_ids if runtime.config else []):
             try:
                 await call.message.bot.send_message(admin_id, f"Тикет #{ticket_id} закрыт пользователем.")
@@ -1777,7 +1795,7 @@ async def support_close_user(call: CallbackQuery, state: FSMContext) -> None:
         await db.close()
 
 
-@router.callback_query(F.data.startswith("fk:cancel:"))
+@callbacks.prefix("fk:cancel:")
 async def freekassa_cancel(call: CallbackQuery, state: FSMContext) -> None:
     await call.answer()
     parts = call.data.split(":")
@@ -1805,6 +1823,7 @@ async def freekassa_cancel(call: CallbackQuery, state: FSMContext) -> None:
             return
         if payment["status"] != "canceled":
             await dao.update_payment_status(db, payment_id, "canceled", provider_payment_id=f"freekassa:{payment_id}")
+            await scheduler.cancel(db, FREEKASSA_POLL, payment_id)
 
         user_row, header = await _get_user_and_header(db, call.from_user.id)
         await _send_status_message(
@@ -1819,7 +1838,7 @@ async def freekassa_cancel(call: CallbackQuery, state: FSMContext) -> None:
         await db.close()
 
 
-@router.callback_query(F.data.startswith("fk:check:"))
+@callbacks.prefix("fk:check:")
 async def freekassa_check_legacy(call: CallbackQuery) -> None:
     await call.answer("Автопроверка включена. Статус придёт отдельным сообщением.", show_alert=False)
 
@@ -1861,7 +1880,9 @@ async def successful_payment(message: Message) -> None:
             return
 
         await dao.update_payment_status(db, payment_id, "paid", provider_payment_id)
-        await dao.add_user_balance(db, user_id, rub)
+        await dao.add_user_balance(
+            db, user_id, rub, kind="payment", idempotency_key=f"payment:{payment_id}", ref=provider_payment_id
+        )
         reenabled = await reenable_proxies_for_user(db, user_id)
         user = await dao.get_user_by_id(db, user_id)
         _, header = await _get_user_and_header(db, user["tg_id"]) if user else (None, "Баланс: 0 ₽")
@@ -1,10 +1,36 @@
 from __future__ import annotations
 
+import hashlib
+from functools import lru_cache
+from typing import Optional, Tuple
+
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from pydantic import PrivateAttr
 
 STYLE_SUCCESS = "success"
 STYLE_PRIMARY = STYLE_SUCCESS
 STYLE_DANGER = "danger"
+# Bound for keyboards memoized by their arguments (ticket ids, user ids, amounts).
+KEYBOARD_CACHE_SIZE = 1024
+
+
+class SharedMarkup(InlineKeyboardMarkup):
+    # Returned from the caches below and reused across renders: callers must not mutate it.
+    # The bot session serializes it once and keeps the JSON here (bot/session.py).
+    _json: Optional[str] = PrivateAttr(default=None)
+    _fingerprint: Optional[bytes] = PrivateAttr(default=None)
+
+
+def markup_fingerprint(markup: InlineKeyboardMarkup | None) -> bytes:
+    # Short digest of a keyboard for "did this render change" checks; computed once per SharedMarkup.
+    if markup is None:
+        return b""
+    if isinstance(markup, SharedMarkup) and markup._fingerprint is not None:
+        return markup._fingerprint
+    digest = hashlib.blake2b(markup.model_dump_json(exclude_none=True).encode(), digest_size=16).digest()
+    if isinstance(markup, SharedMarkup):
+        markup._fingerprint = digest
+    return digest
 
 
 def _btn(
@@ -25,7 +51,8 @@ def _btn(
     return InlineKeyboardButton(**data)
 
 
-def main_menu_inline_kb(is_admin: bool = False) -> InlineKeyboardMarkup:
+@lru_cache(maxsize=None)
+def main_menu_inline_kb(is_admin: bool = False) -> SharedMarkup:
     buttons = [
         [
             _btn("🛰 Мои прокси", callback_data="menu:proxies", style=STYLE_PRIMARY),
@@ -45,30 +72,34 @@ def main_menu_inline_kb(is_admin: bool = False) -> InlineKeyboardMarkup:
     ]
     if is_admin:
         buttons.append([_btn("🛠 Админка", callback_data="menu:admin", style=STYLE_PRIMARY)])
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    return SharedMarkup(inline_keyboard=buttons)
 
 
-def back_main_kb() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
+@lru_cache(maxsize=None)
+def back_main_kb() -> SharedMarkup:
+    return SharedMarkup(
         inline_keyboard=[[_btn("⬅️ Назад", callback_data="menu:main", style=STYLE_DANGER)]]
     )
 
 
-def referral_share_kb(ref_url: str) -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
+@lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+def referral_share_kb(ref_url: str) -> SharedMarkup:
+    return SharedMarkup(
         inline_keyboard=[
             [_btn("Подключить прокси для Telegram", url=ref_url, style=STYLE_SUCCESS)],
         ]
     )
 
 
-def support_cancel_kb() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
+@lru_cache(maxsize=None)
+def support_cancel_kb() -> SharedMarkup:
+    return SharedMarkup(
         inline_keyboard=[[_btn("❌ Отмена", callback_data="menu:main", style=STYLE_DANGER)]]
     )
 
 
-def support_user_kb(ticket_id: int | None = None) -> InlineKeyboardMarkup:
+@lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+def support_user_kb(ticket_id: int | None = None) -> SharedMarkup:
     rows = []
     if ticket_id:
         rows.append(
@@ -81,11 +112,12 @@ def support_user_kb(ticket_id: int | None = None) -> InlineKeyboardMarkup:
             ]
         )
     rows.append([_btn("❌ Отмена", callback_data="menu:main", style=STYLE_DANGER)])
-    return InlineKeyboardMarkup(inline_keyboard=rows)
+    return SharedMarkup(inline_keyboard=rows)
 
 
-def support_user_close_kb(ticket_id: int) -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
+@lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+def support_user_close_kb(ticket_id: int) -> SharedMarkup:
+    return SharedMarkup(
         inline_keyboard=[
             [_btn("✅ Закрыть тикет", callback_data=f"support:close_user:{ticket_id}", style=STYLE_DANGER)],
             [_btn("⬅️ В главное меню", callback_data="menu:main", style=STYLE_DANGER)],
@@ -93,8 +125,9 @@ def support_user_close_kb(ticket_id: int) -> InlineKeyboardMarkup:
     )
 
 
-def support_admin_reply_kb() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
+@lru_cache(maxsize=None)
+def support_admin_reply_kb() -> SharedMarkup:
+    return SharedMarkup(
         inline_keyboard=[[_btn("❌ Отмена", callback_data="support:reply_cancel", style=STYLE_DANGER)]]
     )
 
@@ -103,11 +136,12 @@ def support_admin_ticket_kb(ticket_id: int) -> InlineKeyboardMarkup:
     return support_admin_ticket_kb_ext(ticket_id)
 
 
+@lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
 def support_admin_ticket_kb_ext(
     ticket_id: int,
     show_back: bool = False,
     show_refresh: bool = False,
-) -> InlineKeyboardMarkup:
+) -> SharedMarkup:
     rows = [
         [
             _btn("Ответить", callback_data=f"support:reply:{ticket_id}", style=STYLE_SUCCESS),
@@ -118,10 +152,11 @@ def support_admin_ticket_kb_ext(
         rows.append([_btn("🔄 Обновить", callback_data=f"admin_support:open:{ticket_id}", style=STYLE_PRIMARY)])
     if show_back:
         rows.append([_btn("⬅️ Назад", callback_data="admin:support", style=STYLE_DANGER)])
-    return InlineKeyboardMarkup(inline_keyboard=rows)
+    return SharedMarkup(inline_keyboard=rows)
 
 
-def admin_menu_inline_kb() -> InlineKeyboardMarkup:
+@lru_cache(maxsize=None)
+def admin_menu_inline_kb() -> SharedMarkup:
     buttons = [
         [
             _btn("📊 Статистика", callback_data="admin:stats", style=STYLE_PRIMARY),
@@ -141,16 +176,20 @@ def admin_menu_inline_kb() -> InlineKeyboardMarkup:
         ],
         [
             _btn("💳 FreeKassa", callback_data="admin:freekassa", style=STYLE_PRIMARY),
+            _btn("⏱ Производительность", callback_data="admin:perf", style=STYLE_PRIMARY),
         ],
         [
             _btn("📦 Экспорт", callback_data="admin:export", style=STYLE_PRIMARY),
             _btn("📣 Рассылка", callback_data="admin:broadcast", style=STYLE_PRIMARY),
         ],
+        [
+            _btn("📈 Прогноз", callback_data="admin:forecast", style=STYLE_PRIMARY),
+        ],
         [
             _btn("⬅️ Назад", callback_data="menu:main", style=STYLE_DANGER),
         ],
     ]
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    return SharedMarkup(inline_keyboard=buttons)
 
 
 def admin_support_list_kb(items: list[dict]) -> InlineKeyboardMarkup:
@@ -162,12 +201,13 @@ def admin_support_list_kb(items: list[dict]) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
-def admin_referrals_kb() -> InlineKeyboardMarkup:
+@lru_cache(maxsize=None)
+def admin_referrals_kb() -> SharedMarkup:
     buttons = [
         [_btn("Создать ссылку", callback_data="admin:ref_create", style=STYLE_SUCCESS)],
         [_btn("⬅️ Назад", callback_data="menu:admin", style=STYLE_DANGER)],
     ]
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    return SharedMarkup(inline_keyboard=buttons)
 
 
 def admin_referrals_list_kb(codes: list[str]) -> InlineKeyboardMarkup:
@@ -179,15 +219,17 @@ def admin_referrals_list_kb(codes: list[str]) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
-def admin_ref_delete_confirm_kb(code: str) -> InlineKeyboardMarkup:
+@lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+def admin_ref_delete_confirm_kb(code: str) -> SharedMarkup:
     buttons = [
         [_btn("✅ Удалить", callback_data=f"admin_ref_del_confirm:{code}", style=STYLE_DANGER)],
         [_btn("❌ Отмена", callback_data="admin:referrals", style=STYLE_DANGER)],
     ]
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    return SharedMarkup(inline_keyboard=buttons)
 
 
-def admin_user_actions_kb(user_id: int, blocked: bool) -> InlineKeyboardMarkup:
+@lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+def admin_user_actions_kb(user_id: int, blocked: bool) -> SharedMarkup:
     block_label = "Разблок" if blocked else "Блок"
     block_style = STYLE_SUCCESS if blocked else STYLE_DANGER
     buttons = [
@@ -218,14 +260,28 @@ def admin_user_actions_kb(user_id: int, blocked: bool) -> InlineKeyboardMarkup:
             _btn("⬅️ Назад", callback_data="menu:admin", style=STYLE_DANGER),
         ],
     ]
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    return SharedMarkup(inline_keyboard=buttons)
 
 
 def _bool_label(value: str | None) -> str:
     return "Вкл" if (value or "0") == "1" else "Выкл"
 
 
-def admin_settings_kb(settings: dict[str, str]) -> InlineKeyboardMarkup:
+_settings_kb: Optional[Tuple[int, SharedMarkup]] = None
+
+
+def admin_settings_kb(settings: dict[str, str], version: int | None = None) -> InlineKeyboardMarkup:
+    # With dao.settings_version() the keyboard is rebuilt only after a setting actually changed.
+    global _settings_kb
+    if version is not None and _settings_kb is not None and _settings_kb[0] == version:
+        return _settings_kb[1]
+    markup = _build_admin_settings_kb(settings)
+    if version is not None:
+        _settings_kb = (version, markup)
+    return markup
+
+
+def _build_admin_settings_kb(settings: dict[str, str]) -> SharedMarkup:
     def val(key: str, default: str = "") -> str:
         return settings.get(key, default)
 
@@ -381,15 +437,59 @@ def admin_settings_kb(settings: dict[str, str]) -> InlineKeyboardMarkup:
                 style=STYLE_PRIMARY,
             ),
         ],
+        [
+            _btn(
+                f"Антифлуд/мин: {val('flood_user_budget_per_min', '30')}",
+                callback_data="admin_settings_edit:flood_user_budget_per_min",
+                style=STYLE_PRIMARY,
+            ),
+            _btn(
+                f"Общий лимит/с: {val('flood_global_per_sec', '50')}",
+                callback_data="admin_settings_edit:flood_global_per_sec",
+                style=STYLE_PRIMARY,
+            ),
+        ],
+        [
+            _btn(
+                "Веса действий",
+                callback_data="admin_settings_edit:flood_costs",
+                style=STYLE_PRIMARY,
+            ),
+        ],
+        [
+            _btn(
+                f"Срок платежа: {val('payment_pending_ttl_hours', '48')} ч",
+                callback_data="admin_settings_edit:payment_pending_ttl_hours",
+                style=STYLE_PRIMARY,
+            ),
+            _btn(
+                f"Уведомл. об истечении: {_bool_label(val('payment_expiry_notify', '1'))}",
+                callback_data="admin_settings_toggle:payment_expiry_notify",
+                style=toggle_style("payment_expiry_notify", "1"),
+            ),
+        ],
+        [
+            _btn(
+                f"Архив платежей: {val('payment_archive_days', '90')} дн.",
+                callback_data="admin_settings_edit:payment_archive_days",
+                style=STYLE_PRIMARY,
+            ),
+            _btn(
+                "Сроки хранения",
+                callback_data="admin_settings_edit:retention_days",
+                style=STYLE_PRIMARY,
+            ),
+        ],
         [
             _btn("⬅️ Назад", callback_data="menu:admin", style=STYLE_DANGER),
         ],
     ]
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    return SharedMarkup(inline_keyboard=buttons)
 
 
-def mtproxy_status_kb() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
+@lru_cache(maxsize=None)
+def mtproxy_status_kb() -> SharedMarkup:
+    return SharedMarkup(
         inline_keyboard=[
             [_btn("🔄 Обновить", callback_data="admin:mtproxy_refresh", style=STYLE_PRIMARY)],
             [_btn("📄 Логи", callback_data="admin:mtproxy_logs", style=STYLE_PRIMARY)],
@@ -398,8 +498,24 @@ def mtproxy_status_kb() -> InlineKeyboardMarkup:
     )
 
 
-def freekassa_status_kb() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
+@lru_cache(maxsize=None)
+def perf_report_kb() -> SharedMarkup:
+    return SharedMarkup(
+        inline_keyboard=[
+            [_btn("🔄 Обновить", callback_data="admin:perf_refresh", style=STYLE_PRIMARY)],
+            [
+                _btn("📄 Стеки", callback_data="admin:perf_stacks", style=STYLE_PRIMARY),
+                _btn("🗄 SQL", callback_data="admin:perf_sql", style=STYLE_PRIMARY),
+            ],
+            [_btn("🧹 Сбросить", callback_data="admin:perf_reset", style=STYLE_DANGER)],
+            [_btn("⬅️ Назад", callback_data="menu:admin", style=STYLE_DANGER)],
+        ]
+    )
+
+
+@lru_cache(maxsize=None)
+def freekassa_status_kb() -> SharedMarkup:
+    return SharedMarkup(
         inline_keyboard=[
             [_btn("🔄 Обновить", callback_data="admin:freekassa_refresh", style=STYLE_PRIMARY)],
             [_btn("⬅️ Назад", callback_data="menu:admin", style=STYLE_DANGER)],
@@ -407,8 +523,9 @@ def freekassa_status_kb() -> InlineKeyboardMarkup:
     )
 
 
-def help_kb() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
+@lru_cache(maxsize=None)
+def help_kb() -> SharedMarkup:
+    return SharedMarkup(
         inline_keyboard=[
             [_btn("Как включить/выключить", callback_data="help:toggle", style=STYLE_PRIMARY)],
             [_btn("Не подключается", callback_data="help:fail", style=STYLE_PRIMARY)],
@@ -418,16 +535,18 @@ def help_kb() -> InlineKeyboardMarkup:
     )
 
 
-def help_detail_kb() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
+@lru_cache(maxsize=None)
+def help_detail_kb() -> SharedMarkup:
+    return SharedMarkup(
         inline_keyboard=[
             [_btn("⬅️ Назад", callback_data="menu:help", style=STYLE_DANGER)],
         ]
     )
 
 
-def admin_users_kb() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
+@lru_cache(maxsize=None)
+def admin_users_kb() -> SharedMarkup:
+    return SharedMarkup(
         inline_keyboard=[
             [_btn("🔎 Поиск", callback_data="admin_users:search", style=STYLE_PRIMARY)],
             [
@@ -452,8 +571,9 @@ def admin_users_list_kb(users: list[dict]) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
-def admin_export_kb() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
+@lru_cache(maxsize=None)
+def admin_export_kb() -> SharedMarkup:
+    return SharedMarkup(
         inline_keyboard=[
             [
                 _btn("Users", callback_data="admin_export:users", style=STYLE_PRIMARY),
@@ -486,27 +606,35 @@ def admin_user_proxies_kb(proxies: list[dict], user_id: int) -> InlineKeyboardMa
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
-def proxies_list_kb(proxies: list[dict]) -> InlineKeyboardMarkup:
+def proxies_list_kb(proxies: list[dict]) -> SharedMarkup:
+    # Keyed by what the buttons show, so an unchanged proxy list reuses its keyboard.
+    return _proxies_list_kb(tuple((p["id"], p["login"]) for p in proxies))
+
+
+@lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+def _proxies_list_kb(items: tuple) -> SharedMarkup:
     buttons = []
-    for p in proxies:
+    for proxy_id, login in items:
         buttons.append(
             [
-                _btn(p["login"], callback_data=f"proxy:show:{p['id']}", style=STYLE_PRIMARY),
-                _btn("🗑", callback_data=f"proxy:delete:{p['id']}", style=STYLE_DANGER),
+                _btn(login, callback_data=f"proxy:show:{proxy_id}", style=STYLE_PRIMARY),
+                _btn("🗑", callback_data=f"proxy:delete:{proxy_id}", style=STYLE_DANGER),
             ]
         )
     buttons.append([_btn("⬅️ Назад", callback_data="menu:main", style=STYLE_DANGER)])
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    return SharedMarkup(inline_keyboard=buttons)
 
 
-def proxy_detail_kb() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
+@lru_cache(maxsize=None)
+def proxy_detail_kb() -> SharedMarkup:
+    return SharedMarkup(
         inline_keyboard=[[_btn("⬅️ Назад", callback_data="menu:proxies", style=STYLE_DANGER)]]
     )
 
 
-def proxies_empty_kb() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
+@lru_cache(maxsize=None)
+def proxies_empty_kb() -> SharedMarkup:
+    return SharedMarkup(
         inline_keyboard=[
             [_btn("➕ Купить прокси", callback_data="proxy:buy", style=STYLE_SUCCESS)],
             [_btn("⬅️ Назад", callback_data="menu:main", style=STYLE_DANGER)],
@@ -514,8 +642,9 @@ def proxies_empty_kb() -> InlineKeyboardMarkup:
     )
 
 
-def proxy_delete_confirm_kb(proxy_id: int) -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
+@lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+def proxy_delete_confirm_kb(proxy_id: int) -> SharedMarkup:
+    return SharedMarkup(
         inline_keyboard=[
             [
                 _btn("✅ Да, удалить", callback_data=f"proxy:delete_confirm:{proxy_id}", style=STYLE_DANGER),
@@ -525,18 +654,20 @@ def proxy_delete_confirm_kb(proxy_id: int) -> InlineKeyboardMarkup:
     )
 
 
-def topup_method_kb(stars_enabled: bool, freekassa_enabled: bool) -> InlineKeyboardMarkup:
+@lru_cache(maxsize=None)
+def topup_method_kb(stars_enabled: bool, freekassa_enabled: bool) -> SharedMarkup:
     buttons = []
     if stars_enabled:
         buttons.append([_btn("⭐ Stars", callback_data="topup:method:stars", style=STYLE_PRIMARY)])
     if freekassa_enabled:
         buttons.append([_btn("💳 FreeKassa", callback_data="topup:method:freekassa", style=STYLE_PRIMARY)])
     buttons.append([_btn("⬅️ Назад", callback_data="menu:main", style=STYLE_DANGER)])
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    return SharedMarkup(inline_keyboard=buttons)
 
 
-def topup_recommend_days_kb() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
+@lru_cache(maxsize=None)
+def topup_recommend_days_kb() -> SharedMarkup:
+    return SharedMarkup(
         inline_keyboard=[
             [
                 _btn("На 7 дней", callback_data="topup:rec:7", style=STYLE_SUCCESS),
@@ -563,12 +694,13 @@ def _fmt_money(value: float) -> str:
     return f"{value:.2f}".rstrip("0").rstrip(".")
 
 
+@lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
 def freekassa_method_kb(
     amount: int,
     enable_44: bool = True,
     enable_36: bool = True,
     enable_43: bool = True,
-) -> InlineKeyboardMarkup:
+) -> SharedMarkup:
     buttons = []
     if enable_44 and amount >= 10:
         total_44 = _fmt_money(_fk_fee_total(amount, 44))
@@ -587,10 +719,11 @@ def freekassa_method_kb(
         )
     buttons.append([_btn("⬅️ Назад", callback_data="fk:amounts_back", style=STYLE_DANGER)])
     buttons.append([_btn("⬅️ В главное меню", callback_data="menu:main", style=STYLE_DANGER)])
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    return SharedMarkup(inline_keyboard=buttons)
 
 
-def freekassa_amount_kb() -> InlineKeyboardMarkup:
+@lru_cache(maxsize=None)
+def freekassa_amount_kb() -> SharedMarkup:
     buttons = [
         [_btn("📅 На 7 дней", callback_data="topup:days:freekassa:7", style=STYLE_PRIMARY)],
         [
@@ -607,10 +740,11 @@ def freekassa_amount_kb() -> InlineKeyboardMarkup:
         [_btn("⬅️ К способам оплаты", callback_data="menu:topup", style=STYLE_DANGER)],
         [_btn("⬅️ Назад", callback_data="menu:main", style=STYLE_DANGER)],
     ]
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    return SharedMarkup(inline_keyboard=buttons)
 
 
-def topup_quick_kb(method: str, show_method_back: bool = False) -> InlineKeyboardMarkup:
+@lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+def topup_quick_kb(method: str, show_method_back: bool = False) -> SharedMarkup:
     buttons = [
         [_btn("📅 На 7 дней", callback_data=f"topup:days:{method}:7", style=STYLE_PRIMARY)],
         [
@@ -628,7 +762,7 @@ def topup_quick_kb(method: str, show_method_back: bool = False) -> InlineKeyboar
     if show_method_back:
         buttons.append([_btn("⬅️ К способам оплаты", callback_data="menu:topup", style=STYLE_DANGER)])
     buttons.append([_btn("⬅️ Назад", callback_data="menu:main", style=STYLE_DANGER)])
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    return SharedMarkup(inline_keyboard=buttons)
 
 
 def freekassa_pay_kb(payment_id: int, pay_url: str) -> InlineKeyboardMarkup:
@@ -650,7 +784,8 @@ def proxies_select_kb(action: str, proxies: list[dict]) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
-def broadcast_filters_kb() -> InlineKeyboardMarkup:
+@lru_cache(maxsize=None)
+def broadcast_filters_kb() -> SharedMarkup:
     buttons = [
         [_btn("Всем", callback_data="broadcast:all", style=STYLE_PRIMARY)],
         [_btn("Активные 7д", callback_data="broadcast:active7", style=STYLE_PRIMARY)],
@@ -658,4 +793,4 @@ def broadcast_filters_kb() -> InlineKeyboardMarkup:
         [_btn("Баланс > 0", callback_data="broadcast:balance_pos", style=STYLE_PRIMARY)],
         [_btn("Отмена", callback_data="broadcast:cancel", style=STYLE_DANGER)],
     ]
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    return SharedMarkup(inline_keyboard=buttons)
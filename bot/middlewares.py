@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+from bot.services.flood_control import admit
+from bot.services.metrics import FLOOD_REJECTIONS, TELEGRAM_API_ERRORS, TELEGRAM_API_SECONDS, current_scope
+
+FLOOD_NOTICE = "Слишком часто. Подождите немного."
+
+
+class HandlerLabelMiddleware(BaseMiddleware):
+    # Inner middleware: only here the matched handler is known.
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        scope = current_scope.get()
+        # Callbacks go through one CallbackRoutes handler per router; the routed function is the real label.
+        handler_obj = data.get("callback_route") or data.get("handler")
+        if scope is not None and handler_obj is not None:
+            scope.handler = getattr(handler_obj.callback, "__name__", "unknown")
+        return await handler(event, data)
+
+
+class FloodControlMiddleware(BaseMiddleware):
+    # Outer middleware: runs before filters and handlers, so a rejected update never opens the DB.
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if isinstance(event, CallbackQuery):
+            kind, action = "callback", event.data or ""
+        elif isinstance(event, Message):
+            if event.successful_payment is not None:
+                return await handler(event, data)
+            text = event.text or ""
+            kind, action = "message", text.split(" ", 1)[0] if text.startswith("/") else "message"
+        else:
+            return await handler(event, data)
+
+        user = event.from_user
+        reason = admit(user.id if user else None, action)
+        if reason is None:
+            return await handler(event, data)
+
+        FLOOD_REJECTIONS.inc(reason, kind)
+        scope = current_scope.get()
+        if scope is not None:
+            scope.handler = "flood_rejected"
+        if isinstance(event, CallbackQuery):
+            try:
+                await event.answer(FLOOD_NOTICE)
+            except Exception:
+                pass
+        return None
+
+
+class TelegramApiMetricsMiddleware(BaseRequestMiddleware):
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter:
+            TELEGRAM_API_ERRORS.inc(name, "retry_after")
+            raise
+        except Exception:
+            TELEGRAM_API_ERRORS.inc(name, "error")
+            raise
+        finally:
+            TELEGRAM_API_SECONDS.observe(time.perf_counter() - started, name)
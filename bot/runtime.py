@@ -3,6 +3,8 @@ from __future__ import annotations
 from dataclasses import dataclass
 from typing import Optional
 
+from aiogram.types import User
+
 from bot.services.proxy_provider import ProxyProvider
 from bot.config import Config
 
@@ -17,7 +19,18 @@ class Runtime:
     mtproxy_restart_required: bool = False
     bg_enabled: bool = True
     bg_path: Optional[str] = None
+    bg_file_id: Optional[str] = None
+    bg_file_signature: Optional[str] = None
+    bot_info: Optional[User] = None
     last_freekassa_reconcile_ts: Optional[float] = None
+    is_leader: bool = False
+    leader_id: Optional[str] = None
+    # Set once every epoch *_ts column is backfilled; until then the DAO compares the ISO text columns.
+    epoch_ts_ready: bool = False
+    # Startup warm-up finished (GET /ready).
+    ready: bool = False
+    # The write-behind flusher is running: user bookkeeping writes are buffered in dao until it flushes them.
+    write_behind: bool = False
 
 
 runtime = Runtime()
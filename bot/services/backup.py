@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import gzip
+import os
+import shutil
+import sqlite3
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
+
+from bot.runtime import runtime
+from bot.services.metrics import BACKUP_LAST_BYTES, BACKUP_LAST_SECONDS, BACKUP_LAST_SUCCESS
+
+BACKUP_PREFIX = "bot-"
+BACKUP_SUFFIX = ".db.gz"
+
+
+@dataclass
+class BackupResult:
+    path: str
+    size_bytes: int
+    db_bytes: int
+    duration_sec: float
+    integrity: str
+    # Times a step saw the source change underneath it and the copy started over.
+    restarts: int = 0
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def backup_dir() -> str:
+    config = runtime.config
+    if config is None:
+        return os.path.join("data", "backups")
+    return config.backup_dir or os.path.join(os.path.dirname(config.db_path), "backups")
+
+
+def list_backups(directory: str) -> List[str]:
+    path = Path(directory)
+    if not path.is_dir():
+        return []
+    return sorted(str(item) for item in path.glob(f"{BACKUP_PREFIX}*{BACKUP_SUFFIX}"))
+
+
+def integrity_check(path: str) -> str:
+    conn = sqlite3.connect(path)
+    try:
+        rows = conn.execute("PRAGMA integrity_check").fetchall()
+    finally:
+        conn.close()
+    return "; ".join(str(row[0]) for row in rows[:5])
+
+
+def _copy(src: sqlite3.Connection, dst: sqlite3.Connection, pages: int, sleep: float, max_restarts: int) -> int:
+    restarts = 0
+    last_remaining: Optional[int] = None
+
+    def progress(status: int, remaining: int, total: int) -> None:
+        nonlocal restarts, last_remaining
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts > max_restarts:
+                raise _TooManyRestarts()
+        last_remaining = remaining
+
+    try:
+        src.backup(dst, pages=pages, progress=progress, sleep=sleep)
+    except _TooManyRestarts:
+        # A busy writer keeps invalidating the stepped copy. One step holds a single read snapshot,
+        # which under WAL still does not block writers (it only delays checkpointing past it).
+        src.backup(dst, pages=-1)
+    return restarts
+
+
+def backup_database(
+    db_path: str,
+    directory: str,
+    keep: int = 7,
+    pages: int = 256,
+    sleep: float = 0.01,
+    max_restarts: int = 20,
+) -> BackupResult:
+    """Blocking: copies the live DB with the online backup API, verifies and gzips it. Run in a thread."""
+    started = time.perf_counter()
+    os.makedirs(directory, exist_ok=True)
+    name = f"{BACKUP_PREFIX}{datetime.utcnow():%Y%m%d-%H%M%S}"
+    raw_path = os.path.join(directory, f".{name}.db.tmp")
+    final_path = os.path.join(directory, f"{name}{BACKUP_SUFFIX}")
+    try:
+        src = sqlite3.connect(db_path)
+        dst = sqlite3.connect(raw_path)
+        try:
+            restarts = _copy(src, dst, pages, sleep, max_restarts)
+            # The copy inherits WAL mode from the source; a rollback-journal file is self-contained.
+            dst.execute("PRAGMA journal_mode = DELETE")
+        finally:
+            dst.close()
+            src.close()
+        integrity = integrity_check(raw_path)
+        if integrity != "ok":
+            raise RuntimeError(f"integrity_check failed: {integrity}")
+        db_bytes = os.path.getsize(raw_path)
+        with open(raw_path, "rb") as fin, gzip.open(final_path + ".tmp", "wb", compresslevel=6) as fout:
+            shutil.copyfileobj(fin, fout, 1024 * 1024)
+        os.replace(final_path + ".tmp", final_path)
+    finally:
+        for leftover in (raw_path, final_path + ".tmp"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+    prune_backups(directory, keep)
+    result = BackupResult(
+        path=final_path,
+        size_bytes=os.path.getsize(final_path),
+        db_bytes=db_bytes,
+        duration_sec=time.perf_counter() - started,
+        integrity=integrity,
+        restarts=restarts,
+    )
+    BACKUP_LAST_SUCCESS.set(value=time.time())
+    BACKUP_LAST_SECONDS.set(value=result.duration_sec)
+    BACKUP_LAST_BYTES.set(value=float(result.size_bytes))
+    return result
+
+
+def prune_backups(directory: str, keep: int) -> List[str]:
+    backups = list_backups(directory)
+    removed = backups[: max(0, len(backups) - max(1, keep))]
+    for path in removed:
+        os.remove(path)
+    return removed
+
+
+def last_backup_ts(directory: str) -> float:
+    backups = list_backups(directory)
+    return os.path.getmtime(backups[-1]) if backups else 0.0
+
+
+def restore_backup(backup_path: str, db_path: str) -> str:
+    """Replaces db_path with a verified backup; the bot must be stopped. Returns where the old DB was moved."""
+    tmp_path = db_path + ".restore.tmp"
+    with gzip.open(backup_path, "rb") as fin, open(tmp_path, "wb") as fout:
+        shutil.copyfileobj(fin, fout, 1024 * 1024)
+    integrity = integrity_check(tmp_path)
+    if integrity != "ok":
+        os.remove(tmp_path)
+        raise RuntimeError(f"integrity_check failed: {integrity}")
+    previous = ""
+    if os.path.exists(db_path):
+        previous = f"{db_path}.before-restore-{datetime.utcnow():%Y%m%d-%H%M%S}"
+        # Fold the WAL into the old file first so the moved-aside copy is complete on its own.
+        conn = sqlite3.connect(db_path)
+        try:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        finally:
+            conn.close()
+        os.replace(db_path, previous)
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    os.replace(tmp_path, db_path)
+    return previous
@@ -1,7 +1,8 @@
 from __future__ import annotations
 
+import time
 from dataclasses import dataclass
-from datetime import datetime, date
+from datetime import datetime
 from typing import Optional, Dict, List
 
 import aiosqlite
@@ -15,14 +16,8 @@ class BillingResult:
     changed: bool
     disabled_by_balance: Dict[int, List[aiosqlite.Row]]
     low_balance_warnings: Dict[int, dict]
-
-def _parse_date(value: Optional[str]) -> Optional[date]:
-    if not value:
-        return None
-    try:
-        return datetime.fromisoformat(value.replace("Z", "")).date()
-    except Exception:
-        return None
+    # Earliest next_bill_at left after this run; None when billing is off or nothing is active.
+    next_due_at: Optional[int] = None
 
 
 async def run_billing_once(db: aiosqlite.Connection) -> BillingResult:
@@ -30,49 +25,58 @@ async def run_billing_once(db: aiosqlite.Connection) -> BillingResult:
     if day_price <= 0:
         return BillingResult(changed=False, disabled_by_balance={}, low_balance_warnings={})
 
-    today = datetime.utcnow().date()
-    proxies = await dao.get_active_proxies_for_billing(db)
+    now_ts = int(time.time())
+    today_key = datetime.utcfromtimestamp(now_ts).date().isoformat()
+    active_counts = await dao.count_active_proxies_for_due_users(db, now_ts)
+    proxies = await dao.get_due_proxies_for_billing(db, now_ts)
     changed = False
     disabled_by_balance: Dict[int, List[aiosqlite.Row]] = {}
     user_state: Dict[int, dict] = {}
+    charges: List[dao.LedgerEntry] = []
+    billed_ids: List[int] = []
     for proxy in proxies:
-        user_balance = int(proxy["user_balance"])
         user_blocked = proxy["user_blocked"] is not None
         user_deleted = proxy["user_deleted"] is not None
         state = user_state.setdefault(
             proxy["user_id"],
             {
-                "balance": user_balance,
+                "balance": int(proxy["user_balance"]),
                 "blocked": user_blocked,
                 "deleted": user_deleted,
                 "warn_at": proxy["user_warn_at"],
                 "warn_24h_at": proxy["user_warn_24h_at"],
                 "warn_6h_at": proxy["user_warn_6h_at"],
-                "active_count": 0,
+                "active_count": active_counts.get(proxy["user_id"], 0),
             },
         )
-        state["active_count"] += 1
 
         if user_deleted or user_blocked:
             await dao.set_proxy_status(db, proxy["id"], "disabled")
             changed = True
             continue
 
-        last_billed = _parse_date(proxy["last_billed_at"])
-        if last_billed == today:
-            continue
-
-        if user_balance >= day_price:
-            await dao.add_user_balance(db, proxy["user_id"], -day_price)
-            await dao.update_proxy_last_billed(db, proxy["id"])
+        # Every proxy row carries the same starting balance; charge against the running one.
+        if state["balance"] >= day_price:
+            state["balance"] -= day_price
+            charges.append(
+                (
+                    proxy["user_id"],
+                    "charge",
+                    -day_price,
+                    f"charge:{proxy['id']}:{today_key}",
+                    f"proxy:{proxy['id']}",
+                )
+            )
         else:
             await dao.set_proxy_status(db, proxy["id"], "disabled")
-            await dao.update_proxy_last_billed(db, proxy["id"])
             changed = True
             disabled_by_balance.setdefault(proxy["user_id"], []).append(proxy)
+        billed_ids.append(proxy["id"])
+
+    await dao.append_ledger_entries(db, charges)
+    await dao.update_proxies_last_billed(db, billed_ids)
 
     low_balance_warnings: Dict[int, dict] = {}
-    today_key = datetime.utcnow().date().isoformat()
     for user_id, state in user_state.items():
         if state["deleted"] or state["blocked"]:
             continue
@@ -108,4 +112,5 @@ async def run_billing_once(db: aiosqlite.Connection) -> BillingResult:
         changed=changed,
         disabled_by_balance=disabled_by_balance,
         low_balance_warnings=low_balance_warnings,
+        next_due_at=await dao.get_next_bill_at(db),
     )
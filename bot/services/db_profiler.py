@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import math
+import re
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional
+
+from bot.services.metrics import UPDATE_DB_STATEMENTS, UpdateScope, current_scope
+
+_MAX_STATEMENTS = 500
+_MAX_HANDLERS = 200
+_SAMPLES_PER_HANDLER = 500
+_RECENT = 200
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST_RE = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)+\s*\)", re.IGNORECASE)
+_SPACE_RE = re.compile(r"\s+")
+_normalized_cache: Dict[str, str] = {}
+
+
+def normalize_sql(sql: str) -> str:
+    cached = _normalized_cache.get(sql)
+    if cached is not None:
+        return cached
+    text = _STRING_RE.sub("?", sql)
+    text = _NUMBER_RE.sub("?", text)
+    text = _IN_LIST_RE.sub("IN (?...)", text)
+    text = _SPACE_RE.sub(" ", text).strip().rstrip(";")
+    if len(_normalized_cache) < 2048:
+        _normalized_cache[sql] = text
+    return text
+
+
+@dataclass
+class StatementStats:
+    sql: str
+    count: int = 0
+    total_sec: float = 0.0
+    max_sec: float = 0.0
+    rows: int = 0
+
+
+@dataclass
+class StatementRecord:
+    update_id: Optional[int]
+    handler: str
+    sql: str
+    seconds: float
+    rows: int = 0
+
+
+@dataclass
+class _Budget:
+    limit: int
+    statements: List[str] = field(default_factory=list)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+_budget: ContextVar[Optional[_Budget]] = ContextVar("db_query_budget", default=None)
+
+
+def _percentile(values: List[int], pct: float) -> int:
+    if not values:
+        return 0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class DbProfiler:
+    def __init__(self) -> None:
+        self.statements: "OrderedDict[str, StatementStats]" = OrderedDict()
+        self.per_handler: Dict[str, Deque[int]] = {}
+        self.recent: Deque[StatementRecord] = deque(maxlen=_RECENT)
+
+    def record(self, sql: str, seconds: float) -> StatementRecord:
+        normalized = normalize_sql(sql)
+        stats = self.statements.get(normalized)
+        if stats is None:
+            if len(self.statements) >= _MAX_STATEMENTS:
+                self.statements.popitem(last=False)
+            stats = self.statements[normalized] = StatementStats(sql=normalized)
+        stats.count += 1
+        stats.total_sec += seconds
+        stats.max_sec = max(stats.max_sec, seconds)
+
+        scope = current_scope.get()
+        if scope is not None:
+            scope.statements += 1
+        record = StatementRecord(
+            update_id=scope.update_id if scope else None,
+            handler=scope.handler if scope else "background",
+            sql=normalized,
+            seconds=seconds,
+        )
+        self.recent.append(record)
+
+        budget = _budget.get()
+        if budget is not None:
+            budget.statements.append(normalized)
+        return record
+
+    def record_rows(self, record: Optional[StatementRecord], rows: int) -> None:
+        if record is None or rows <= 0:
+            return
+        record.rows += rows
+        stats = self.statements.get(record.sql)
+        if stats is not None:
+            stats.rows += rows
+
+    def finish_update(self, scope: UpdateScope) -> None:
+        samples = self.per_handler.get(scope.handler)
+        if samples is None:
+            if len(self.per_handler) >= _MAX_HANDLERS:
+                return
+            samples = self.per_handler[scope.handler] = deque(maxlen=_SAMPLES_PER_HANDLER)
+        samples.append(scope.statements)
+        UPDATE_DB_STATEMENTS.observe(scope.statements, scope.handler)
+
+    def handler_summary(self) -> List[dict]:
+        rows = []
+        for handler, samples in self.per_handler.items():
+            values = list(samples)
+            rows.append(
+                {
+                    "handler": handler,
+                    "updates": len(values),
+                    "p50": _percentile(values, 50),
+                    "p99": _percentile(values, 99),
+                    "max": max(values) if values else 0,
+                }
+            )
+        rows.sort(key=lambda item: (item["p99"], item["p50"]), reverse=True)
+        return rows
+
+    def top_statements(self, limit: int = 20) -> List[StatementStats]:
+        items = list(self.statements.values())
+        items.sort(key=lambda item: item.total_sec, reverse=True)
+        return items[:limit]
+
+    def assert_max_queries(self, handler: str, max_queries: int) -> None:
+        samples = self.per_handler.get(handler)
+        if not samples:
+            raise QueryBudgetExceeded(f"no updates recorded for handler {handler!r}")
+        worst = max(samples)
+        if worst > max_queries:
+            raise QueryBudgetExceeded(
+                f"{handler} ran {worst} statements per update, budget is {max_queries}"
+            )
+
+    def reset(self) -> None:
+        self.statements.clear()
+        self.per_handler.clear()
+        self.recent.clear()
+
+
+@contextmanager
+def query_budget(max_queries: int):
+    """Fail if the wrapped block issues more than `max_queries` SQL statements.
+
+    Meant for tests and benchmarks: wrap one feed_update() or handler call.
+    """
+    budget = _Budget(limit=max_queries)
+    token = _budget.set(budget)
+    try:
+        yield budget
+    finally:
+        _budget.reset(token)
+    if len(budget.statements) > max_queries:
+        listing = "\n".join(f"  {sql}" for sql in budget.statements)
+        raise QueryBudgetExceeded(
+            f"{len(budget.statements)} statements, budget is {max_queries}:\n{listing}"
+        )
+
+
+db_profiler = DbProfiler()
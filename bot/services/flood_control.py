@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+import aiosqlite
+
+from bot import dao
+from bot.db import DEFAULT_SETTINGS
+from bot.services.rate_limit import consume
+
+SETTING_KEYS = ("flood_user_budget_per_min", "flood_global_per_sec", "flood_costs")
+DEFAULT_COSTS = DEFAULT_SETTINGS["flood_costs"]
+
+
+@dataclass(frozen=True)
+class FloodPolicy:
+    user_budget_per_min: float = 30.0
+    global_per_sec: float = 50.0
+    # (prefix, cost), longest prefix first.
+    costs: Tuple[Tuple[str, float], ...] = ()
+
+    def cost_for(self, action: str) -> float:
+        for prefix, cost in self.costs:
+            if action.startswith(prefix):
+                return cost
+        return 1.0
+
+
+def parse_costs(raw: str) -> Tuple[Tuple[str, float], ...]:
+    costs: Dict[str, float] = {}
+    for item in (raw or "").split(","):
+        prefix, sep, value = item.strip().rpartition("=")
+        if not sep or not prefix.strip():
+            continue
+        try:
+            costs[prefix.strip()] = max(0.0, float(value))
+        except ValueError:
+            continue
+    return tuple(sorted(costs.items(), key=lambda item: len(item[0]), reverse=True))
+
+
+def _float(value: Optional[str], default: float) -> float:
+    try:
+        return float(value) if value not in (None, "") else default
+    except ValueError:
+        return default
+
+
+def policy_from_settings(settings_map: Dict[str, str]) -> FloodPolicy:
+    return FloodPolicy(
+        user_budget_per_min=_float(settings_map.get("flood_user_budget_per_min"), 30.0),
+        global_per_sec=_float(settings_map.get("flood_global_per_sec"), 50.0),
+        costs=parse_costs(settings_map.get("flood_costs", DEFAULT_COSTS)),
+    )
+
+
+# Kept in memory so the middleware can reject an update without touching the DB.
+_policy = FloodPolicy(costs=parse_costs(DEFAULT_COSTS))
+
+
+def get_policy() -> FloodPolicy:
+    return _policy
+
+
+async def reload_policy(db: aiosqlite.Connection) -> FloodPolicy:
+    global _policy
+    values = {key: await dao.get_setting(db, key) for key in SETTING_KEYS}
+    _policy = policy_from_settings({key: value for key, value in values.items() if value is not None})
+    return _policy
+
+
+def admit(user_id: Optional[int], action: str) -> Optional[str]:
+    """Returns None when the update may proceed, otherwise the rejection reason."""
+    policy = _policy
+    if not consume("flood:global", policy.global_per_sec, 1):
+        return "global"
+    if user_id is None:
+        return None
+    cost = policy.cost_for(action)
+    if cost <= 0:
+        return None
+    if not consume(f"flood:{user_id}", policy.user_budget_per_min, 60, cost):
+        return "user"
+    return None
@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import time
+from array import array
+from dataclasses import dataclass, field, replace
+from typing import Dict, List, Optional, Tuple
+
+import aiosqlite
+
+from bot import dao
+from bot.services.settings import get_int_setting
+
+try:
+    import numpy as np
+except Exception:  # pragma: no cover
+    np = None
+
+FORECAST_SETTINGS = ("proxy_day_price", "free_credit", "max_active_proxies")
+# Sign-ups per day for new cohorts are averaged over this many past days.
+SIGNUP_WINDOW_DAYS = 30
+
+
+@dataclass(frozen=True)
+class ForecastParams:
+    proxy_day_price: int
+    free_credit: int
+    max_active_proxies: int
+    signups_per_day: float = 0.0
+
+
+@dataclass
+class BillingBook:
+    # Parallel columns, one entry per distinct (balance, active proxies) pair; `users` is how many share it.
+    balance: array = field(default_factory=lambda: array("q"))
+    active: array = field(default_factory=lambda: array("q"))
+    users: array = field(default_factory=lambda: array("q"))
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+    def append(self, balance: int, active: int, users: int) -> None:
+        self.balance.append(balance)
+        self.active.append(active)
+        self.users.append(users)
+
+    @property
+    def total_users(self) -> int:
+        return sum(self.users)
+
+
+@dataclass
+class Forecast:
+    params: ForecastParams
+    days: int
+    # Index 0 is the first billing run from now (midnight UTC), one entry per day.
+    revenue: List[float]
+    disabled: List[float]
+    warnings: List[float]
+    backend: str
+    seconds: float
+
+    @property
+    def total_revenue(self) -> int:
+        return round(sum(self.revenue))
+
+    @property
+    def total_disabled(self) -> int:
+        return round(sum(self.disabled))
+
+    @property
+    def total_warnings(self) -> int:
+        return round(sum(self.warnings))
+
+    def windows(self, size: int = 7) -> List[Tuple[int, int, int, int, int]]:
+        # (first day, last day, revenue, disabled, warnings), days numbered from 1.
+        result = []
+        for start in range(0, self.days, size):
+            end = min(self.days, start + size)
+            result.append(
+                (
+                    start + 1,
+                    end,
+                    round(sum(self.revenue[start:end])),
+                    round(sum(self.disabled[start:end])),
+                    round(sum(self.warnings[start:end])),
+                )
+            )
+        return result
+
+
+async def load_params(db: aiosqlite.Connection, overrides: Optional[Dict[str, int]] = None) -> ForecastParams:
+    since = time.time() - SIGNUP_WINDOW_DAYS * 86400
+    signups = await dao.count_users_created_since(db, since)
+    params = ForecastParams(
+        proxy_day_price=await get_int_setting(db, "proxy_day_price", 0),
+        free_credit=await get_int_setting(db, "free_credit", 0),
+        max_active_proxies=await get_int_setting(db, "max_active_proxies", 0),
+        signups_per_day=signups / SIGNUP_WINDOW_DAYS,
+    )
+    return replace(params, **overrides) if overrides else params
+
+
+async def load_book(db: aiosqlite.Connection) -> BillingBook:
+    book = BillingBook()
+    for row in await dao.get_billing_book_rows(db):
+        book.append(int(row["balance"]), int(row["active"]), int(row["users"]))
+    return book
+
+
+def simulate(book: BillingBook, params: ForecastParams, days: int) -> Forecast:
+    """Projects billing for `days` runs without top-ups: revenue, proxies disabled and low-balance warnings per day.
+
+    Billing charges each active proxy proxy_day_price while the balance covers it and disables it otherwise, so
+    a user with balance B and K proxies pays K*price for B // (K*price) days, keeps B % (K*price) // price
+    proxies one day longer, and is warned on the last full day and on each disabling run. That closed form is
+    evaluated for every (balance, proxies) pair at once. New users (signups_per_day, free_credit, one proxy)
+    join every day from the first run on.
+
+    max_active_proxies does not change the projection: billing charges every active proxy whatever the limit,
+    which is only checked when a proxy is bought or re-enabled after a top-up, and neither happens here.
+    """
+    started = time.perf_counter()
+    days = max(0, int(days))
+    if params.proxy_day_price <= 0 or days == 0:
+        empty = [0.0] * days
+        return Forecast(params, days, empty, list(empty), list(empty), "none", time.perf_counter() - started)
+    if np is not None:
+        revenue, disabled, warnings = _simulate_numpy(book, params, days)
+        backend = "numpy"
+    else:
+        revenue, disabled, warnings = _simulate_array(book, params, days)
+        backend = "array"
+    if params.signups_per_day > 0:
+        # Every new user starts the same way, so one cohort's curve shifted by its sign-up day covers them all.
+        cohort = BillingBook()
+        cohort.append(params.free_credit, 1, 1)
+        unit = _simulate_array(cohort, params, days)
+        for totals, curve in zip((revenue, disabled, warnings), unit):
+            running = 0.0
+            for day in range(1, days):
+                running += curve[day - 1]
+                totals[day] += running * params.signups_per_day
+    return Forecast(params, days, revenue, disabled, warnings, backend, time.perf_counter() - started)
+
+
+def _simulate_numpy(book: BillingBook, params: ForecastParams, days: int) -> Tuple[List[float], ...]:
+    price = params.proxy_day_price
+    balance = np.maximum(np.frombuffer(book.balance, dtype=np.int64), 0)
+    active = np.frombuffer(book.active, dtype=np.int64)
+    users = np.frombuffer(book.users, dtype=np.int64).astype(np.float64)
+    daily = active * price
+    full = balance // daily
+    kept = (balance - full * daily) // price
+    # Bucket i is billing run i (1-based); anything past the horizon lands in the last bucket and is dropped.
+    size = days + 2
+
+    def spread(day, weights):
+        return np.bincount(np.minimum(day, days + 1), weights=weights, minlength=size)
+
+    paid = users * daily
+    revenue = np.cumsum(spread(np.ones_like(full), paid) - spread(full + 1, paid))
+    revenue += spread(full + 1, users * kept * price)
+    disabled = spread(full + 1, users * (active - kept)) + spread(full + 2, users * kept)
+    warnings = spread(full, users * (full > 0)) + spread(full + 1, users) + spread(full + 2, users * (kept > 0))
+    return (
+        revenue[1 : days + 1].tolist(),
+        disabled[1 : days + 1].tolist(),
+        warnings[1 : days + 1].tolist(),
+    )
+
+
+def _simulate_array(book: BillingBook, params: ForecastParams, days: int) -> Tuple[List[float], ...]:
+    price = params.proxy_day_price
+    # Same buckets as the NumPy path; full-day revenue goes through a difference array.
+    size = days + 2
+    revenue_delta = [0.0] * size
+    revenue = [0.0] * size
+    disabled = [0.0] * size
+    warnings = [0.0] * size
+    last = days + 1
+    for balance, active, users in zip(book.balance, book.active, book.users):
+        if balance < 0:
+            balance = 0
+        daily = active * price
+        full, rest = divmod(balance, daily)
+        kept = rest // price
+        paid = users * daily
+        revenue_delta[1] += paid
+        end = full + 1 if full < days else last
+        revenue_delta[end] -= paid
+        if end < last:
+            revenue[end] += users * kept * price
+            disabled[end] += users * (active - kept)
+            warnings[end] += users
+            if full > 0:
+                warnings[full] += users
+            if kept and end + 1 < last:
+                disabled[end + 1] += users * kept
+                warnings[end + 1] += users
+        elif full == days:
+            warnings[full] += users
+    running = 0.0
+    for day in range(1, last):
+        running += revenue_delta[day]
+        revenue[day] += running
+    return revenue[1:last], disabled[1:last], warnings[1:last]
@@ -9,6 +9,8 @@ from typing import Any, Dict
 
 import aiohttp
 
+from bot.services.metrics import FREEKASSA_API_SECONDS
+
 logger = logging.getLogger(__name__)
 
 
@@ -76,40 +78,41 @@ async def create_order(
         )
 
         async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30)) as session:
-            async with session.post(api_url, json=payload, headers=headers) as resp:
-                text = await resp.text()
-                payment_link = resp.headers.get("Location")
-                data: dict = {}
-                try:
-                    data = await resp.json(encoding="utf-8")
-                    if "location" in data and not payment_link:
-                        payment_link = data["location"]
-                except Exception:
-                    data = {"error": "Invalid JSON", "raw": text}
-
-                logger.info(
-                    "FreeKassa response: status=%s headers=%s body=%s",
-                    resp.status,
-                    dict(resp.headers),
-                    data
-                )
-
-                if resp.status != 200:
-                    return {"error": data.get("message") or data.get("error") or "FreeKassa error"}
-
-                if not payment_link:
-                    return {"error": "Не получена ссылка на оплату"}
-
-                # Исправляем невалидные URL от Freekassa (пробелы в параметрах)
-                if ' ' in payment_link and '?' in payment_link:
-                    base, params = payment_link.split('?', 1)
-                    payment_link = base + '?' + params.replace(' ', '%20')
-
-                return {
-                    "payment_link": payment_link,
-                    "order_id": data.get("orderId") or data.get("id"),
-                    "status": data.get("status"),
-                }
+            with FREEKASSA_API_SECONDS.time("orders/create"):
+                async with session.post(api_url, json=payload, headers=headers) as resp:
+                    text = await resp.text()
+                    payment_link = resp.headers.get("Location")
+                    data: dict = {}
+                    try:
+                        data = await resp.json(encoding="utf-8")
+                        if "location" in data and not payment_link:
+                            payment_link = data["location"]
+                    except Exception:
+                        data = {"error": "Invalid JSON", "raw": text}
+
+                    logger.info(
+                        "FreeKassa response: status=%s headers=%s body=%s",
+                        resp.status,
+                        dict(resp.headers),
+                        data
+                    )
+
+                    if resp.status != 200:
+                        return {"error": data.get("message") or data.get("error") or "FreeKassa error"}
+
+                    if not payment_link:
+                        return {"error": "Не получена ссылка на оплату"}
+
+                    # Исправляем невалидные URL от Freekassa (пробелы в параметрах)
+                    if ' ' in payment_link and '?' in payment_link:
+                        base, params = payment_link.split('?', 1)
+                        payment_link = base + '?' + params.replace(' ', '%20')
+
+                    return {
+                        "payment_link": payment_link,
+                        "order_id": data.get("orderId") or data.get("id"),
+                        "status": data.get("status"),
+                    }
     except Exception as exc:
         logger.error("FreeKassa create error: %s", exc, exc_info=True)
         return {"error": "FreeKassa error"}
@@ -130,15 +133,16 @@ async def get_currencies(api_base: str, api_key: str, shop_id: str) -> Dict[str,
 
     api_url = f"{api_base.rstrip('/')}/currencies"
     async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30)) as session:
-        async with session.post(api_url, json=payload, headers=headers) as resp:
-            data = {}
-            try:
-                data = await resp.json(encoding="utf-8")
-            except Exception:
-                data = {"error": await resp.text()}
-            if resp.status != 200:
-                return {"error": data.get("message") or data.get("error") or "FreeKassa error"}
-            return data
+        with FREEKASSA_API_SECONDS.time("currencies"):
+            async with session.post(api_url, json=payload, headers=headers) as resp:
+                data = {}
+                try:
+                    data = await resp.json(encoding="utf-8")
+                except Exception:
+                    data = {"error": await resp.text()}
+                if resp.status != 200:
+                    return {"error": data.get("message") or data.get("error") or "FreeKassa error"}
+                return data
 
 
 async def get_order_status(
@@ -162,54 +166,57 @@ async def get_order_status(
     async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30)) as session:
         # Preferred flow: orders list filtered by merchant paymentId
         try:
-            async with session.post(f"{base}/orders", json=payload, headers=headers) as resp:
-                text = await resp.text()
-                try:
-                    data = await resp.json(encoding="utf-8")
-                except Exception:
-                    data = {"raw": text}
-                if resp.status == 200:
-                    orders = data.get("orders")
-                    if isinstance(orders, list) and orders:
-                        # pick exact merchant order id if present
-                        target = None
-                        for item in orders:
-                            if str(item.get("merchant_order_id", "")) == str(payment_id):
-                                target = item
-                                break
-                        if target is None:
-                            target = orders[0]
-                        return {"status": target.get("status"), "order": target, "orders": orders}
-                    return data
+            with FREEKASSA_API_SECONDS.time("orders"):
+                async with session.post(f"{base}/orders", json=payload, headers=headers) as resp:
+                    text = await resp.text()
+                    try:
+                        data = await resp.json(encoding="utf-8")
+                    except Exception:
+                        data = {"raw": text}
+                    if resp.status == 200:
+                        orders = data.get("orders")
+                        if isinstance(orders, list) and orders:
+                            # pick exact merchant order id if present
+                            target = None
+                            for item in orders:
+                                if str(item.get("merchant_order_id", "")) == str(payment_id):
+                                    target = item
+                                    break
+                            if target is None:
+                                target = orders[0]
+                            return {"status": target.get("status"), "order": target, "orders": orders}
+                        return data
         except Exception:
             pass
 
         try:
-            async with session.post(f"{base}/orders/status", json=payload, headers=headers) as resp:
-                text = await resp.text()
-                try:
-                    data = await resp.json(encoding="utf-8")
-                except Exception:
-                    data = {"raw": text}
-                if resp.status == 200:
-                    return data
+            with FREEKASSA_API_SECONDS.time("orders/status"):
+                async with session.post(f"{base}/orders/status", json=payload, headers=headers) as resp:
+                    text = await resp.text()
+                    try:
+                        data = await resp.json(encoding="utf-8")
+                    except Exception:
+                        data = {"raw": text}
+                    if resp.status == 200:
+                        return data
         except Exception:
             pass
 
         # Fallback for accounts where order lookup endpoint is enabled only by order id path
         try:
-            async with session.get(
-                f"{base}/orders/{payment_id}?shopId={shop_id}",
-                headers=headers,
-            ) as resp:
-                text = await resp.text()
-                try:
-                    data = await resp.json(encoding="utf-8")
-                except Exception:
-                    data = {"raw": text}
-                if resp.status == 200:
-                    return data
-                return {"error": data.get("message") or data.get("error") or "FreeKassa error"}
+            with FREEKASSA_API_SECONDS.time("orders/{id}"):
+                async with session.get(
+                    f"{base}/orders/{payment_id}?shopId={shop_id}",
+                    headers=headers,
+                ) as resp:
+                    text = await resp.text()
+                    try:
+                        data = await resp.json(encoding="utf-8")
+                    except Exception:
+                        data = {"raw": text}
+                    if resp.status == 200:
+                        return data
+                    return {"error": data.get("message") or data.get("error") or "FreeKassa error"}
         except Exception:
             return {"error": "FreeKassa status check failed"}
 
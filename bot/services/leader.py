@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import logging
+import os
+import socket
+import time
+import uuid
+
+import aiosqlite
+
+from bot import dao
+from bot.runtime import runtime
+from bot.services.metrics import IS_LEADER
+
+logger = logging.getLogger(__name__)
+
+LEASE_NAME = "background_jobs"
+
+# Local view of when our lease runs out; used to ride out a failed renewal.
+_expires_at = 0.0
+
+
+def _holder_id() -> str:
+    if runtime.leader_id is None:
+        runtime.leader_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+    return runtime.leader_id
+
+
+def lease_ttl_sec() -> int:
+    config = runtime.config
+    ttl = int(config.leader_lease_ttl_sec) if config else 30
+    return max(5, ttl)
+
+
+def renew_interval_sec() -> float:
+    return lease_ttl_sec() / 3
+
+
+async def refresh_leadership(db: aiosqlite.Connection) -> bool:
+    """Acquire or renew the lease. Returns True when leadership changed."""
+    global _expires_at
+    holder = _holder_id()
+    ttl = lease_ttl_sec()
+    started = time.time()
+    try:
+        acquired = await dao.try_acquire_lease(db, LEASE_NAME, holder, ttl)
+    except aiosqlite.Error:
+        logger.exception("Leader lease renewal failed")
+        # Nobody else can take the lease before it expires, so keep running until then.
+        acquired = runtime.is_leader and time.time() < _expires_at
+    else:
+        if acquired:
+            _expires_at = started + ttl
+    changed = acquired != runtime.is_leader
+    runtime.is_leader = acquired
+    IS_LEADER.set(value=1.0 if acquired else 0.0)
+    if changed:
+        logger.info("Leader lease %s: %s", "acquired" if acquired else "lost", holder)
+    return changed
+
+
+async def release_leadership(db: aiosqlite.Connection) -> None:
+    global _expires_at
+    if not runtime.is_leader or runtime.leader_id is None:
+        return
+    try:
+        await dao.release_lease(db, LEASE_NAME, runtime.leader_id)
+    except aiosqlite.Error:
+        logger.exception("Leader lease release failed")
+    runtime.is_leader = False
+    _expires_at = 0.0
+    IS_LEADER.set(value=0.0)
@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+import logging
+from dataclasses import dataclass, field
+from typing import List, Tuple
+
+import aiosqlite
+
+from bot import dao
+from bot.services.metrics import LEDGER_MISMATCHES
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_SETTING = "ledger_verified_id"
+
+
+@dataclass
+class LedgerCheck:
+    from_id: int
+    to_id: int
+    users_checked: int = 0
+    # (user_id, expected from ledger, cached users.balance)
+    mismatches: List[Tuple[int, int, int]] = field(default_factory=list)
+
+
+async def verify_ledger(db: aiosqlite.Connection, batch_entries: int = 50_000) -> LedgerCheck:
+    """Checks cached balances against the ledger entries appended since the last checkpoint."""
+    after_id = int(await dao.get_setting(db, CHECKPOINT_SETTING, "0", cached=False) or 0)
+    max_id = await dao.get_ledger_max_id(db)
+    check = LedgerCheck(from_id=after_id, to_id=after_id)
+    while after_id < max_id:
+        upto_id = min(max_id, after_id + batch_entries)
+        rows = await dao.get_ledger_verify_rows(db, after_id, upto_id)
+        for row in rows:
+            if int(row["expected"]) != int(row["actual"]):
+                check.mismatches.append((int(row["user_id"]), int(row["expected"]), int(row["actual"])))
+        # The ledger is the source of truth: checkpoints keep its value even when the cache disagrees.
+        await dao.save_balance_checkpoints(db, [(int(row["user_id"]), int(row["expected"])) for row in rows])
+        await dao.set_setting(db, CHECKPOINT_SETTING, str(upto_id))
+        check.users_checked += len(rows)
+        check.to_id = after_id = upto_id
+
+    LEDGER_MISMATCHES.inc(value=len(check.mismatches))
+    for user_id, expected, actual in check.mismatches[:20]:
+        logger.warning("Balance mismatch for user %s: ledger %s, cached %s", user_id, expected, actual)
+    return check
@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional
+
+from bot.services.metrics import LOOP_LAG_SECONDS, LOOP_STALLS
+
+logger = logging.getLogger(__name__)
+
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+_MAX_OFFENDERS = 50
+_STACK_DEPTH = 12
+
+
+@dataclass
+class Offender:
+    site: str
+    stack: str
+    count: int = 0
+    total_sec: float = 0.0
+    max_sec: float = 0.0
+    last_ts: float = 0.0
+
+
+def _site_from_stack(frames: List[traceback.FrameSummary]) -> str:
+    # Innermost frame of our own code is the most useful label; library frames
+    # below it (sqlite3, pydantic, open()) are kept in the full stack text.
+    for frame in reversed(frames):
+        filename = os.path.abspath(frame.filename)
+        if filename.startswith(_PROJECT_ROOT) and "site-packages" not in filename:
+            rel = os.path.relpath(filename, _PROJECT_ROOT)
+            return f"{rel}:{frame.lineno} {frame.name}"
+    if frames:
+        frame = frames[-1]
+        return f"{os.path.basename(frame.filename)}:{frame.lineno} {frame.name}"
+    return "unknown"
+
+
+class LoopMonitor:
+    def __init__(self, interval_sec: float = 0.1, threshold_sec: float = 0.25) -> None:
+        self.interval_sec = max(0.01, interval_sec)
+        self.threshold_sec = max(self.interval_sec, threshold_sec)
+        self._offenders: "OrderedDict[str, Offender]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._beat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._pending: Optional[Offender] = None
+        self._stop = threading.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def configure(self, interval_sec: float, threshold_sec: float) -> None:
+        self.interval_sec = max(0.01, interval_sec)
+        self.threshold_sec = max(self.interval_sec, threshold_sec)
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watchdog, name="loop-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _heartbeat(self) -> None:
+        while True:
+            started = time.monotonic()
+            self._beat = started
+            await asyncio.sleep(self.interval_sec)
+            now = time.monotonic()
+            lag = max(0.0, now - started - self.interval_sec)
+            self._beat = now
+            LOOP_LAG_SECONDS.observe(lag)
+            with self._lock:
+                pending, self._pending = self._pending, None
+            if pending is not None:
+                # The watchdog saw the stall while it was happening; now we know how long it was.
+                with self._lock:
+                    pending.total_sec += lag
+                    pending.max_sec = max(pending.max_sec, lag)
+                LOOP_STALLS.inc(pending.site)
+                logger.warning("Event loop blocked for %.3fs at %s", lag, pending.site)
+
+    def _watchdog(self) -> None:
+        check_every = min(self.interval_sec, self.threshold_sec / 2)
+        captured_for: Optional[float] = None
+        while not self._stop.wait(check_every):
+            beat = self._beat
+            if time.monotonic() - beat < self.interval_sec + self.threshold_sec:
+                continue
+            if captured_for == beat:
+                continue
+            captured_for = beat
+            self._capture()
+
+    def _capture(self) -> None:
+        if self._loop_thread_id is None:
+            return
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return
+        frames = traceback.extract_stack(frame)[-_STACK_DEPTH:]
+        site = _site_from_stack(frames)
+        with self._lock:
+            offender = self._offenders.get(site)
+            if offender is None:
+                if len(self._offenders) >= _MAX_OFFENDERS:
+                    self._offenders.popitem(last=False)
+                offender = Offender(site=site, stack="".join(traceback.format_list(frames)))
+                self._offenders[site] = offender
+            else:
+                self._offenders.move_to_end(site)
+            offender.count += 1
+            offender.last_ts = time.time()
+            self._pending = offender
+
+    def top(self, limit: int = 10) -> List[Offender]:
+        with self._lock:
+            items = list(self._offenders.values())
+        items.sort(key=lambda item: (item.total_sec, item.count), reverse=True)
+        return items[:limit]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._offenders.clear()
+            self._pending = None
+
+
+loop_monitor = LoopMonitor()
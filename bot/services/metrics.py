@@ -0,0 +1,339 @@
+from __future__ import annotations
+
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+LAG_BUCKETS: Tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+COUNT_BUCKETS: Tuple[float, ...] = (1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+LOOP_BUCKETS: Tuple[float, ...] = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+@dataclass
+class UpdateScope:
+    update_id: Optional[int] = None
+    update_type: str = "unknown"
+    handler: str = "unhandled"
+    statements: int = 0
+
+
+# Set by the webhook for the duration of one update; handler middleware fills in `handler`.
+current_scope: ContextVar[Optional[UpdateScope]] = ContextVar("current_scope", default=None)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    if not parts:
+        return ""
+    return "{" + ",".join(parts) + "}"
+
+
+def _format_number(value: float) -> str:
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = labels
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def inc(self, *labels: str, value: float = 1.0) -> None:
+        slot = self._values.get(labels)
+        if slot is None:
+            slot = self._values[labels] = [0.0]
+        slot[0] += value
+
+    def get(self, *labels: str) -> float:
+        slot = self._values.get(labels)
+        return slot[0] if slot else 0.0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, slot in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {_format_number(slot[0])}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, *labels: str, value: float) -> None:
+        slot = self._values.get(labels)
+        if slot is None:
+            slot = self._values[labels] = [0.0]
+        slot[0] = value
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+_INF = 'le="+Inf"'
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = labels
+        self.buckets = tuple(sorted(buckets))
+        # Per series: one slot per bucket, one for +Inf, then sum and count.
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0.0] * (len(self.buckets) + 3)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    @contextmanager
+    def time(self, *labels: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def count(self, *labels: str) -> int:
+        series = self._series.get(labels)
+        return int(series[-1]) if series else 0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self._series.items()):
+            cumulative = 0.0
+            for bound, hits in zip(self.buckets, series):
+                cumulative += hits
+                le = f'le="{_format_number(bound)}"'
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.label_names, labels, le)} {_format_number(cumulative)}"
+                )
+            cumulative += series[len(self.buckets)]
+            lines.append(
+                f"{self.name}_bucket{_format_labels(self.label_names, labels, _INF)} {_format_number(cumulative)}"
+            )
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {repr(series[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {_format_number(series[-1])}")
+        return lines
+
+
+_registry: List[object] = []
+
+
+def _register(metric):
+    _registry.append(metric)
+    return metric
+
+
+def render_latest() -> str:
+    lines: List[str] = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+WEBHOOK_SECONDS = _register(
+    Histogram(
+        "bot_webhook_request_seconds",
+        "Webhook update processing time.",
+        labels=("update_type", "handler"),
+    )
+)
+DB_STATEMENT_SECONDS = _register(
+    Histogram(
+        "bot_db_statement_seconds",
+        "SQLite call time by statement kind.",
+        labels=("kind",),
+    )
+)
+UPDATE_DB_STATEMENTS = _register(
+    Histogram(
+        "bot_update_db_statements",
+        "SQL statements issued while handling one update.",
+        labels=("handler",),
+        buckets=COUNT_BUCKETS,
+    )
+)
+TELEGRAM_API_SECONDS = _register(
+    Histogram(
+        "bot_telegram_api_seconds",
+        "Telegram Bot API call time.",
+        labels=("method",),
+    )
+)
+TELEGRAM_API_ERRORS = _register(
+    Counter(
+        "bot_telegram_api_errors_total",
+        "Failed Telegram Bot API calls.",
+        labels=("method", "error"),
+    )
+)
+FREEKASSA_API_SECONDS = _register(
+    Histogram(
+        "bot_freekassa_api_seconds",
+        "FreeKassa API call time.",
+        labels=("endpoint",),
+    )
+)
+LOOP_SECONDS = _register(
+    Histogram(
+        "bot_background_loop_seconds",
+        "Duration of one background loop iteration.",
+        labels=("loop",),
+        buckets=LOOP_BUCKETS,
+    )
+)
+MTPROXY_RESTARTS = _register(
+    Counter(
+        "bot_mtproxy_restarts_total",
+        "MTProxy service restarts issued by the bot.",
+        labels=("reason",),
+    )
+)
+LOOP_LAG_SECONDS = _register(
+    Histogram(
+        "bot_event_loop_lag_seconds",
+        "How late the event loop heartbeat woke up.",
+        buckets=LAG_BUCKETS,
+    )
+)
+LOOP_STALLS = _register(
+    Counter(
+        "bot_event_loop_stalls_total",
+        "Event loop stalls over the threshold by the code site that was running.",
+        labels=("site",),
+    )
+)
+IS_LEADER = _register(
+    Gauge(
+        "bot_is_leader",
+        "1 if this worker holds the background jobs lease.",
+    )
+)
+FLOOD_REJECTIONS = _register(
+    Counter(
+        "bot_flood_rejections_total",
+        "Updates dropped by flood control before reaching a handler.",
+        labels=("reason", "kind"),
+    )
+)
+LEDGER_MISMATCHES = _register(
+    Counter(
+        "bot_ledger_mismatches_total",
+        "Users whose cached balance disagreed with the balance ledger during verification.",
+    )
+)
+SCHEDULED_TASKS_FIRED = _register(
+    Counter(
+        "bot_scheduled_tasks_fired_total",
+        "Scheduled task deadlines handled, by kind and outcome.",
+        labels=("kind", "outcome"),
+    )
+)
+RETENTION_ROWS = _register(
+    Counter(
+        "bot_retention_rows_total",
+        "Rows moved out of the hot DB by retention, by table and action (archived/deleted).",
+        labels=("table", "action"),
+    )
+)
+BACKUP_LAST_SUCCESS = _register(
+    Gauge(
+        "bot_backup_last_success_timestamp",
+        "Unix time of the last verified DB backup.",
+    )
+)
+BACKUP_LAST_SECONDS = _register(
+    Gauge(
+        "bot_backup_last_duration_seconds",
+        "Wall time of the last DB backup, including verification and compression.",
+    )
+)
+BACKUP_LAST_BYTES = _register(
+    Gauge(
+        "bot_backup_last_size_bytes",
+        "Compressed size of the last DB backup.",
+    )
+)
+DB_WAL_BYTES = _register(
+    Gauge(
+        "bot_db_wal_bytes",
+        "Size of the SQLite WAL file after the last managed checkpoint.",
+    )
+)
+WAL_CHECKPOINTS = _register(
+    Counter(
+        "bot_wal_checkpoints_total",
+        "Managed WAL checkpoints by mode and whether they were blocked by readers/writers.",
+        labels=("mode", "busy"),
+    )
+)
+STARTUP_STEP_SECONDS = _register(
+    Gauge(
+        "bot_startup_step_seconds",
+        "Duration of each startup step in the last start (step=total: until /ready).",
+        labels=("step",),
+    )
+)
+POLLED_UPDATES = _register(
+    Counter(
+        "bot_polling_updates_total",
+        "Updates received through getUpdates (UPDATE_MODE=polling).",
+    )
+)
+MENU_RENDERS = _register(
+    Counter(
+        "bot_menu_renders_total",
+        "send_or_edit_bg_message outcomes: skipped (unchanged, no API call), edited, not_modified, resent, sent.",
+        labels=("kind", "outcome"),
+    )
+)
+WRITE_BEHIND_ROWS = _register(
+    Counter(
+        "bot_write_behind_rows_total",
+        "Buffered bookkeeping writes applied by the write-behind flusher (table=users: merged per user).",
+        labels=("table",),
+    )
+)
@@ -9,6 +9,7 @@ import aiosqlite
 
 from bot import dao
 from bot.runtime import runtime
+from bot.services.metrics import MTPROXY_RESTARTS
 from bot.services.settings import get_bool_setting, get_int_setting
 from bot.utils import generate_mtproto_secret
 
@@ -117,12 +118,17 @@ async def sync_mtproto_secrets(db: aiosqlite.Connection) -> None:
         for secret in secrets:
             fh.write(secret + "\n")
     now_ts = time.time()
+    if not runtime.is_leader:
+        # Only the lease holder restarts the service; it picks this up on its next renewal.
+        await dao.set_setting(db, "mtproxy_restart_requested_at", str(int(now_ts)))
+        return
     last_restart = runtime.mtproxy_last_restart_ts or 0.0
     cooldown = max(1, int(config.mtproxy_restart_cooldown_sec))
     if now_ts - last_restart < cooldown:
         runtime.mtproxy_restart_required = True
         return
     await _control_mtproxy_service(config.mtproxy_service, action="restart")
+    MTPROXY_RESTARTS.inc("sync")
     runtime.mtproxy_last_restart_ts = now_ts
     runtime.mtproxy_restart_required = False
 
@@ -137,11 +143,37 @@ async def maybe_restart_mtproxy_service() -> bool:
     if now_ts - last_restart < cooldown:
         return False
     await _control_mtproxy_service(config.mtproxy_service, action="restart")
+    MTPROXY_RESTARTS.inc("deferred")
     runtime.mtproxy_last_restart_ts = now_ts
     runtime.mtproxy_restart_required = False
     return True
 
 
+async def apply_requested_mtproxy_restart(db: aiosqlite.Connection) -> bool:
+    requested = await dao.get_setting(db, "mtproxy_restart_requested_at", "0", cached=False) or "0"
+    try:
+        requested_ts = float(requested)
+    except ValueError:
+        return False
+    # The applied mark lives in settings, so a newly elected leader does not restart for a request already served.
+    applied = await dao.get_setting(db, "mtproxy_restart_applied_at", "0", cached=False) or "0"
+    try:
+        applied_ts = float(applied)
+    except ValueError:
+        applied_ts = 0.0
+    if requested_ts <= applied_ts:
+        return False
+    if requested_ts <= (runtime.mtproxy_last_restart_ts or 0.0):
+        # This process already restarted after the request (e.g. on its own secrets sync).
+        await dao.set_setting(db, "mtproxy_restart_applied_at", requested)
+        return False
+    runtime.mtproxy_restart_required = True
+    if not await maybe_restart_mtproxy_service():
+        return False
+    await dao.set_setting(db, "mtproxy_restart_applied_at", requested)
+    return True
+
+
 async def _control_mtproxy_service(service_name: str | None, action: str) -> None:
     if not service_name:
         return
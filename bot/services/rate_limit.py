@@ -1,21 +1,191 @@
 from __future__ import annotations
 
+import logging
+import os
+import sqlite3
+import threading
 import time
-from collections import defaultdict, deque
+from collections import OrderedDict
+from typing import Optional
 
-_events: dict[str, deque[float]] = defaultdict(deque)
+from bot.runtime import runtime
 
+logger = logging.getLogger(__name__)
 
-def is_allowed(user_id: int, action: str, limit: int, window_sec: int) -> bool:
+DEFAULT_MAX_KEYS = 100_000
+
+
+class MemoryBackend:
+    """Per-process token buckets: [tokens, updated_at, full_at] per key, LRU-ordered.
+
+    A bucket idle past `full_at` is indistinguishable from a missing one, so it can be
+    dropped at any time; the hard `max_keys` cap evicts least recently used keys first.
+    """
+
+    def __init__(self, max_keys: int = DEFAULT_MAX_KEYS) -> None:
+        self.max_keys = max(1, max_keys)
+        self._buckets: "OrderedDict[str, list[float]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def consume(self, key: str, capacity: float, refill_per_sec: float, cost: float, now: float) -> bool:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            tokens = capacity
+        else:
+            self._buckets.move_to_end(key)
+            tokens = min(capacity, bucket[0] + (now - bucket[1]) * refill_per_sec)
+        if tokens < cost:
+            return False
+        tokens -= cost
+        full_at = now + (capacity - tokens) / refill_per_sec
+        if bucket is None:
+            self._buckets[key] = [tokens, now, full_at]
+            self._evict(now)
+        else:
+            bucket[0], bucket[1], bucket[2] = tokens, now, full_at
+        return True
+
+    def _evict(self, now: float) -> None:
+        buckets = self._buckets
+        while buckets:
+            oldest = next(iter(buckets.values()))
+            if len(buckets) <= self.max_keys and oldest[2] > now:
+                break
+            buckets.popitem(last=False)
+
+
+class SqliteBackend:
+    """Buckets shared by all workers through a small SQLite file (one atomic upsert per check).
+
+    Checks never wait for a lock (busy timeout 0) and fall back to per-process buckets while the file is busy;
+    expired and overflowing keys are swept by a background thread on its own connection.
+    """
+
+    _CONSUME_SQL = """
+        INSERT INTO rate_buckets(key, tokens, updated_at, full_at)
+        VALUES(:key, :capacity - :cost, :now, :now + :cost / :rate)
+        ON CONFLICT(key) DO UPDATE SET
+            tokens = MIN(:capacity, tokens + (:now - updated_at) * :rate) - :cost,
+            updated_at = :now,
+            full_at = :now + (:capacity - (MIN(:capacity, tokens + (:now - updated_at) * :rate) - :cost)) / :rate
+        WHERE MIN(:capacity, tokens + (:now - updated_at) * :rate) >= :cost
+        RETURNING tokens
+    """
+
+    def __init__(self, path: str, max_keys: int = DEFAULT_MAX_KEYS, sweep_interval: float = 60.0) -> None:
+        self.path = path
+        self.max_keys = max(1, max_keys)
+        self.sweep_interval = max(1.0, sweep_interval)
+        self._conn: Optional[sqlite3.Connection] = None
+        # Used while the shared file is locked by another worker, so the check never waits on the event loop.
+        self._fallback = MemoryBackend(max_keys=max_keys)
+        self._sweeper: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def _open(self, timeout: float) -> sqlite3.Connection:
+        dir_name = os.path.dirname(self.path)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+        conn = sqlite3.connect(self.path, isolation_level=None, timeout=timeout, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS rate_buckets ("
+            "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL, full_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_rate_buckets_full_at ON rate_buckets(full_at)")
+        return conn
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            # Setup may wait for the file once; every check after that runs with busy timeout 0.
+            conn = self._open(timeout=1.0)
+            conn.execute("PRAGMA busy_timeout = 0")
+            self._conn = conn
+            self._start_sweeper()
+        return self._conn
+
+    def consume(self, key: str, capacity: float, refill_per_sec: float, cost: float, now: float) -> bool:
+        try:
+            row = self._connect().execute(
+                self._CONSUME_SQL,
+                {"key": key, "capacity": capacity, "cost": cost, "now": now, "rate": refill_per_sec},
+            ).fetchone()
+        except sqlite3.Error:
+            # Busy or broken file: limit per process for this check instead of blocking or letting everything through.
+            logger.debug("Rate limit file unavailable, using memory buckets", exc_info=True)
+            return self._fallback.consume(key, capacity, refill_per_sec, cost, now)
+        return row is not None
+
+    def _start_sweeper(self) -> None:
+        if self._sweeper is None:
+            self._sweeper = threading.Thread(target=self._sweep_loop, name="rate-limit-sweep", daemon=True)
+            self._sweeper.start()
+
+    def _sweep_loop(self) -> None:
+        conn: Optional[sqlite3.Connection] = None
+        while not self._stop.wait(self.sweep_interval):
+            try:
+                if conn is None:
+                    conn = self._open(timeout=5.0)
+                self._sweep(conn, time.time())
+            except sqlite3.Error:
+                logger.warning("Rate limit sweep failed", exc_info=True)
+        if conn is not None:
+            conn.close()
+
+    def _sweep(self, conn: sqlite3.Connection, now: float) -> None:
+        conn.execute("DELETE FROM rate_buckets WHERE full_at <= ?", (now,))
+        overflow = conn.execute("SELECT COUNT(*) FROM rate_buckets").fetchone()[0] - self.max_keys
+        if overflow > 0:
+            conn.execute(
+                "DELETE FROM rate_buckets WHERE key IN "
+                "(SELECT key FROM rate_buckets ORDER BY updated_at LIMIT ?)",
+                (overflow,),
+            )
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+_backend = None
+
+
+def _make_backend():
+    config = runtime.config
+    if config is None:
+        return MemoryBackend()
+    if config.rate_limit_backend == "sqlite":
+        path = config.rate_limit_db_path or os.path.join(os.path.dirname(config.db_path), "rate_limit.db")
+        return SqliteBackend(path, max_keys=config.rate_limit_max_keys)
+    return MemoryBackend(max_keys=config.rate_limit_max_keys)
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = _make_backend()
+    return _backend
+
+
+def set_backend(backend) -> None:
+    global _backend
+    _backend = backend
+
+
+def consume(key: str, limit: float, window_sec: float, cost: float = 1.0) -> bool:
+    """Token bucket: up to `limit` tokens, refilled at `limit / window_sec` per second."""
     if limit <= 0 or window_sec <= 0:
         return True
-    now = time.time()
-    key = f"{action}:{user_id}"
-    bucket = _events[key]
-    cutoff = now - window_sec
-    while bucket and bucket[0] < cutoff:
-        bucket.popleft()
-    if len(bucket) >= limit:
+    if cost > limit:
         return False
-    bucket.append(now)
-    return True
+    return get_backend().consume(key, float(limit), limit / window_sec, float(cost), time.time())
+
+
+def is_allowed(user_id: int, action: str, limit: int, window_sec: int) -> bool:
+    return consume(f"{action}:{user_id}", limit, window_sec)
@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import os
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import aiosqlite
+
+from bot import dao
+from bot.db import DEFAULT_SETTINGS
+from bot.runtime import runtime
+from bot.services.metrics import RETENTION_ROWS
+
+SETTING_KEY = "retention_days"
+ARCHIVE_ALIAS = "archive"
+
+
+@dataclass(frozen=True)
+class RetentionPolicy:
+    table: str
+    # Condition for expired rows; the single parameter is the ISO cutoff.
+    where: str
+    # False: rows are only deleted (nothing worth keeping, e.g. update dedupe ids).
+    archive: bool = True
+
+
+POLICIES: Tuple[RetentionPolicy, ...] = (
+    RetentionPolicy("processed_updates", "created_at < ?", archive=False),
+    RetentionPolicy("admin_audit_log", "created_at < ?"),
+    RetentionPolicy(
+        "support_messages",
+        "ticket_id IN (SELECT id FROM support_tickets WHERE status = 'closed' AND updated_at < ?)",
+    ),
+    RetentionPolicy("referral_clicks", "created_at < ?"),
+    RetentionPolicy("proxies", "deleted_at IS NOT NULL AND deleted_at < ?"),
+)
+
+
+@dataclass
+class RetentionRun:
+    archive_path: Optional[str] = None
+    # table -> rows removed from the hot DB
+    removed: Dict[str, int] = field(default_factory=dict)
+    vacuumed_pages: int = 0
+
+
+def parse_days(raw: str) -> Dict[str, int]:
+    days: Dict[str, int] = {}
+    for item in (raw or "").split(","):
+        table, sep, value = item.strip().partition("=")
+        if not sep or not table.strip():
+            continue
+        try:
+            days[table.strip()] = int(value)
+        except ValueError:
+            continue
+    return days
+
+
+def archive_dir() -> str:
+    config = runtime.config
+    if config is None:
+        return os.path.join("data", "archive")
+    return config.archive_dir or os.path.join(os.path.dirname(config.db_path), "archive")
+
+
+def archive_path_for(directory: str, when: Optional[datetime] = None) -> str:
+    when = when or datetime.utcnow()
+    return os.path.join(directory, f"bot-archive-{when:%Y-%m}.db")
+
+
+def list_archives(directory: str) -> List[str]:
+    path = Path(directory)
+    if not path.is_dir():
+        return []
+    return sorted(str(item) for item in path.glob("bot-archive-*.db"))
+
+
+async def _columns(db: aiosqlite.Connection, schema: str, table: str) -> List[str]:
+    cur = await db.execute(f"PRAGMA {schema}.table_info({table})")
+    return [row["name"] for row in await cur.fetchall()]
+
+
+async def _prepare_archive_table(db: aiosqlite.Connection, table: str) -> List[str]:
+    """Mirrors the hot table's columns in the archive (new columns are added as the schema grows)."""
+    columns = await _columns(db, "main", table)
+    existing = await _columns(db, ARCHIVE_ALIAS, table)
+    if not existing:
+        await db.execute(f"CREATE TABLE {ARCHIVE_ALIAS}.{table} AS SELECT * FROM main.{table} WHERE 0")
+        await db.execute(f"CREATE UNIQUE INDEX {ARCHIVE_ALIAS}.idx_{table}_id ON {table}(id)")
+        await db.execute(f"ALTER TABLE {ARCHIVE_ALIAS}.{table} ADD COLUMN archived_at TEXT")
+    else:
+        for column in columns:
+            if column not in existing:
+                await db.execute(f"ALTER TABLE {ARCHIVE_ALIAS}.{table} ADD COLUMN {column}")
+    await db.commit()
+    return columns
+
+
+async def _apply_policy(
+    db: aiosqlite.Connection, policy: RetentionPolicy, cutoff: str, batch: int, archived_at: str
+) -> int:
+    columns = await _prepare_archive_table(db, policy.table) if policy.archive else []
+    column_list = ", ".join(columns)
+    removed = 0
+    while True:
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            cur = await db.execute(
+                f"SELECT id FROM main.{policy.table} WHERE {policy.where} LIMIT ?", (cutoff, batch)
+            )
+            ids = [row["id"] for row in await cur.fetchall()]
+            if ids:
+                # Main is in WAL mode, so the commit is not atomic across both files; a batch cut short
+                # after the archive write is simply re-copied next time (INSERT OR IGNORE on the id index).
+                placeholders = ",".join("?" for _ in ids)
+                if policy.archive:
+                    await db.execute(
+                        f"INSERT OR IGNORE INTO {ARCHIVE_ALIAS}.{policy.table} ({column_list}, archived_at) "
+                        f"SELECT {column_list}, ? FROM main.{policy.table} WHERE id IN ({placeholders})",
+                        (archived_at, *ids),
+                    )
+                await db.execute(f"DELETE FROM main.{policy.table} WHERE id IN ({placeholders})", ids)
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+        removed += len(ids)
+        if len(ids) < batch:
+            break
+    if removed:
+        RETENTION_ROWS.inc(policy.table, "archived" if policy.archive else "deleted", value=removed)
+    return removed
+
+
+async def incremental_vacuum(db: aiosqlite.Connection, max_pages: int = 0) -> int:
+    """Returns free pages to the OS when the DB uses auto_vacuum=INCREMENTAL (0 pages means all)."""
+    cur = await db.execute("PRAGMA main.auto_vacuum")
+    if (await cur.fetchone())[0] != 2:
+        return 0
+    cur = await db.execute("PRAGMA main.freelist_count")
+    free = (await cur.fetchone())[0]
+    if not free:
+        return 0
+    pages = min(free, max_pages) if max_pages > 0 else free
+    cur = await db.execute(f"PRAGMA main.incremental_vacuum({pages})")
+    await cur.fetchall()
+    return pages
+
+
+async def run_retention(
+    db: aiosqlite.Connection,
+    directory: Optional[str] = None,
+    batch: int = 2000,
+    now: Optional[datetime] = None,
+) -> RetentionRun:
+    raw = await dao.get_setting(db, SETTING_KEY, DEFAULT_SETTINGS[SETTING_KEY])
+    days = parse_days(raw or "")
+    active = [policy for policy in POLICIES if days.get(policy.table, 0) > 0]
+    run = RetentionRun()
+    if not active:
+        return run
+    now = now or datetime.utcnow()
+    path = archive_path_for(directory or archive_dir(), now)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    archived_at = dao.now_iso()
+    await db.execute(f"ATTACH DATABASE ? AS {ARCHIVE_ALIAS}", (path,))
+    try:
+        for policy in active:
+            cutoff = dao.days_ago_iso(days[policy.table])
+            run.removed[policy.table] = await _apply_policy(db, policy, cutoff, batch, archived_at)
+    finally:
+        await db.execute(f"DETACH DATABASE {ARCHIVE_ALIAS}")
+    if any(policy.archive and run.removed.get(policy.table) for policy in active):
+        run.archive_path = path
+    if sum(run.removed.values()):
+        run.vacuumed_pages = await incremental_vacuum(db)
+    return run
+
+
+@asynccontextmanager
+async def attached_archives(db: aiosqlite.Connection, paths: List[str]) -> AsyncIterator[List[str]]:
+    """Attaches archive files read-only as archive0, archive1, ... for the duration of the block."""
+    aliases: List[str] = []
+    try:
+        for index, path in enumerate(paths):
+            alias = f"archive{index}"
+            await db.execute(f"ATTACH DATABASE ? AS {alias}", (f"{Path(path).resolve().as_uri()}?mode=ro",))
+            aliases.append(alias)
+        yield aliases
+    finally:
+        for alias in aliases:
+            await db.execute(f"DETACH DATABASE {alias}")
@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import logging
+import math
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import aiosqlite
+
+from bot import dao
+from bot.db import get_db
+from bot.runtime import runtime
+from bot.services.metrics import SCHEDULED_TASKS_FIRED
+
+logger = logging.getLogger(__name__)
+
+SUPPORT_SLA = "support_sla"
+FREEKASSA_POLL = "freekassa_poll"
+
+# A handler gets the task row. To run again it calls scheduler.schedule() itself; otherwise the task is done.
+TaskHandler = Callable[[aiosqlite.Connection, aiosqlite.Row], Awaitable[None]]
+
+
+class Scheduler:
+    """Persistent per-entity deadlines (scheduled_tasks) fired from an in-memory heap on the leader.
+
+    The heap holds only tasks due within `horizon` seconds and is reloaded from the due_at index every
+    `reload_interval` seconds, which also picks up deadlines registered by other workers.
+    """
+
+    def __init__(self, reload_interval: float = 30.0, horizon: float = 300.0, batch: int = 1000) -> None:
+        self.reload_interval = reload_interval
+        self.horizon = horizon
+        self.batch = batch
+        self._handlers: Dict[str, TaskHandler] = {}
+        self._heap: List[Tuple[float, str, int]] = []
+        self._due: Dict[Tuple[str, int], float] = {}
+        self._loaded_until = 0.0
+        self._reload_at = 0.0
+        self._wake = asyncio.Event()
+
+    def register(self, kind: str, handler: TaskHandler) -> None:
+        self._handlers[kind] = handler
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def _push(self, kind: str, entity_id: int, due_at: float) -> None:
+        if not runtime.is_leader or due_at > self._loaded_until:
+            return
+        self._due[(kind, entity_id)] = due_at
+        heapq.heappush(self._heap, (due_at, kind, entity_id))
+        self._wake.set()
+
+    async def schedule(
+        self,
+        db: aiosqlite.Connection,
+        kind: str,
+        entity_id: int,
+        due_at: float,
+        payload: Optional[str] = None,
+    ) -> None:
+        await dao.schedule_task(db, kind, entity_id, due_at, payload)
+        self._due.pop((kind, entity_id), None)
+        self._push(kind, entity_id, due_at)
+
+    async def cancel(self, db: aiosqlite.Connection, kind: str, entity_id: int) -> None:
+        await dao.cancel_task(db, kind, entity_id)
+        self._due.pop((kind, entity_id), None)
+
+    async def _reload(self, db: aiosqlite.Connection, now: float) -> None:
+        rows = await dao.list_scheduled_tasks_until(db, now + self.horizon, self.batch)
+        self._due = {(row["kind"], row["entity_id"]): row["due_at"] for row in rows}
+        self._heap = [(due_at, kind, entity_id) for (kind, entity_id), due_at in self._due.items()]
+        heapq.heapify(self._heap)
+        self._loaded_until = now + self.horizon if len(rows) < self.batch else rows[-1]["due_at"]
+        self._reload_at = now + self.reload_interval
+
+    async def _fire(self, db: aiosqlite.Connection, task: aiosqlite.Row) -> None:
+        kind = task["kind"]
+        handler = self._handlers.get(kind)
+        if handler is None:
+            logger.warning("No handler for scheduled task kind=%s, dropping", kind)
+            await dao.finish_scheduled_task(db, task["id"], task["due_at"])
+            SCHEDULED_TASKS_FIRED.inc(kind, "dropped")
+            return
+        try:
+            await handler(db, task)
+        except Exception:
+            logger.exception("Scheduled task failed kind=%s entity_id=%s", kind, task["entity_id"])
+            retry_at = time.time() + min(3600, 30 * 2 ** min(int(task["attempts"]), 7))
+            await dao.retry_scheduled_task(db, task["id"], task["due_at"], retry_at)
+            self._push(kind, task["entity_id"], retry_at)
+            SCHEDULED_TASKS_FIRED.inc(kind, "error")
+            return
+        await dao.finish_scheduled_task(db, task["id"], task["due_at"])
+        SCHEDULED_TASKS_FIRED.inc(kind, "ok")
+
+    async def _fire_due(self, db: aiosqlite.Connection) -> None:
+        while self._heap and self._heap[0][0] <= time.time():
+            due_at, kind, entity_id = heapq.heappop(self._heap)
+            if self._due.get((kind, entity_id)) != due_at:
+                continue
+            del self._due[(kind, entity_id)]
+            # The row is authoritative: another worker may have moved or cancelled the deadline.
+            task = await dao.get_scheduled_task(db, kind, entity_id)
+            if task is None:
+                continue
+            if task["due_at"] > time.time():
+                self._push(kind, entity_id, task["due_at"])
+                continue
+            await self._fire(db, task)
+
+    async def run_due(self, db: aiosqlite.Connection, now: Optional[float] = None, kind: Optional[str] = None) -> int:
+        """Fires everything due by `now` straight from the table (bench and manual runs)."""
+        rows = await dao.list_scheduled_tasks_until(db, time.time() if now is None else now, 10**9, kind)
+        for task in rows:
+            await self._fire(db, task)
+        return len(rows)
+
+    async def run(self, db_path: str) -> None:
+        while True:
+            if not runtime.is_leader:
+                self._heap, self._due, self._loaded_until, self._reload_at = [], {}, 0.0, 0.0
+                await asyncio.sleep(self.reload_interval)
+                continue
+            try:
+                if time.time() >= self._reload_at or (self._heap and self._heap[0][0] <= time.time()):
+                    db = await get_db(db_path)
+                    try:
+                        if time.time() >= self._reload_at:
+                            await self._reload(db, time.time())
+                        await self._fire_due(db)
+                    finally:
+                        await db.close()
+            except Exception:
+                logger.exception("Scheduler iteration failed")
+                self._reload_at = time.time() + self.reload_interval
+            next_at = min(self._reload_at, self._heap[0][0] if self._heap else math.inf)
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=max(0.0, next_at - time.time()))
+            except asyncio.TimeoutError:
+                pass
+
+
+scheduler = Scheduler()
@@ -0,0 +1,34 @@
+from __future__ import annotations
+
+import json
+import re
+from typing import Optional, Tuple
+
+try:
+    import orjson
+except Exception:  # pragma: no cover
+    orjson = None
+
+# Telegram serializes update_id first and the payload key right after it: {"update_id":1,"message":{...}}.
+_HEAD_RE = re.compile(rb'\s*\{\s*"update_id"\s*:\s*(\d+)\s*,\s*"([a-z_]+)"')
+
+
+def loads(body: bytes):
+    return orjson.loads(body) if orjson is not None else json.loads(body)
+
+
+def peek_update(body: bytes) -> Tuple[Optional[int], Optional[str]]:
+    # update_id and update type without building the payload; (None, None) if the body is not an update object.
+    match = _HEAD_RE.match(body)
+    if match:
+        return int(match.group(1)), match.group(2).decode()
+    # Another key order (a re-serializing proxy, hand-made requests): one full parse with the fastest parser at hand.
+    try:
+        data = loads(body)
+    except ValueError:
+        return None, None
+    if not isinstance(data, dict):
+        return None, None
+    update_id = data.get("update_id")
+    update_type = next((key for key in data if key != "update_id"), None)
+    return (update_id if isinstance(update_id, int) else None), update_type
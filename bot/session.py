@@ -0,0 +1,19 @@
+from __future__ import annotations
+
+from aiogram.client.session.aiohttp import AiohttpSession
+
+from bot.keyboards import SharedMarkup
+
+
+class PreparedMarkupSession(AiohttpSession):
+    # Shared keyboards are serialized on their first send; later sends attach the stored JSON instead of
+    # dumping the markup model and walking it through prepare_value again.
+    def build_form_data(self, bot, method):
+        markup = getattr(method, "reply_markup", None)
+        if not isinstance(markup, SharedMarkup):
+            return super().build_form_data(bot, method)
+        if markup._json is None:
+            markup._json = self.prepare_value(markup, bot=bot, files={})
+        form = super().build_form_data(bot, method.model_copy(update={"reply_markup": None}))
+        form.add_field("reply_markup", markup._json)
+        return form
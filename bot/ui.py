@@ -1,14 +1,38 @@
 from __future__ import annotations
 
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from datetime import datetime
 from pathlib import Path
+from typing import Optional, Tuple
 
 from aiogram import Bot
-from aiogram.types import FSInputFile, InlineKeyboardMarkup
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, InlineKeyboardMarkup, Message, User
 from bot import dao
+from bot.db import get_db
+from bot.keyboards import markup_fingerprint
 from bot.runtime import runtime
+from bot.services.metrics import MENU_RENDERS
+
+logger = logging.getLogger(__name__)
 
 _BG_PATH = Path(__file__).resolve().parents[1] / "bg.jpg"
 _CAPTION_LIMIT = 1000
+# "<mtime_ns>:<size>|<file_id>": Telegram's id for the uploaded background, valid while bg.jpg is unchanged.
+BG_FILE_ID_SETTING = "bg_file_id"
+_RENDER_CACHE_SIZE = 10000
+# (chat_id, message_id) -> (digest of what this process last put there, edit_date Telegram reported for it).
+_rendered: "OrderedDict[Tuple[int, int], Tuple[bytes, Optional[datetime]]]" = OrderedDict()
+
+
+async def get_bot_info(bot: Bot) -> User:
+    # The bot's own identity never changes while the process runs; warmed at startup.
+    if runtime.bot_info is None:
+        runtime.bot_info = await bot.get_me()
+    return runtime.bot_info
 
 
 def clip_caption(text: str, limit: int = _CAPTION_LIMIT) -> str:
@@ -19,13 +43,106 @@ def clip_caption(text: str, limit: int = _CAPTION_LIMIT) -> str:
     return text[: limit - 3] + "..."
 
 
-def get_bg_file() -> FSInputFile | None:
+def _bg_signature() -> str | None:
+    path = Path(runtime.bg_path) if runtime.bg_path else _BG_PATH
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+
+def get_bg_file() -> FSInputFile | str | None:
+    """The background as a cached file_id when one matches the current bg.jpg, otherwise the file to upload."""
     if runtime.bg_enabled is False:
         return None
-    path = Path(runtime.bg_path) if runtime.bg_path else _BG_PATH
-    if path.exists():
-        return FSInputFile(str(path))
-    return None
+    signature = _bg_signature()
+    if signature is None:
+        return None
+    if runtime.bg_file_id and runtime.bg_file_signature == signature:
+        return runtime.bg_file_id
+    return FSInputFile(str(Path(runtime.bg_path) if runtime.bg_path else _BG_PATH))
+
+
+def remember_bg_upload(bg: FSInputFile | str | None, message: Message) -> None:
+    if not isinstance(bg, FSInputFile) or not message.photo:
+        return
+    signature = _bg_signature()
+    if signature is None:
+        return
+    runtime.bg_file_id = message.photo[-1].file_id
+    runtime.bg_file_signature = signature
+    if runtime.config is not None:
+        asyncio.create_task(_persist_bg_file_id(runtime.config.db_path, f"{signature}|{runtime.bg_file_id}"))
+
+
+async def _persist_bg_file_id(db_path: str, value: str) -> None:
+    try:
+        db = await get_db(db_path)
+        try:
+            await dao.set_setting(db, BG_FILE_ID_SETTING, value)
+        finally:
+            await db.close()
+    except Exception:
+        logger.exception("Failed to store bg file_id")
+
+
+async def load_bg_file_id(db) -> bool:
+    raw = await dao.get_setting(db, BG_FILE_ID_SETTING, "") or ""
+    signature, _, file_id = raw.rpartition("|")
+    if not file_id or signature != _bg_signature():
+        return False
+    runtime.bg_file_id = file_id
+    runtime.bg_file_signature = signature
+    return True
+
+
+def _is_stale_file_id(exc: TelegramBadRequest) -> bool:
+    # "wrong file identifier/HTTP URL specified", "wrong remote file identifier specified", ...
+    text = (exc.message or "").lower()
+    return "file identifier" in text or ("file_id" in text and ("invalid" in text or "wrong" in text))
+
+
+async def send_bg_photo(bot: Bot, chat_id: int, bg: FSInputFile | str, **kwargs) -> Message:
+    try:
+        msg = await bot.send_photo(chat_id=chat_id, photo=bg, **kwargs)
+    except TelegramBadRequest as exc:
+        if isinstance(bg, FSInputFile) or not _is_stale_file_id(exc):
+            raise
+        # A stale file_id (e.g. after a bot token change): upload the file again.
+        runtime.bg_file_id = None
+        bg = get_bg_file()
+        if bg is None:
+            raise
+        msg = await bot.send_photo(chat_id=chat_id, photo=bg, **kwargs)
+    remember_bg_upload(bg, msg)
+    return msg
+
+
+def _render_digest(kind: str, text: str, reply_markup: InlineKeyboardMarkup | None, parse_mode: str | None) -> bytes:
+    head = f"{kind}\0{parse_mode or ''}\0{text}\0".encode()
+    return hashlib.blake2b(head + markup_fingerprint(reply_markup), digest_size=16).digest()
+
+
+def _remember_render(chat_id: int, message_id: int, digest: bytes, edit_date: Optional[datetime]) -> None:
+    key = (chat_id, message_id)
+    _rendered[key] = (digest, edit_date)
+    _rendered.move_to_end(key)
+    while len(_rendered) > _RENDER_CACHE_SIZE:
+        _rendered.popitem(last=False)
+
+
+def _unchanged(chat_id: int, message_id: int, digest: bytes, current: Message | None) -> bool:
+    # Only with the message state Telegram sent along (callback_query.message): its edit_date must still be the one
+    # from our render, otherwise another worker may have edited the message since and the edit has to go out.
+    if not isinstance(current, Message) or current.message_id != message_id:
+        return False
+    cached = _rendered.get((chat_id, message_id))
+    return cached is not None and cached == (digest, current.edit_date)
+
+
+def _edit_date(result) -> Optional[datetime]:
+    return result.edit_date if isinstance(result, Message) else None
 
 
 async def send_or_edit_bg_message(
@@ -35,41 +152,56 @@ async def send_or_edit_bg_message(
     reply_markup: InlineKeyboardMarkup | None = None,
     parse_mode: str | None = None,
     message_id: int | None = None,
+    current: Message | None = None,
 ) -> int:
     caption = clip_caption(text)
     bg = get_bg_file()
+    kind = "photo" if bg else "text"
+    digest = _render_digest(kind, caption if bg else text, reply_markup, parse_mode)
+
+    if message_id and _unchanged(chat_id, message_id, digest, current):
+        MENU_RENDERS.inc(kind, "skipped")
+        return message_id
 
     if message_id and bg:
         try:
-            await bot.edit_message_caption(
+            result = await bot.edit_message_caption(
                 chat_id=chat_id,
                 message_id=message_id,
                 caption=caption,
                 reply_markup=reply_markup,
                 parse_mode=parse_mode,
             )
+            MENU_RENDERS.inc(kind, "edited")
+            _remember_render(chat_id, message_id, digest, _edit_date(result))
             return message_id
         except Exception as exc:
             if "message is not modified" in str(exc).lower():
+                MENU_RENDERS.inc(kind, "not_modified")
+                _remember_render(chat_id, message_id, digest, current.edit_date if isinstance(current, Message) else None)
                 return message_id
+            _rendered.pop((chat_id, message_id), None)
             try:
                 await bot.delete_message(chat_id=chat_id, message_id=message_id)
             except Exception:
                 pass
 
     if bg:
-        msg = await bot.send_photo(
-            chat_id=chat_id,
-            photo=bg,
+        msg = await send_bg_photo(
+            bot,
+            chat_id,
+            bg,
             caption=caption,
             reply_markup=reply_markup,
             parse_mode=parse_mode,
         )
+        MENU_RENDERS.inc(kind, "resent" if message_id else "sent")
+        _remember_render(chat_id, msg.message_id, digest, None)
         return msg.message_id
 
     if message_id:
         try:
-            await bot.edit_message_text(
+            result = await bot.edit_message_text(
                 text,
                 chat_id=chat_id,
                 message_id=message_id,
@@ -77,9 +209,15 @@ async def send_or_edit_bg_message(
                 parse_mode=parse_mode,
                 disable_web_page_preview=True,
             )
+            MENU_RENDERS.inc(kind, "edited")
+            _remember_render(chat_id, message_id, digest, _edit_date(result))
             return message_id
-        except Exception:
-            pass
+        except Exception as exc:
+            if "message is not modified" in str(exc).lower():
+                MENU_RENDERS.inc(kind, "not_modified")
+                _remember_render(chat_id, message_id, digest, current.edit_date if isinstance(current, Message) else None)
+                return message_id
+            _rendered.pop((chat_id, message_id), None)
 
     msg = await bot.send_message(
         chat_id=chat_id,
@@ -88,6 +226,8 @@ async def send_or_edit_bg_message(
         parse_mode=parse_mode,
         disable_web_page_preview=True,
     )
+    MENU_RENDERS.inc(kind, "resent" if message_id else "sent")
+    _remember_render(chat_id, msg.message_id, digest, None)
     return msg.message_id
 
 
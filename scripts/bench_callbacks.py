@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from scripts.bench_common import BENCH_BOT_TOKEN, prepare_env
+
+
+async def _noop(call) -> None:
+    return None
+
+
+def _route_tables(padding: int) -> List[List[Tuple[str, str]]]:
+    # The real user/admin tables; padding adds fake admin prefixes ahead of the real ones.
+    from bot.handlers.admin import callbacks as admin_callbacks
+    from bot.handlers.user import callbacks as user_callbacks
+
+    user = [(kind, value) for kind, value, _ in user_callbacks.routes]
+    admin = [("prefix", f"pad{i}:") for i in range(padding)]
+    admin += [(kind, value) for kind, value, _ in admin_callbacks.routes]
+    return [user, admin]
+
+
+def _build(tables: List[List[Tuple[str, str]]], routed: bool):
+    from aiogram import Dispatcher, F, Router
+    from bot.callback_routes import CallbackRoutes
+
+    dp = Dispatcher()
+    for table in tables:
+        router = Router()
+        if routed:
+            routes = CallbackRoutes(router)
+            for kind, value in table:
+                (routes.exact if kind == "exact" else routes.prefix)(value)(_noop)
+        else:
+            # What the handlers registered before: one filter per handler, checked in order.
+            for kind, value in table:
+                flt = F.data == value if kind == "exact" else F.data.startswith(value)
+                router.callback_query.register(_noop, flt)
+        dp.include_router(router)
+    return dp
+
+
+def _updates(tables: List[List[Tuple[str, str]]]):
+    from aiogram.types import Update
+
+    values = [value if kind == "exact" else value + "1" for table in tables for kind, value in table]
+    values = [value for value in values if not value.startswith("pad")]
+    updates = []
+    for index, data in enumerate(values, 1):
+        updates.append(
+            Update.model_validate(
+                {
+                    "update_id": index,
+                    "callback_query": {
+                        "id": str(index),
+                        "from": {"id": 42, "is_bot": False, "first_name": "Bench"},
+                        "chat_instance": "42",
+                        "data": data,
+                        "message": {
+                            "message_id": index,
+                            "date": int(datetime.utcnow().timestamp()),
+                            "chat": {"id": 42, "type": "private"},
+                            "text": "menu",
+                        },
+                    },
+                }
+            )
+        )
+    return updates
+
+
+async def _measure(variants: Dict[str, object], updates, rounds: int, repeat: int) -> Dict[str, float]:
+    from aiogram import Bot
+
+    bot = Bot(token=BENCH_BOT_TOKEN)
+    best = {name: float("inf") for name in variants}
+    for _ in range(rounds):
+        # Interleaved rounds, best one counts.
+        for name, dp in variants.items():
+            started = time.perf_counter()
+            for _ in range(repeat):
+                for update in updates:
+                    await dp.feed_update(bot, update)
+            best[name] = min(best[name], time.perf_counter() - started)
+    await bot.session.close()
+    total = len(updates) * repeat
+    return {name: round(value / total * 1e6, 2) for name, value in best.items()}
+
+
+async def run(args: argparse.Namespace) -> dict:
+    result = {"rows": []}
+    for padding in [int(part) for part in args.padding.split(",")]:
+        tables = _route_tables(padding)
+        updates = _updates(tables)
+        timings = await _measure(
+            {"filter_chain": _build(tables, routed=False), "routed": _build(tables, routed=True)},
+            updates,
+            args.rounds,
+            args.repeat,
+        )
+        result["rows"].append(
+            {
+                "handlers": sum(len(table) for table in tables),
+                "callbacks": len(updates),
+                "us_per_callback": timings,
+            }
+        )
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Накладные расходы диспетчеризации callback: цепочка F.data против CallbackRoutes")
+    parser.add_argument("--padding", default="0,100,500", help="сколько фиктивных префиксов добавить в таблицу админки")
+    parser.add_argument("--rounds", type=int, default=7)
+    parser.add_argument("--repeat", type=int, default=20, help="проходов по всем callback_data за раунд")
+    args = parser.parse_args()
+    prepare_env(":memory:", "/tmp")
+    print(json.dumps(asyncio.run(run(args)), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
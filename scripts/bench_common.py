@@ -0,0 +1,332 @@
+from __future__ import annotations
+
+import asyncio
+import itertools
+import json
+import math
+import os
+import sqlite3
+import sys
+import time
+import typing
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+BENCH_BOT_TOKEN = "123456:BENCH"
+USER_TG_BASE = 10_000_000
+
+
+def prepare_env(db_path: str, workdir: str, **extra: str) -> None:
+    # Must run before anything imports app.main: config is read at import time.
+    os.environ["BOT_TOKEN"] = BENCH_BOT_TOKEN
+    os.environ["WEBHOOK_URL"] = "https://bench.invalid/webhook"
+    os.environ["WEBHOOK_SECRET"] = ""
+    os.environ["DB_PATH"] = db_path
+    os.environ["APP_PREFIX"] = ""
+    os.environ["ADMIN_TG_IDS"] = "1"
+    os.environ["MTPROXY_SERVICE"] = ""
+    os.environ["MTPROXY_SECRETS_FILE"] = os.path.join(workdir, "mtproxy_secrets.txt")
+    os.environ["PROXY_PROVIDER"] = "mock"
+    for key, value in extra.items():
+        os.environ[key] = value
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(values: List[float], scale: float = 1.0, digits: int = 3) -> Dict[str, float]:
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0, "mean": 0.0}
+    return {
+        "p50": round(percentile(values, 50) * scale, digits),
+        "p95": round(percentile(values, 95) * scale, digits),
+        "p99": round(percentile(values, 99) * scale, digits),
+        "max": round(max(values) * scale, digits),
+        "mean": round(sum(values) / len(values) * scale, digits),
+    }
+
+
+def peak_rss_mb() -> float:
+    try:
+        import resource
+    except ImportError:  # pragma: no cover - not on Windows
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes.
+    if sys.platform == "darwin":
+        return round(usage / (1024 * 1024), 1)
+    return round(usage / 1024, 1)
+
+
+def iso(dt: datetime) -> str:
+    return dt.replace(microsecond=0).isoformat() + "Z"
+
+
+# Telegram calls recorded by StubSession while a benchmarked update is running.
+current_calls: ContextVar[Optional[List[str]]] = ContextVar("bench_current_calls", default=None)
+
+
+def _build_stub_session():
+    from aiogram.client.session.base import BaseSession
+    from aiogram.types import Chat, Message, PhotoSize, User
+
+    class StubSession(BaseSession):
+        """Bot API session that records calls and fabricates plausible results."""
+
+        def __init__(self) -> None:
+            super().__init__()
+            self.calls: Dict[str, int] = {}
+            self._message_ids = itertools.count(1_000_000)
+            self.latency_sec = 0.0
+            # getUpdates stand-in: updates queued by push_update, served with Bot API offset semantics.
+            self.pending: List[Any] = []
+            self._arrived = asyncio.Event()
+
+        def push_update(self, update) -> None:
+            self.pending.append(update)
+            self._arrived.set()
+
+        async def _get_updates(self, method) -> List[Any]:
+            if method.offset is not None:
+                self.pending = [u for u in self.pending if u.update_id >= method.offset]
+            if not self.pending and method.timeout:
+                self._arrived.clear()
+                try:
+                    await asyncio.wait_for(self._arrived.wait(), timeout=method.timeout)
+                except asyncio.TimeoutError:
+                    pass
+            return self.pending[: method.limit or 100]
+
+        async def close(self) -> None:
+            return None
+
+        async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+            yield b""
+
+        def _fake_result(self, bot, method) -> Any:
+            returning = method.__returning__
+            options = typing.get_args(returning) or (returning,)
+            if Message in options:
+                chat_id = getattr(method, "chat_id", None)
+                if not isinstance(chat_id, int):
+                    chat_id = 0
+                message_id = getattr(method, "message_id", None) or next(self._message_ids)
+                # Uploads come back with a file_id, which the bot reuses instead of uploading again.
+                photo = [PhotoSize(file_id="bench-photo", file_unique_id="bench-photo", width=1, height=1)]
+                return Message(
+                    message_id=message_id,
+                    date=datetime.utcnow(),
+                    chat=Chat(id=chat_id, type="private"),
+                    photo=photo if type(method).__name__ == "SendPhoto" else None,
+                ).as_(bot)
+            if bool in options:
+                return True
+            if User in options:
+                return User(id=int(BENCH_BOT_TOKEN.split(":")[0]), is_bot=True, first_name="Bench", username="bench_bot")
+            if str in options:
+                return "https://t.me/$bench"
+            origin = typing.get_origin(returning)
+            if origin in (list, List):
+                return []
+            return None
+
+        async def make_request(self, bot, method, timeout=None):
+            name = type(method).__name__
+            self.calls[name] = self.calls.get(name, 0) + 1
+            bucket = current_calls.get()
+            if bucket is not None:
+                bucket.append(name)
+            if self.latency_sec:
+                await asyncio.sleep(self.latency_sec)
+            if name == "GetUpdates":
+                return await self._get_updates(method)
+            return self._fake_result(bot, method)
+
+    return StubSession
+
+
+def install_stub_session(bot, latency_ms: float = 0.0):
+    from bot.middlewares import TelegramApiMetricsMiddleware
+
+    session = _build_stub_session()()
+    session.latency_sec = max(0.0, latency_ms) / 1000
+    session.middleware(TelegramApiMetricsMiddleware())
+    bot.session = session
+    return session
+
+
+async def asgi_request(
+    app,
+    method: str,
+    path: str,
+    body: bytes = b"",
+    headers: Optional[Dict[str, str]] = None,
+) -> tuple[int, bytes]:
+    raw_headers = [(b"content-length", str(len(body)).encode())]
+    for key, value in (headers or {}).items():
+        raw_headers.append((key.lower().encode(), value.encode()))
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": raw_headers,
+        "client": ("127.0.0.1", 50000),
+        "server": ("bench", 80),
+    }
+    delivered = False
+
+    async def receive() -> dict:
+        nonlocal delivered
+        if not delivered:
+            delivered = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return {"type": "http.disconnect"}
+
+    status = 0
+    chunks: List[bytes] = []
+
+    async def send(message: dict) -> None:
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return status, b"".join(chunks)
+
+
+def seed_basic(
+    db_path: str,
+    users: int,
+    proxies_per_user: float = 1.0,
+    payments_per_user: float = 1.0,
+    ref_links: int = 10,
+) -> Dict[str, Any]:
+    """Uniform seed for the webhook benchmark; scripts/gen_dataset.py builds skewed ones."""
+    from bot.db import (
+        BACKFILL_NEXT_BILL_SQL,
+        BACKFILL_PAYMENT_PROVIDER_SQL,
+        EPOCH_BACKFILL_DONE_SQL,
+        EPOCH_BACKFILL_SQL,
+        EPOCH_INDEX_SQL,
+        OPENING_LEDGER_SQL,
+    )
+
+    conn = sqlite3.connect(db_path)
+    try:
+        now = datetime.utcnow()
+        created = iso(now - timedelta(days=30))
+        conn.executemany(
+            "INSERT INTO users (tg_id, username, ref_code, balance, created_at, last_seen_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                (USER_TG_BASE + i, f"user{i}", f"u{i:08d}", 50 + (i * 37) % 500, created, created)
+                for i in range(users)
+            ),
+        )
+        conn.execute(OPENING_LEDGER_SQL)
+        proxies_total = int(users * proxies_per_user)
+        conn.executemany(
+            "INSERT INTO proxies (user_id, login, password, ip, port, status, is_free, mtproto_secret, "
+            "created_at, last_billed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                (
+                    1 + (i % users),
+                    f"bench{i:09d}",
+                    "x" * 12,
+                    "127.0.0.1",
+                    1080,
+                    "active",
+                    1 if i < users else 0,
+                    f"{i:032x}",
+                    created,
+                    iso(now - timedelta(hours=1)),
+                )
+                for i in range(proxies_total)
+            ),
+        )
+        conn.execute(BACKFILL_NEXT_BILL_SQL)
+        payments_total = int(users * payments_per_user)
+        conn.executemany(
+            "INSERT INTO payments (user_id, amount, status, provider_payment_id, payload, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                (1 + (i % users), 100 + (i % 5) * 50, "paid", f"stars:{i}", f"stars:{i}", created)
+                for i in range(payments_total)
+            ),
+        )
+        conn.execute(BACKFILL_PAYMENT_PROVIDER_SQL)
+        codes = [f"bench{i}" for i in range(ref_links)]
+        conn.executemany(
+            "INSERT INTO referral_links (code, name, bonus_inviter, bonus_invited, created_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            ((code, code, 10, 10, created) for code in codes),
+        )
+        for sql in EPOCH_INDEX_SQL + EPOCH_BACKFILL_SQL:
+            conn.execute(sql)
+        conn.execute(EPOCH_BACKFILL_DONE_SQL)
+        conn.commit()
+    finally:
+        conn.close()
+    return {"users": users, "proxies": proxies_total, "payments": payments_total, "ref_codes": codes}
+
+
+def load_json(path: str) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def compare_to_baseline(
+    current: Dict[str, Any],
+    baseline: Dict[str, Any],
+    keys: List[str],
+) -> Dict[str, Dict[str, float]]:
+    """Percent change per dotted key path; positive means the current run is larger."""
+
+    def pick(data: Dict[str, Any], dotted: str) -> Optional[float]:
+        node: Any = data
+        for part in dotted.split("."):
+            if not isinstance(node, dict) or part not in node:
+                return None
+            node = node[part]
+        return float(node) if isinstance(node, (int, float)) else None
+
+    diff: Dict[str, Dict[str, float]] = {}
+    for key in keys:
+        old, new = pick(baseline, key), pick(current, key)
+        if old is None or new is None:
+            continue
+        change = ((new - old) / old * 100) if old else 0.0
+        diff[key] = {"baseline": old, "current": new, "change_pct": round(change, 1)}
+    return diff
+
+
+class Timer:
+    def __init__(self) -> None:
+        self.started = 0.0
+        self.elapsed = 0.0
+
+    def __enter__(self) -> "Timer":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.elapsed = time.perf_counter() - self.started
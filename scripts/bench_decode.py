@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from scripts.bench_common import USER_TG_BASE
+from scripts.bench_webhook import TrafficGenerator
+
+
+def build_bodies(count: int, unsupported_share: float, seed: int) -> List[bytes]:
+    # Webhook bodies as Telegram sends them: compact JSON, update_id first.
+    rng = random.Random(seed)
+    gen = TrafficGenerator(1000, ["bench0"], rng)
+    bodies: List[bytes] = []
+    for _ in range(count):
+        tg_id = USER_TG_BASE + rng.randrange(1000)
+        roll = rng.random()
+        if roll < unsupported_share:
+            update = gen.message(tg_id, "edited text")
+            update["edited_message"] = update.pop("message")
+        elif roll < unsupported_share + (1 - unsupported_share) / 2:
+            update = gen.message(tg_id, rng.choice(["/start", "/start bench0", "150", "Не работает прокси"]))
+        else:
+            update = gen.callback(tg_id, rng.choice(["menu:proxies", "proxy:buy", "menu:topup", "menu:support"]))
+        bodies.append(json.dumps(update, ensure_ascii=False, separators=(",", ":")).encode())
+    return bodies
+
+
+def measure(decoders: Dict[str, Callable[[bytes], object]], bodies: List[bytes], rounds: int) -> Dict[str, float]:
+    # Rounds alternate between decoders and the best one counts, so background noise hits both alike.
+    for decode in decoders.values():
+        for body in bodies[:200]:
+            decode(body)
+    best = {name: float("inf") for name in decoders}
+    for _ in range(rounds):
+        for name, decode in decoders.items():
+            started = time.process_time()
+            for body in bodies:
+                decode(body)
+            best[name] = min(best[name], time.process_time() - started)
+    return {name: round(value / len(bodies) * 1e6, 2) for name, value in best.items()}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="CPU на декодирование тела webhook: dict + model_validate против peek + model_validate_json")
+    parser.add_argument("--updates", type=int, default=20000)
+    parser.add_argument("--unsupported-share", type=float, default=0.1, help="доля апдейтов типов без хендлеров")
+    parser.add_argument("--rounds", type=int, default=15, help="лучший из N прогонов")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    from aiogram.types import Update
+    from bot.handlers import routers
+    from aiogram import Dispatcher
+    from bot.services import update_decoder
+    from bot.services.update_decoder import peek_update
+
+    dp = Dispatcher()
+    for router in routers:
+        dp.include_router(router)
+    allowed = set(dp.resolve_used_update_types())
+    bodies = build_bodies(args.updates, args.unsupported_share, args.seed)
+
+    def before(body: bytes) -> object:
+        # request.json() followed by Update.model_validate(data).
+        return Update.model_validate(json.loads(body))
+
+    def after(body: bytes) -> object:
+        _, update_type = peek_update(body)
+        if update_type is not None and update_type not in allowed:
+            return None
+        return Update.model_validate_json(body)
+
+    result = {
+        "updates": len(bodies),
+        "unsupported_share": args.unsupported_share,
+        "mean_body_bytes": round(sum(map(len, bodies)) / len(bodies), 1),
+        "orjson": update_decoder.orjson is not None,
+        "cpu_us_per_update": measure({"before": before, "after": after}, bodies, args.rounds),
+    }
+    cpu = result["cpu_us_per_update"]
+    result["speedup"] = round(cpu["before"] / max(cpu["after"], 1e-9), 2)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
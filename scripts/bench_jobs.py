@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from scripts.bench_common import Timer, current_calls, install_stub_session, peak_rss_mb, prepare_env
+
+EXPORT_KINDS = ("users", "users_balances", "proxies", "payments", "referrals", "audit")
+BROADCAST_AUDIENCES = ("all", "active7", "active_proxies", "balance_pos")
+JOBS: List[str] = (
+    [
+        "billing",
+        "mtproto_sync",
+        "freekassa_poll",
+        "support_sla",
+        "payments_maintenance",
+        "retention",
+        "admin_stats",
+    ]
+    + [f"export:{kind}" for kind in EXPORT_KINDS]
+    + [f"broadcast:{action}" for action in BROADCAST_AUDIENCES]
+)
+
+
+class _StubMessage:
+    def __init__(self) -> None:
+        self.document_bytes = 0
+
+    async def answer_document(self, document, **kwargs) -> None:
+        self.document_bytes = len(document.data)
+
+
+async def _start_freekassa_stub(latency_ms: float, seed: int):
+    from aiohttp import web
+
+    rng = random.Random(seed)
+
+    async def orders(request: web.Request) -> web.Response:
+        if latency_ms:
+            await asyncio.sleep(latency_ms / 1000)
+        try:
+            payload = await request.json()
+        except Exception:
+            payload = {}
+        payment_id = str(payload.get("paymentId") or request.match_info.get("order_id") or "0")
+        status = rng.choice((0, 0, 0, 1, 8, 9))
+        return web.json_response({"orders": [{"merchant_order_id": payment_id, "status": status}]})
+
+    app = web.Application()
+    app.router.add_post("/orders", orders)
+    app.router.add_post("/orders/status", orders)
+    app.router.add_get("/orders/{order_id}", orders)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+async def _run_child(job: str, db_path: str, fk_latency_ms: float) -> Dict[str, Any]:
+    workdir = tempfile.mkdtemp(prefix="bench_jobs_")
+    runner = None
+    extra_env: Dict[str, str] = {}
+    if job == "freekassa_poll":
+        runner, base = await _start_freekassa_stub(fk_latency_ms, seed=1)
+        extra_env = {
+            "FREEKASSA_API_BASE": base,
+            "FREEKASSA_SHOP_ID": "1",
+            "FREEKASSA_API_KEY": "bench",
+            "FREEKASSA_SECRET_WORD_2": "bench",
+        }
+    prepare_env(db_path, workdir, LOOP_LAG_THRESHOLD_MS="0", **extra_env)
+    try:
+        import app.main as main_mod
+        from bot import dao
+        from bot.db import close_pool, epoch_backfill_done, get_db
+        from bot.handlers import admin
+        from bot.services.billing import run_billing_once
+        from bot.services.db_profiler import query_budget
+        from bot.services.mtproto import sync_mtproto_secrets
+        from bot.services.retention import run_retention
+        from bot.runtime import runtime
+        from bot.services.scheduler import FREEKASSA_POLL, SUPPORT_SLA, scheduler
+
+        install_stub_session(main_mod.bot)
+        rss_before = peak_rss_mb()
+        calls: List[str] = []
+        token = current_calls.set(calls)
+        extra: Dict[str, Any] = {}
+        db = await get_db(db_path)
+        runtime.epoch_ts_ready = await epoch_backfill_done(db)
+        try:
+            with query_budget(10**12) as budget, Timer() as timer:
+                if job == "billing":
+                    result = await run_billing_once(db)
+                    extra = {
+                        "changed": result.changed,
+                        "users_disabled": len(result.disabled_by_balance),
+                        "low_balance_warnings": len(result.low_balance_warnings),
+                    }
+                elif job == "mtproto_sync":
+                    await sync_mtproto_secrets(db)
+                elif job in ("freekassa_poll", "support_sla"):
+                    # Startup backfill registers every pending order / open ticket; then fire them all at once.
+                    await dao.backfill_scheduled_tasks(db, 0)
+                    kind = FREEKASSA_POLL if job == "freekassa_poll" else SUPPORT_SLA
+                    extra = {"tasks_fired": await scheduler.run_due(db, now=float("inf"), kind=kind)}
+                elif job == "payments_maintenance":
+                    extra = {
+                        "expired": await main_mod._expire_pending_payments(db),
+                        "archived": await dao.archive_payments(db, time.time() - 90 * 86400),
+                    }
+                elif job == "retention":
+                    result = await run_retention(db, os.path.join(workdir, "archive"))
+                    extra = {"removed": result.removed, "vacuumed_pages": result.vacuumed_pages}
+                elif job == "admin_stats":
+                    await admin._admin_stats_text(db)
+                elif job.startswith("export:"):
+                    message = _StubMessage()
+                    await admin._send_export_csv(job.split(":", 1)[1], message, db)
+                    extra = {"csv_bytes": message.document_bytes}
+                elif job.startswith("broadcast:"):
+                    rows = await admin._broadcast_audience(db, job.split(":", 1)[1])
+                    extra = {"recipients": len(rows)}
+                else:
+                    raise SystemExit(f"unknown job {job}")
+        finally:
+            await db.close()
+            # Pooled connections outlive close(); closing them checkpoints the WAL before the next copy.
+            await close_pool()
+            current_calls.reset(token)
+        return {
+            "wall_sec": round(timer.elapsed, 4),
+            "statements": len(budget.statements),
+            "telegram_calls": len(calls),
+            "rss_before_mb": rss_before,
+            "peak_rss_mb": peak_rss_mb(),
+            **extra,
+        }
+    finally:
+        if runner is not None:
+            await runner.cleanup()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _dataset_counts(db_path: str) -> Dict[str, int]:
+    conn = sqlite3.connect(db_path)
+    try:
+        return {
+            table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in ("users", "proxies", "payments", "support_tickets", "referral_clicks")
+        }
+    finally:
+        conn.close()
+
+
+def _run_job_subprocess(job: str, db_path: str, timeout: float, fk_latency_ms: float) -> Dict[str, Any]:
+    cmd = [
+        sys.executable,
+        str(Path(__file__).resolve()),
+        "--child",
+        job,
+        "--db",
+        db_path,
+        "--fk-latency-ms",
+        str(fk_latency_ms),
+    ]
+    try:
+        proc = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout, cwd=str(ROOT))
+    except subprocess.TimeoutExpired:
+        return {"error": f"timeout after {timeout:.0f}s"}
+    if proc.returncode != 0:
+        tail = (proc.stderr or proc.stdout).strip().splitlines()[-5:]
+        return {"error": "\n".join(tail)}
+    try:
+        return json.loads(proc.stdout.strip().splitlines()[-1])
+    except (IndexError, json.JSONDecodeError):
+        return {"error": "no result", "stdout": proc.stdout[-500:]}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Бенчмарк фоновых и админских задач на синтетических БД")
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="размеры БД (пользователей) через запятую")
+    parser.add_argument("--jobs", default=",".join(JOBS), help="задачи через запятую")
+    parser.add_argument("--data-dir", default="data/bench", help="где хранить сгенерированные БД")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--regen", action="store_true", help="пересоздать БД, даже если есть")
+    parser.add_argument("--timeout", type=float, default=900.0, help="таймаут одной задачи, сек")
+    parser.add_argument("--fk-latency-ms", type=float, default=20.0, help="задержка заглушки FreeKassa")
+    parser.add_argument("--out", help="куда записать JSON (по умолчанию stdout)")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--db", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = asyncio.run(_run_child(args.child, args.db, args.fk_latency_ms))
+        print(json.dumps(result))
+        return
+
+    from scripts.gen_dataset import generate
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    jobs = [job.strip() for job in args.jobs.split(",") if job.strip()]
+    report: Dict[str, Any] = {"seed": args.seed, "sizes": {}}
+    for size in [int(item) for item in args.sizes.split(",") if item.strip()]:
+        dataset = os.path.join(args.data_dir, f"users_{size}_seed{args.seed}.db")
+        if args.regen or not os.path.exists(dataset):
+            print(f"[{size}] generating {dataset} ...", file=sys.stderr)
+            generate(dataset, size, args.seed)
+        entry: Dict[str, Any] = {"dataset": _dataset_counts(dataset), "jobs": {}}
+        work_copy = os.path.join(args.data_dir, f"work_{size}.db")
+        for job in jobs:
+            # Jobs mutate the DB (billing, reconcile), so each one starts from the same snapshot.
+            for suffix in ("-wal", "-shm"):
+                if os.path.exists(work_copy + suffix):
+                    os.remove(work_copy + suffix)
+            shutil.copyfile(dataset, work_copy)
+            result = _run_job_subprocess(job, work_copy, args.timeout, args.fk_latency_ms)
+            entry["jobs"][job] = result
+            if "error" in result:
+                print(f"[{size}] {job:<28} ERROR {result['error']}", file=sys.stderr)
+            else:
+                print(
+                    f"[{size}] {job:<28} {result['wall_sec']:>9.3f}s "
+                    f"{result['statements']:>9} stmts {result['peak_rss_mb']:>8.1f} MB",
+                    file=sys.stderr,
+                )
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(work_copy + suffix):
+                os.remove(work_copy + suffix)
+        report["sizes"][str(size)] = entry
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        Path(args.out).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from scripts.bench_common import BENCH_BOT_TOKEN
+
+
+def _best_us(fn: Callable[[], object], repeat: int, rounds: int) -> float:
+    best = float("inf")
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+        best = min(best, time.perf_counter() - started)
+    return round(best / repeat * 1e6, 2)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Стоимость клавиатуры на один рендер: построение + сериализация запроса")
+    parser.add_argument("--repeat", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.methods import EditMessageText
+
+    from bot import keyboards
+    from bot.session import PreparedMarkupSession
+
+    proxies = [{"id": i, "login": f"user{i}"} for i in range(5)]
+    cases: Dict[str, tuple] = {
+        # name -> (uncached builder, cached call)
+        "main_menu_inline_kb": (lambda: keyboards.main_menu_inline_kb.__wrapped__(False), lambda: keyboards.main_menu_inline_kb(False)),
+        "admin_menu_inline_kb": (keyboards.admin_menu_inline_kb.__wrapped__, keyboards.admin_menu_inline_kb),
+        "help_kb": (keyboards.help_kb.__wrapped__, keyboards.help_kb),
+        "topup_quick_kb": (lambda: keyboards.topup_quick_kb.__wrapped__("stars"), lambda: keyboards.topup_quick_kb("stars")),
+        "proxies_list_kb[5]": (
+            lambda: keyboards._proxies_list_kb.__wrapped__(tuple((p["id"], p["login"]) for p in proxies)),
+            lambda: keyboards.proxies_list_kb(proxies),
+        ),
+        "admin_settings_kb": (lambda: keyboards._build_admin_settings_kb({}), lambda: keyboards.admin_settings_kb({}, 1)),
+    }
+    bot = Bot(token=BENCH_BOT_TOKEN)
+    plain, prepared = AiohttpSession(), PreparedMarkupSession()
+    rows = {}
+    for name, (build, cached) in cases.items():
+        def before() -> None:
+            method = EditMessageText(chat_id=1, message_id=1, text="x", reply_markup=build())
+            plain.build_form_data(bot, method)
+
+        def after() -> None:
+            method = EditMessageText(chat_id=1, message_id=1, text="x", reply_markup=cached())
+            prepared.build_form_data(bot, method)
+
+        rows[name] = {
+            "before_us": _best_us(before, args.repeat, args.rounds),
+            "after_us": _best_us(after, args.repeat, args.rounds),
+        }
+    print(json.dumps(rows, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from scripts.bench_common import install_stub_session, prepare_env, seed_basic, summarize
+from scripts.bench_webhook import SCENARIOS, Recorder, TrafficGenerator, _post_update
+
+
+async def _drive(gen: TrafficGenerator, rate: float, duration: float, run_session) -> float:
+    # Same open-loop arrival of user sessions as bench_webhook; steps of one session stay sequential.
+    mean_steps = sum(w * len(steps) for w, steps in SCENARIOS.values()) / sum(w for w, _ in SCENARIOS.values())
+    interval = mean_steps / max(rate, 0.1)
+    tasks: List[asyncio.Task] = []
+    started = time.perf_counter()
+    next_at = started
+    while time.perf_counter() - started < duration:
+        tasks.append(asyncio.create_task(run_session(gen.pick())))
+        next_at += interval
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+    await asyncio.gather(*tasks)
+    return time.perf_counter() - started
+
+
+def _report(recorder: Recorder, elapsed: float) -> Dict[str, object]:
+    return {
+        "updates": len(recorder.latencies),
+        "errors": recorder.errors,
+        "elapsed_sec": round(elapsed, 3),
+        "throughput_ups": round(len(recorder.latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": summarize(recorder.latencies, scale=1000),
+    }
+
+
+async def run(args: argparse.Namespace) -> dict:
+    workdir = tempfile.mkdtemp(prefix="bench_polling_")
+    db_path = str(Path(workdir) / "bot.db")
+    prepare_env(
+        db_path,
+        workdir,
+        LOOP_LAG_THRESHOLD_MS="0",
+        UPDATE_MODE="polling",
+        POLLING_LIMIT=str(args.limit),
+        RATE_LIMIT_START_PER_MIN="100000",
+        RATE_LIMIT_TOPUP_PER_MIN="100000",
+        RATE_LIMIT_SUPPORT_PER_MIN="100000",
+    )
+    try:
+        import app.main as main_mod
+        from aiogram.types import Update
+        from bot import dao
+        from bot.db import ensure_default_settings, get_db, init_db
+        from bot.runtime import runtime
+        from bot.services.flood_control import reload_policy
+        from bot.services.mtproto import sync_mtproto_secrets
+
+        session = install_stub_session(main_mod.bot, args.api_latency_ms)
+        db = await get_db(db_path)
+        try:
+            await init_db(db)
+            await ensure_default_settings(db)
+        finally:
+            await db.close()
+        seeded = seed_basic(db_path, args.users, 1.5, 2.0)
+        db = await get_db(db_path)
+        try:
+            await sync_mtproto_secrets(db)
+            await dao.set_setting(db, "flood_user_budget_per_min", "0")
+            await dao.set_setting(db, "flood_global_per_sec", "0")
+            await reload_policy(db)
+        finally:
+            await db.close()
+        runtime.ready = True
+        runtime.is_leader = True
+        gen = TrafficGenerator(args.users, seeded["ref_codes"], random.Random(args.seed))
+        result: Dict[str, object] = {
+            "config": {
+                "users": args.users,
+                "rate_ups": args.rate,
+                "duration_sec": args.duration,
+                "api_latency_ms": args.api_latency_ms,
+                "polling_limit": args.limit,
+            }
+        }
+
+        if args.mode in ("webhook", "both"):
+            recorder = Recorder()
+
+            async def webhook_session(scenario: str) -> None:
+                tg_id = gen.user_for(scenario)
+                for kind, payload in SCENARIOS[scenario][1]:
+                    update = gen.message(tg_id, payload) if kind == "message" else gen.callback(tg_id, payload)
+                    await _post_update(main_mod.app, main_mod.WEBHOOK_PATH, update, scenario, recorder)
+
+            elapsed = await _drive(gen, args.rate, args.duration, webhook_session)
+            result["webhook"] = _report(recorder, elapsed)
+
+        if args.mode in ("polling", "both"):
+            recorder = Recorder()
+            waiters: Dict[int, asyncio.Future] = {}
+            original = main_mod.process_update
+
+            async def tracked(update) -> None:
+                try:
+                    await original(update)
+                finally:
+                    waiter = waiters.pop(update.update_id, None)
+                    if waiter is not None and not waiter.done():
+                        waiter.set_result(None)
+
+            # polling_loop looks process_update up in the module on every call.
+            main_mod.process_update = tracked
+            poller = asyncio.create_task(main_mod.polling_loop())
+
+            async def polling_session(scenario: str) -> None:
+                tg_id = gen.user_for(scenario)
+                for kind, payload in SCENARIOS[scenario][1]:
+                    data = gen.message(tg_id, payload) if kind == "message" else gen.callback(tg_id, payload)
+                    waiter = asyncio.get_running_loop().create_future()
+                    waiters[data["update_id"]] = waiter
+                    started = time.perf_counter()
+                    session.push_update(Update.model_validate(data))
+                    await waiter
+                    recorder.add(scenario, time.perf_counter() - started, 0, 0, 200)
+
+            elapsed = await _drive(gen, args.rate, args.duration, polling_session)
+            poller.cancel()
+            main_mod.process_update = original
+            report = _report(recorder, elapsed)
+            report["getupdates_calls"] = session.calls.get("GetUpdates", 0)
+            result["polling"] = report
+        return result
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Пропускная способность getUpdates против webhook (in-process)")
+    parser.add_argument("--mode", choices=("both", "webhook", "polling"), default="both")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--rate", type=float, default=100.0, help="целевой поток апдейтов в секунду")
+    parser.add_argument("--duration", type=float, default=15.0)
+    parser.add_argument("--api-latency-ms", type=float, default=20.0, help="задержка заглушки Bot API, в т.ч. getUpdates")
+    parser.add_argument("--limit", type=int, default=100, help="POLLING_LIMIT")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="куда записать JSON (по умолчанию stdout)")
+    args = parser.parse_args()
+    text = json.dumps(asyncio.run(run(args)), ensure_ascii=False, indent=2)
+    if args.out:
+        Path(args.out).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from scripts.bench_common import USER_TG_BASE, seed_basic, summarize
+
+DURABILITY = {
+    "safe": "commit survives power loss",
+    "balanced": "no corruption; last commits may roll back on power loss",
+    "fast": "OS crash or power loss can corrupt the DB",
+}
+
+# (op, weight); the ops mirror what a webhook update does to the DB.
+OPS = (
+    ("read_user", 40),
+    ("read_proxies", 25),
+    ("touch_user", 20),
+    ("dedupe_update", 10),
+    ("ledger_credit", 5),
+)
+
+
+async def _op(name: str, db, rng: random.Random, users: int, seq: List[int]) -> None:
+    from bot import dao
+
+    tg_id = USER_TG_BASE + rng.randrange(users)
+    if name == "read_user":
+        await dao.get_user_by_tg_id(db, tg_id)
+    elif name == "read_proxies":
+        await dao.list_proxies_by_user(db, 1 + rng.randrange(users))
+    elif name == "touch_user":
+        await dao.update_user_last_seen(db, tg_id)
+    elif name == "dedupe_update":
+        seq[0] += 1
+        await dao.insert_processed_update(db, seq[0])
+    else:
+        seq[0] += 1
+        await dao.add_user_balance(db, 1 + rng.randrange(users), 1, kind="bench", idempotency_key=f"bench:{seq[0]}")
+
+
+async def _worker(db_path: str, deadline: float, rng: random.Random, users: int, seq: List[int], out: Dict[str, Any]) -> None:
+    from bot.db import get_db
+
+    names = [name for name, weight in OPS for _ in range(weight)]
+    while time.perf_counter() < deadline:
+        name = rng.choice(names)
+        started = time.perf_counter()
+        try:
+            # One connection per "update", as the handlers do; the pool decides whether that opens a file.
+            db = await get_db(db_path)
+            try:
+                await _op(name, db, rng, users, seq)
+            finally:
+                await db.close()
+        except sqlite3.OperationalError as exc:
+            out["errors"][str(exc)] = out["errors"].get(str(exc), 0) + 1
+            continue
+        elapsed = time.perf_counter() - started
+        out["latencies"].append(elapsed)
+        out["read_latencies" if name.startswith("read_") else "write_latencies"].append(elapsed)
+
+
+async def _run_profile(base_db: str, workdir: str, profile: str, pool_size: int, args: argparse.Namespace) -> Dict[str, Any]:
+    from bot.db import close_pool
+
+    db_path = os.path.join(workdir, f"{profile}_{pool_size}.db")
+    shutil.copyfile(base_db, db_path)
+    os.environ["SQLITE_PROFILE"] = profile
+    os.environ["SQLITE_POOL_SIZE"] = str(pool_size)
+    seq = [10**12]
+    out: Dict[str, Any] = {"latencies": [], "read_latencies": [], "write_latencies": [], "errors": {}}
+    rng = random.Random(args.seed)
+    deadline = time.perf_counter() + args.duration
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(
+            _worker(db_path, deadline, random.Random(rng.random()), args.users, seq, out)
+            for _ in range(args.concurrency)
+        )
+    )
+    wall = time.perf_counter() - started
+    wal_path = db_path + "-wal"
+    wal_mb = round(os.path.getsize(wal_path) / 1024 / 1024, 2) if os.path.exists(wal_path) else 0.0
+    await close_pool()
+    return {
+        "profile": profile,
+        "pool_size": pool_size,
+        "durability": DURABILITY.get(profile, ""),
+        "ops": len(out["latencies"]),
+        "ops_per_sec": round(len(out["latencies"]) / wall, 1),
+        "latency_ms": summarize(out["latencies"], 1000),
+        "read_ms": summarize(out["read_latencies"], 1000),
+        "write_ms": summarize(out["write_latencies"], 1000),
+        "errors": out["errors"],
+        "wal_mb": wal_mb,
+    }
+
+
+async def main_async(args: argparse.Namespace) -> Dict[str, Any]:
+    from bot.db import close_pool, ensure_default_settings, get_db, init_db
+
+    workdir = tempfile.mkdtemp(prefix="bench_sqlite_")
+    try:
+        base_db = os.path.join(workdir, "base.db")
+        os.environ["SQLITE_POOL_SIZE"] = "0"
+        db = await get_db(base_db)
+        try:
+            await init_db(db)
+            await ensure_default_settings(db)
+        finally:
+            await db.close()
+        seed_basic(base_db, args.users, 1.0, 1.0)
+        conn = sqlite3.connect(base_db)
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.close()
+        await close_pool()
+        results = []
+        for profile in args.profiles.split(","):
+            for pool_size in (int(item) for item in args.pool_sizes.split(",")):
+                result = await _run_profile(base_db, workdir, profile.strip(), pool_size, args)
+                results.append(result)
+                print(
+                    f"{profile:<9} pool={pool_size:<3} {result['ops_per_sec']:>9.1f} ops/s  "
+                    f"p50={result['latency_ms']['p50']:.2f}ms p99={result['latency_ms']['p99']:.2f}ms  "
+                    f"write p99={result['write_ms']['p99']:.2f}ms  wal={result['wal_mb']}MB  "
+                    f"errors={sum(result['errors'].values())}",
+                    file=sys.stderr,
+                )
+        return {
+            "users": args.users,
+            "concurrency": args.concurrency,
+            "duration_sec": args.duration,
+            "results": results,
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Пропускная способность и надёжность профилей SQLite")
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=16, help="одновременных «апдейтов»")
+    parser.add_argument("--duration", type=float, default=10.0, help="секунд на профиль")
+    parser.add_argument("--profiles", default="safe,balanced,fast")
+    parser.add_argument("--pool-sizes", default="0,8", help="размеры пула через запятую (0 — без пула)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="куда записать JSON (по умолчанию stdout)")
+    args = parser.parse_args()
+    report = asyncio.run(main_async(args))
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.out).write_text(text, encoding="utf-8")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from scripts.bench_common import install_stub_session, prepare_env, seed_basic, summarize
+
+
+async def _burst(main_mod, gen, count: int) -> Dict[str, float]:
+    from scripts.bench_webhook import Recorder, _run_session
+
+    recorder = Recorder()
+    await asyncio.gather(
+        *(_run_session(main_mod.app, main_mod.WEBHOOK_PATH, gen, gen.pick(), recorder) for _ in range(count))
+    )
+    return summarize(recorder.latencies, 1000)
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    workdir = tempfile.mkdtemp(prefix="bench_startup_")
+    db_path = str(Path(workdir) / "bot.db")
+    prepare_env(
+        db_path,
+        workdir,
+        LOOP_LAG_THRESHOLD_MS="0",
+        LOOP_START_JITTER_SEC=str(args.jitter),
+        RATE_LIMIT_START_PER_MIN="100000",
+        RATE_LIMIT_TOPUP_PER_MIN="100000",
+        RATE_LIMIT_SUPPORT_PER_MIN="100000",
+    )
+    try:
+        import app.main as main_mod
+        from bot import dao
+        from bot.db import close_pool, ensure_default_settings, get_db, init_db
+        from bot.runtime import runtime
+        from bot.services.metrics import STARTUP_STEP_SECONDS
+        from scripts.bench_webhook import TrafficGenerator
+
+        install_stub_session(main_mod.bot, args.api_latency_ms)
+        db = await get_db(db_path)
+        try:
+            await init_db(db)
+            await ensure_default_settings(db)
+            await dao.set_setting(db, "flood_user_budget_per_min", "0")
+            await dao.set_setting(db, "flood_global_per_sec", "0")
+        finally:
+            await db.close()
+        seeded = seed_basic(db_path, args.users, 1.0, 1.0)
+        await close_pool()
+        dao.invalidate_settings_cache()
+
+        # A restart: the process starts with empty caches against an existing database.
+        started = time.perf_counter()
+        await main_mod.on_startup()
+        serving_sec = time.perf_counter() - started
+        while not runtime.ready:
+            await asyncio.sleep(0.005)
+        ready_sec = time.perf_counter() - started
+
+        gen = TrafficGenerator(args.users, seeded["ref_codes"], random.Random(args.seed))
+        first = await _burst(main_mod, gen, args.burst)
+        second = await _burst(main_mod, gen, args.burst)
+        return {
+            "users": args.users,
+            "api_latency_ms": args.api_latency_ms,
+            "serving_sec": round(serving_sec, 4),
+            "ready_sec": round(ready_sec, 4),
+            "steps_sec": {labels[0]: round(slot[0], 4) for labels, slot in STARTUP_STEP_SECONDS._values.items()},
+            "first_burst_ms": first,
+            "second_burst_ms": second,
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Время до /ready и задержки первых апдейтов после рестарта")
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--burst", type=int, default=50, help="сессий в каждой пачке после готовности")
+    parser.add_argument("--api-latency-ms", type=float, default=50.0, help="задержка заглушки Bot API")
+    parser.add_argument("--jitter", type=float, default=10.0, help="LOOP_START_JITTER_SEC")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="куда записать JSON (по умолчанию stdout)")
+    args = parser.parse_args()
+    report = asyncio.run(run(args))
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.out).write_text(text, encoding="utf-8")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from scripts.bench_common import (
+    USER_TG_BASE,
+    compare_to_baseline,
+    current_calls,
+    install_stub_session,
+    load_json,
+    prepare_env,
+    seed_basic,
+    summarize,
+    asgi_request,
+)
+
+# name -> (weight, steps); a step is ("message", text) or ("callback", data).
+SCENARIOS: Dict[str, tuple] = {
+    "start": (25, [("message", "/start")]),
+    "start_new": (5, [("message", "/start")]),
+    "start_new_ref": (10, [("message", "/start {ref}")]),
+    "proxies": (25, [("callback", "menu:proxies")]),
+    "proxy_buy": (10, [("callback", "proxy:buy")]),
+    "topup": (
+        15,
+        [("callback", "menu:topup"), ("message", "150"), ("callback", "topup:method:stars")],
+    ),
+    "support": (10, [("callback", "menu:support"), ("message", "Не работает прокси, помогите")]),
+}
+BASELINE_KEYS = [
+    "throughput_ups",
+    "latency_ms.p50",
+    "latency_ms.p95",
+    "latency_ms.p99",
+    "db_statements_per_update.mean",
+    "telegram_calls_per_update.mean",
+]
+
+
+class TrafficGenerator:
+    def __init__(self, seeded_users: int, ref_codes: List[str], rng: random.Random) -> None:
+        self.seeded_users = seeded_users
+        self.ref_codes = ref_codes or ["none"]
+        self.rng = rng
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.new_users = itertools.count(USER_TG_BASE + seeded_users + 1)
+        self._names = list(SCENARIOS)
+        self._weights = [SCENARIOS[name][0] for name in self._names]
+
+    def pick(self) -> str:
+        return self.rng.choices(self._names, weights=self._weights, k=1)[0]
+
+    def user_for(self, scenario: str) -> int:
+        if scenario.startswith("start_new"):
+            return next(self.new_users)
+        return USER_TG_BASE + self.rng.randrange(self.seeded_users)
+
+    def _sender(self, tg_id: int) -> dict:
+        return {"id": tg_id, "is_bot": False, "first_name": "Bench", "username": f"user{tg_id - USER_TG_BASE}"}
+
+    def message(self, tg_id: int, text: str) -> dict:
+        text = text.format(ref=self.rng.choice(self.ref_codes))
+        message = {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": tg_id, "type": "private"},
+            "from": self._sender(tg_id),
+            "text": text,
+        }
+        if text.startswith("/"):
+            command = text.split(" ", 1)[0]
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        return {"update_id": next(self.update_ids), "message": message}
+
+    def callback(self, tg_id: int, data: str) -> dict:
+        update_id = next(self.update_ids)
+        return {
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "from": self._sender(tg_id),
+                "chat_instance": str(tg_id),
+                "data": data,
+                "message": {
+                    "message_id": next(self.message_ids),
+                    "date": int(time.time()),
+                    "chat": {"id": tg_id, "type": "private"},
+                    "from": {"id": 123456, "is_bot": True, "first_name": "Bench"},
+                    "text": "menu",
+                },
+            },
+        }
+
+
+class Recorder:
+    def __init__(self) -> None:
+        self.latencies: List[float] = []
+        self.statements: List[float] = []
+        self.calls: List[float] = []
+        self.by_scenario: Dict[str, Dict[str, List[float]]] = {}
+        self.status_codes: Dict[str, int] = {}
+        self.errors = 0
+
+    def add(self, scenario: str, latency: float, statements: int, calls: int, status: int) -> None:
+        self.latencies.append(latency)
+        self.statements.append(statements)
+        self.calls.append(calls)
+        bucket = self.by_scenario.setdefault(scenario, {"latency": [], "statements": [], "calls": []})
+        bucket["latency"].append(latency)
+        bucket["statements"].append(statements)
+        bucket["calls"].append(calls)
+        key = str(status)
+        self.status_codes[key] = self.status_codes.get(key, 0) + 1
+
+
+async def _post_update(app, path: str, update: dict, scenario: str, recorder: Recorder) -> None:
+    from bot.services.db_profiler import query_budget
+
+    body = json.dumps(update).encode()
+    calls: List[str] = []
+    token = current_calls.set(calls)
+    started = time.perf_counter()
+    status = 0
+    try:
+        with query_budget(10**9) as budget:
+            status, _ = await asgi_request(
+                app,
+                "POST",
+                path,
+                body,
+                headers={"content-type": "application/json"},
+            )
+    except Exception:
+        recorder.errors += 1
+        budget = None
+    finally:
+        current_calls.reset(token)
+    latency = time.perf_counter() - started
+    statements = len(budget.statements) if budget is not None else 0
+    recorder.add(scenario, latency, statements, len(calls), status)
+
+
+async def _run_session(app, path: str, gen: TrafficGenerator, scenario: str, recorder: Recorder) -> None:
+    tg_id = gen.user_for(scenario)
+    for kind, payload in SCENARIOS[scenario][1]:
+        update = gen.message(tg_id, payload) if kind == "message" else gen.callback(tg_id, payload)
+        await _post_update(app, path, update, scenario, recorder)
+
+
+async def run(args: argparse.Namespace) -> dict:
+    workdir = tempfile.mkdtemp(prefix="bench_webhook_")
+    db_path = str(Path(workdir) / "bot.db")
+    prepare_env(
+        db_path,
+        workdir,
+        LOOP_LAG_THRESHOLD_MS=str(args.loop_lag_threshold_ms),
+        RATE_LIMIT_START_PER_MIN="100000",
+        RATE_LIMIT_TOPUP_PER_MIN="100000",
+        RATE_LIMIT_SUPPORT_PER_MIN="100000",
+    )
+    try:
+        import app.main as main_mod
+        from bot.db import ensure_default_settings, get_db, init_db
+        from bot import dao
+        from bot.runtime import runtime
+        from bot.services.flood_control import reload_policy
+        from bot.services.mtproto import sync_mtproto_secrets
+
+        session = install_stub_session(main_mod.bot, args.api_latency_ms)
+        db = await get_db(db_path)
+        try:
+            await init_db(db)
+            await ensure_default_settings(db)
+        finally:
+            await db.close()
+        seeded = seed_basic(db_path, args.users, args.proxies_per_user, args.payments_per_user)
+        db = await get_db(db_path)
+        try:
+            await sync_mtproto_secrets(db)
+            if not args.flood_control:
+                # Synthetic traffic reuses a small user pool; measure handlers, not the flood limiter.
+                await dao.set_setting(db, "flood_user_budget_per_min", "0")
+                await dao.set_setting(db, "flood_global_per_sec", "0")
+            await reload_policy(db)
+        finally:
+            await db.close()
+        runtime.bg_enabled = not args.no_bg
+        # Startup warm-up is not run here; the webhook would otherwise wait READY_WAIT_SEC per update.
+        runtime.ready = True
+        main_mod.start_write_behind()
+
+        rng = random.Random(args.seed)
+        gen = TrafficGenerator(args.users, seeded["ref_codes"], rng)
+        recorder = Recorder()
+        mean_steps = sum(w * len(steps) for w, steps in SCENARIOS.values()) / sum(
+            w for w, _ in SCENARIOS.values()
+        )
+        session_interval = mean_steps / max(args.rate, 0.1)
+        inflight = asyncio.Semaphore(max(1, args.max_inflight))
+        tasks: List[asyncio.Task] = []
+
+        async def guarded(scenario: str) -> None:
+            async with inflight:
+                await _run_session(main_mod.app, main_mod.WEBHOOK_PATH, gen, scenario, recorder)
+
+        for _ in range(args.warmup):
+            await _run_session(main_mod.app, main_mod.WEBHOOK_PATH, gen, gen.pick(), Recorder())
+
+        started = time.perf_counter()
+        next_at = started
+        while time.perf_counter() - started < args.duration:
+            tasks.append(asyncio.create_task(guarded(gen.pick())))
+            next_at += session_interval
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+        await main_mod.stop_write_behind()
+
+        result = {
+            "config": {
+                "users": args.users,
+                "proxies": seeded["proxies"],
+                "payments": seeded["payments"],
+                "target_rate_ups": args.rate,
+                "duration_sec": args.duration,
+                "api_latency_ms": args.api_latency_ms,
+                "seed": args.seed,
+            },
+            "updates": len(recorder.latencies),
+            "errors": recorder.errors,
+            "status_codes": recorder.status_codes,
+            "elapsed_sec": round(elapsed, 3),
+            "throughput_ups": round(len(recorder.latencies) / elapsed, 2) if elapsed else 0.0,
+            "latency_ms": summarize(recorder.latencies, scale=1000),
+            "db_statements_per_update": summarize(recorder.statements, digits=2),
+            "telegram_calls_per_update": summarize(recorder.calls, digits=2),
+            "telegram_calls_total": dict(sorted(session.calls.items())),
+            "by_scenario": {
+                name: {
+                    "updates": len(data["latency"]),
+                    "latency_ms": summarize(data["latency"], scale=1000),
+                    "db_statements_per_update": summarize(data["statements"], digits=2),
+                    "telegram_calls_per_update": summarize(data["calls"], digits=2),
+                }
+                for name, data in sorted(recorder.by_scenario.items())
+            },
+        }
+        return result
+    finally:
+        if args.keep:
+            print(f"workdir kept: {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Нагрузочный бенчмарк webhook (in-process, ASGI)")
+    parser.add_argument("--users", type=int, default=2000, help="пользователей в тестовой БД")
+    parser.add_argument("--proxies-per-user", type=float, default=1.5)
+    parser.add_argument("--payments-per-user", type=float, default=2.0)
+    parser.add_argument("--rate", type=float, default=50.0, help="целевой поток апдейтов в секунду")
+    parser.add_argument("--duration", type=float, default=20.0, help="длительность замера, сек")
+    parser.add_argument("--warmup", type=int, default=20, help="сессий прогрева до замера")
+    parser.add_argument("--max-inflight", type=int, default=200, help="максимум одновременных сессий")
+    parser.add_argument("--api-latency-ms", type=float, default=0.0, help="искусственная задержка Bot API")
+    parser.add_argument("--loop-lag-threshold-ms", type=int, default=0, help="0 — без монитора лага")
+    parser.add_argument("--flood-control", action="store_true", help="оставить антифлуд с настройками по умолчанию")
+    parser.add_argument("--no-bg", action="store_true", help="отключить фоновую картинку")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="куда записать JSON (по умолчанию stdout)")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    parser.add_argument(
+        "--fail-on-regression",
+        type=float,
+        default=None,
+        help="код выхода 1, если p95/p99 выросли больше чем на N процентов",
+    )
+    parser.add_argument("--keep", action="store_true", help="не удалять временную БД")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    exit_code = 0
+    if args.baseline:
+        diff = compare_to_baseline(result, load_json(args.baseline), BASELINE_KEYS)
+        result["baseline_diff"] = diff
+        for key, row in diff.items():
+            print(f"{key}: {row['baseline']} -> {row['current']} ({row['change_pct']:+.1f}%)", file=sys.stderr)
+        if args.fail_on_regression is not None:
+            for key in ("latency_ms.p95", "latency_ms.p99"):
+                row: Optional[dict] = diff.get(key)
+                if row and row["change_pct"] > args.fail_on_regression:
+                    exit_code = 1
+
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.out:
+        Path(args.out).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
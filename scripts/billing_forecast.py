@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from dataclasses import replace
+from pathlib import Path
+from typing import Dict
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from bot.db import get_db
+from bot.services.forecast import (
+    FORECAST_SETTINGS,
+    BillingBook,
+    Forecast,
+    ForecastParams,
+    load_book,
+    load_params,
+    simulate,
+)
+
+
+def _parse_overrides(items) -> Dict[str, int]:
+    overrides: Dict[str, int] = {}
+    for item in items or []:
+        key, sep, value = item.partition("=")
+        if not sep or key not in FORECAST_SETTINGS:
+            raise SystemExit(f"--set ждёт ключ=значение, ключи: {', '.join(FORECAST_SETTINGS)}")
+        overrides[key] = max(0, int(value))
+    return overrides
+
+
+def _synthetic_book(users: int, seed: int) -> BillingBook:
+    # One entry per user (nothing shared), the worst case for the simulator.
+    rng = random.Random(seed)
+    book = BillingBook()
+    for _ in range(users):
+        balance = 0 if rng.random() < 0.3 else max(0, int(rng.paretovariate(1.3) * 20) - 10)
+        book.append(balance, int(rng.paretovariate(2.0)), 1)
+    return book
+
+
+def _print_forecast(title: str, forecast: Forecast, window: int) -> None:
+    params = forecast.params
+    print(
+        f"{title}: цена {params.proxy_day_price} ₽/день, free credit {params.free_credit} ₽, "
+        f"лимит {params.max_active_proxies} (активные прокси не урезает), "
+        f"регистраций {params.signups_per_day:.1f}/день"
+    )
+    print(
+        f"  выручка {forecast.total_revenue} ₽, отключений {forecast.total_disabled}, "
+        f"предупреждений {forecast.total_warnings} ({forecast.backend}, {forecast.seconds * 1000:.1f} ms)"
+    )
+    for first, last, revenue, disabled, warnings in forecast.windows(window):
+        print(f"  дни {first:>3}–{last:<3} {revenue:>12} ₽ {disabled:>9} откл. {warnings:>9} пред.")
+
+
+async def run(args: argparse.Namespace) -> None:
+    overrides = _parse_overrides(args.set)
+    started = time.perf_counter()
+    if args.synthetic_users:
+        book = _synthetic_book(args.synthetic_users, args.seed)
+        params = ForecastParams(proxy_day_price=10, free_credit=50, max_active_proxies=10, signups_per_day=100.0)
+        proposed_params = replace(params, **overrides) if overrides else None
+    else:
+        db = await get_db(args.db)
+        try:
+            book = await load_book(db)
+            params = await load_params(db)
+            proposed_params = await load_params(db, overrides) if overrides else None
+        finally:
+            await db.close()
+    print(f"загрузка: {len(book)} групп (баланс, прокси), {book.total_users} пользователей, "
+          f"{time.perf_counter() - started:.3f} s")
+    _print_forecast("текущие", simulate(book, params, args.days), args.window)
+    if proposed_params is not None:
+        _print_forecast("предложенные", simulate(book, proposed_params, args.days), args.window)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Прогноз биллинга и сравнение настроек (без пополнений)")
+    parser.add_argument("--db", default=os.getenv("DB_PATH", "data/bot.db"))
+    parser.add_argument("--days", type=int, default=30, help="горизонт, дней")
+    parser.add_argument("--window", type=int, default=7, help="дней в строке разбивки")
+    parser.add_argument(
+        "--set",
+        action="append",
+        metavar="KEY=VALUE",
+        help=f"предложенное значение ({', '.join(FORECAST_SETTINGS)}); можно несколько раз",
+    )
+    parser.add_argument(
+        "--synthetic-users",
+        type=int,
+        default=0,
+        help="вместо БД — случайные пользователи, по записи на каждого (замер скорости)",
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from bot.services.backup import backup_database, integrity_check, list_backups, restore_backup
+
+
+def _backup_dir(args: argparse.Namespace) -> str:
+    return args.backup_dir or os.path.join(os.path.dirname(args.db), "backups")
+
+
+def cmd_backup(args: argparse.Namespace) -> None:
+    result = backup_database(args.db, _backup_dir(args), keep=args.keep, pages=args.pages)
+    print(
+        f"{result.path}: {result.size_bytes / 1024 / 1024:.1f} MB gz "
+        f"({result.db_bytes / 1024 / 1024:.1f} MB db), {result.duration_sec:.2f}s, "
+        f"restarts={result.restarts}, integrity={result.integrity}"
+    )
+
+
+def cmd_list(args: argparse.Namespace) -> None:
+    backups = list_backups(_backup_dir(args))
+    if not backups:
+        print("Бэкапов нет.")
+    for path in backups:
+        stamp = datetime.utcfromtimestamp(os.path.getmtime(path)).strftime("%Y-%m-%d %H:%M:%S")
+        print(f"{os.path.basename(path)}  {os.path.getsize(path) / 1024 / 1024:.1f} MB  {stamp} UTC")
+
+
+def cmd_restore(args: argparse.Namespace) -> None:
+    source = args.backup
+    if source == "latest":
+        backups = list_backups(_backup_dir(args))
+        if not backups:
+            raise SystemExit("Бэкапов нет.")
+        source = backups[-1]
+    if not args.yes:
+        answer = input(f"Заменить {args.db} содержимым {source}? Бот должен быть остановлен. [y/N] ")
+        if answer.strip().lower() not in ("y", "yes", "д", "да"):
+            raise SystemExit("Отменено.")
+    previous = restore_backup(source, args.db)
+    print(f"Восстановлено из {source}.")
+    if previous:
+        print(f"Прежняя БД сохранена как {previous}")
+
+
+def cmd_verify(args: argparse.Namespace) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        raw = os.path.join(tmp, "check.db")
+        with gzip.open(args.backup, "rb") as fin, open(raw, "wb") as fout:
+            shutil.copyfileobj(fin, fout, 1024 * 1024)
+        print(integrity_check(raw))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Онлайн-бэкапы bot.db")
+    parser.add_argument("--db", default=os.getenv("DB_PATH", "data/bot.db"))
+    parser.add_argument("--backup-dir", default=os.getenv("BACKUP_DIR", ""))
+    sub = parser.add_subparsers(dest="command", required=True)
+    backup = sub.add_parser("backup", help="снять бэкап (можно на работающем боте)")
+    backup.add_argument("--keep", type=int, default=int(os.getenv("BACKUP_KEEP", "7")))
+    backup.add_argument("--pages", type=int, default=256, help="страниц за шаг backup API")
+    sub.add_parser("list", help="список поколений")
+    restore = sub.add_parser("restore", help="восстановить БД (бот остановлен)")
+    restore.add_argument("backup", help="путь к .db.gz или latest")
+    restore.add_argument("--yes", action="store_true", help="без подтверждения")
+    verify = sub.add_parser("verify", help="integrity_check бэкапа")
+    verify.add_argument("backup")
+    args = parser.parse_args()
+    handlers = {"backup": cmd_backup, "list": cmd_list, "restore": cmd_restore, "verify": cmd_verify}
+    handlers[args.command](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from bot.db import (
+    DEFERRED_MIGRATIONS,
+    MIGRATIONS,
+    deferred_version,
+    get_db,
+    init_db,
+    run_deferred_migrations,
+    schema_version,
+)
+
+
+async def cmd_status(args: argparse.Namespace) -> None:
+    db = await get_db(args.db)
+    try:
+        current = await schema_version(db)
+        cur = await db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'settings'")
+        deferred = await deferred_version(db) if await cur.fetchone() else 0
+    finally:
+        await db.close()
+    print(f"schema: {current}/{MIGRATIONS[-1].version}")
+    for migration in MIGRATIONS:
+        print(f"  {'✓' if migration.version <= current else ' '} {migration.version:>3} {migration.name}")
+    print(f"deferred: {deferred}/{DEFERRED_MIGRATIONS[-1].version}")
+    for migration in DEFERRED_MIGRATIONS:
+        print(f"  {'✓' if migration.version <= deferred else ' '} {migration.version:>3} {migration.name}")
+
+
+async def cmd_up(args: argparse.Namespace) -> None:
+    db = await get_db(args.db)
+    try:
+        started = time.perf_counter()
+        applied = await init_db(db)
+        print(f"schema: {', '.join(applied) or 'актуальна'} ({time.perf_counter() - started:.3f} s)")
+        if args.deferred:
+            started = time.perf_counter()
+            applied = await run_deferred_migrations(db)
+            print(f"deferred: {', '.join(applied) or 'актуальны'} ({time.perf_counter() - started:.3f} s)")
+    finally:
+        await db.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Миграции схемы bot.db (PRAGMA user_version)")
+    parser.add_argument("--db", default=os.getenv("DB_PATH", "data/bot.db"))
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("status", help="применённые и ожидающие миграции")
+    up = sub.add_parser("up", help="применить миграции схемы")
+    up.add_argument("--deferred", action="store_true", help="сразу выполнить и отложенные (индексы, бэкфиллы)")
+    args = parser.parse_args()
+    handlers = {"status": cmd_status, "up": cmd_up}
+    asyncio.run(handlers[args.command](args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import asyncio
+import csv
+import os
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from bot.db import get_db, init_db
+from bot.services.retention import (
+    POLICIES,
+    attached_archives,
+    incremental_vacuum,
+    list_archives,
+    run_retention,
+)
+
+
+def _archive_dir(args: argparse.Namespace) -> str:
+    return args.archive_dir or os.path.join(os.path.dirname(args.db), "archive")
+
+
+async def cmd_run(args: argparse.Namespace) -> None:
+    db = await get_db(args.db)
+    try:
+        await init_db(db)
+        result = await run_retention(db, _archive_dir(args), batch=args.batch)
+    finally:
+        await db.close()
+    for table, removed in result.removed.items():
+        print(f"{table:<20} {removed}")
+    print(f"archive: {result.archive_path or '—'}, vacuumed pages: {result.vacuumed_pages}")
+
+
+async def cmd_list(args: argparse.Namespace) -> None:
+    paths = list_archives(_archive_dir(args))
+    if not paths:
+        print("Архивов нет.")
+        return
+    db = await get_db(args.db)
+    try:
+        # One file at a time: SQLite attaches at most 10 databases per connection.
+        for path in paths:
+            async with attached_archives(db, [path]) as (alias,):
+                counts = []
+                for policy in POLICIES:
+                    cur = await db.execute(
+                        f"SELECT 1 FROM {alias}.sqlite_master WHERE type = 'table' AND name = ?", (policy.table,)
+                    )
+                    if await cur.fetchone() is None:
+                        continue
+                    cur = await db.execute(f"SELECT COUNT(*) FROM {alias}.{policy.table}")
+                    counts.append(f"{policy.table}={(await cur.fetchone())[0]}")
+                size_mb = os.path.getsize(path) / 1024 / 1024
+                print(f"{os.path.basename(path)}  {size_mb:.1f} MB  {' '.join(counts) or '—'}")
+    finally:
+        await db.close()
+
+
+async def cmd_export(args: argparse.Namespace) -> None:
+    paths = list_archives(_archive_dir(args))
+    if args.month:
+        paths = [path for path in paths if os.path.basename(path) == f"bot-archive-{args.month}.db"]
+    if not paths:
+        raise SystemExit("Нет подходящих архивов.")
+    db = await get_db(args.db)
+    out = open(args.out, "w", newline="", encoding="utf-8") if args.out else sys.stdout
+    try:
+        writer = csv.writer(out)
+        header = None
+        for path in paths:
+            async with attached_archives(db, [path]) as (alias,):
+                cur = await db.execute(
+                    f"SELECT 1 FROM {alias}.sqlite_master WHERE type = 'table' AND name = ?", (args.table,)
+                )
+                if await cur.fetchone() is None:
+                    continue
+                cur = await db.execute(f"SELECT * FROM {alias}.{args.table} ORDER BY id")
+                columns = [item[0] for item in cur.description]
+                if header is None:
+                    header = columns
+                    writer.writerow(header)
+                # Older archives may lack columns added later; keep the first file's layout.
+                index = {name: pos for pos, name in enumerate(columns)}
+                for row in await cur.fetchall():
+                    writer.writerow([row[index[name]] if name in index else "" for name in header])
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        await db.close()
+
+
+async def cmd_vacuum(args: argparse.Namespace) -> None:
+    db = await get_db(args.db)
+    try:
+        cur = await db.execute("PRAGMA auto_vacuum")
+        if (await cur.fetchone())[0] != 2:
+            # Switching an existing file to incremental mode needs a full rebuild; run it with the bot stopped.
+            print("Перевод БД в auto_vacuum=INCREMENTAL (полный VACUUM)...")
+            await db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            await db.execute("VACUUM")
+            print("Готово.")
+            return
+        pages = await incremental_vacuum(db)
+        print(f"Освобождено страниц: {pages}")
+    finally:
+        await db.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Хранение и архив старых строк bot.db")
+    parser.add_argument("--db", default=os.getenv("DB_PATH", "data/bot.db"))
+    parser.add_argument("--archive-dir", default=os.getenv("ARCHIVE_DIR", ""))
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("run", help="один проход ретеншна")
+    run.add_argument("--batch", type=int, default=2000)
+    sub.add_parser("list", help="архивные файлы и число строк")
+    export = sub.add_parser("export", help="CSV из архивов (подключаются только на чтение)")
+    export.add_argument("table", choices=[policy.table for policy in POLICIES if policy.archive])
+    export.add_argument("--month", help="YYYY-MM, по умолчанию все архивы")
+    export.add_argument("--out")
+    sub.add_parser("vacuum", help="включить incremental auto_vacuum или вернуть свободные страницы")
+    args = parser.parse_args()
+    handlers = {"run": cmd_run, "list": cmd_list, "export": cmd_export, "vacuum": cmd_vacuum}
+    asyncio.run(handlers[args.command](args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from bot.db import (
+    BACKFILL_NEXT_BILL_SQL,
+    BACKFILL_PAYMENT_PROVIDER_SQL,
+    EPOCH_BACKFILL_DONE_SQL,
+    EPOCH_BACKFILL_SQL,
+    EPOCH_INDEX_SQL,
+    OPENING_LEDGER_SQL,
+)
+from scripts.bench_common import USER_TG_BASE, iso
+
+CHUNK = 20_000
+AMOUNTS = (50, 100, 150, 200, 300, 500, 1000)
+
+
+def _chunks(rows: Iterable[tuple], size: int = CHUNK) -> Iterator[List[tuple]]:
+    batch: List[tuple] = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _insert(conn: sqlite3.Connection, sql: str, rows: Iterable[tuple]) -> int:
+    total = 0
+    for batch in _chunks(rows):
+        conn.executemany(sql, batch)
+        total += len(batch)
+    return total
+
+
+async def _create_schema(db_path: str) -> None:
+    from bot.db import close_pool, ensure_default_settings, get_db, init_db
+
+    db = await get_db(db_path)
+    try:
+        await init_db(db)
+        await ensure_default_settings(db)
+    finally:
+        await db.close()
+        # Pooled connections stay open after close(); the file is reopened with sqlite3 right after this.
+        await close_pool()
+
+
+class _Gen:
+    def __init__(self, users: int, seed: int) -> None:
+        self.users = users
+        self.rng = random.Random(seed)
+        self.now = datetime.utcnow()
+
+    def ago(self, days: float) -> str:
+        return iso(self.now - timedelta(days=days))
+
+    def recent_days(self, horizon: float) -> float:
+        # Squared uniform: most activity is recent, with a long tail back to `horizon`.
+        return horizon * self.rng.random() ** 2
+
+    def heavy_tail(self, alpha: float, cap: int) -> int:
+        return min(cap, int(self.rng.paretovariate(alpha)))
+
+
+def generate(db_path: str, users: int, seed: int = 1) -> Dict[str, int]:
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    asyncio.run(_create_schema(db_path))
+
+    g = _Gen(users, seed)
+    rng = g.rng
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    counts: Dict[str, int] = {}
+    started = time.perf_counter()
+
+    user_created: List[float] = []
+    user_meta: List[Tuple[bool, bool]] = []
+
+    def users_rows():
+        for i in range(users):
+            created_days = g.recent_days(365)
+            user_created.append(created_days)
+            deleted = rng.random() < 0.02
+            blocked = not deleted and rng.random() < 0.005
+            user_meta.append((deleted, blocked))
+            seen_days = created_days * rng.random() ** 3
+            balance = 0 if rng.random() < 0.3 else max(0, int(rng.paretovariate(1.3) * 20) - 10)
+            yield (
+                USER_TG_BASE + i,
+                f"user{i}" if rng.random() < 0.8 else None,
+                f"r{i:09d}",
+                balance,
+                g.ago(created_days),
+                g.ago(seen_days),
+                rng.randrange(1, 1_000_000),
+                g.ago(created_days + 1) if blocked else None,
+                g.ago(seen_days) if deleted else None,
+            )
+
+    counts["users"] = _insert(
+        conn,
+        "INSERT INTO users (tg_id, username, ref_code, balance, created_at, last_seen_at, "
+        "last_menu_message_id, blocked_at, deleted_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        users_rows(),
+    )
+    conn.execute(OPENING_LEDGER_SQL)
+    counts["balance_ledger"] = conn.execute("SELECT COUNT(*) FROM balance_ledger").fetchone()[0]
+
+    proxy_seq = 0
+
+    def proxies_rows():
+        nonlocal proxy_seq
+        for user_idx in range(users):
+            user_id = user_idx + 1
+            created_days = user_created[user_idx]
+            deleted_user = user_meta[user_idx][0]
+            paid = 0 if rng.random() < 0.7 else g.heavy_tail(1.2, 50)
+            for n in range(1 + paid):
+                proxy_seq += 1
+                roll = rng.random()
+                if deleted_user or roll < 0.05:
+                    status, deleted_at = "deleted", g.ago(created_days * rng.random())
+                elif roll < 0.27:
+                    status, deleted_at = "disabled", None
+                else:
+                    status, deleted_at = "active", None
+                yield (
+                    user_id,
+                    f"p{proxy_seq:010d}",
+                    f"{rng.getrandbits(48):012x}",
+                    "127.0.0.1",
+                    1080,
+                    status,
+                    1 if n == 0 else 0,
+                    f"{rng.getrandbits(128):032x}",
+                    g.ago(created_days * rng.random()),
+                    g.ago(rng.random() * 1.2),
+                    deleted_at,
+                )
+
+    counts["proxies"] = _insert(
+        conn,
+        "INSERT INTO proxies (user_id, login, password, ip, port, status, is_free, mtproto_secret, "
+        "created_at, last_billed_at, deleted_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        proxies_rows(),
+    )
+    conn.execute(BACKFILL_NEXT_BILL_SQL)
+
+    def payments_rows():
+        for user_idx in range(users):
+            if rng.random() < 0.5:
+                continue
+            user_id = user_idx + 1
+            for _ in range(g.heavy_tail(1.1, 200)):
+                amount = rng.choice(AMOUNTS)
+                roll = rng.random()
+                if roll < 0.8:
+                    status = "paid"
+                elif roll < 0.85:
+                    status = "pending"
+                elif roll < 0.95:
+                    status = "failed"
+                else:
+                    status = "canceled"
+                created = g.ago(user_created[user_idx] * rng.random())
+                if rng.random() < 0.6:
+                    payload = f"freekassa:{user_id}:{amount}"
+                    provider = None if status == "pending" else f"freekassa:{user_id}"
+                else:
+                    payload = f"topup:{user_id}:{amount}:{amount}"
+                    provider = f"stars:{rng.getrandbits(40):x}" if status == "paid" else None
+                yield (user_id, amount, status, provider, payload, created)
+
+    counts["payments"] = _insert(
+        conn,
+        "INSERT INTO payments (user_id, amount, status, provider_payment_id, payload, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        payments_rows(),
+    )
+    conn.execute(BACKFILL_PAYMENT_PROVIDER_SQL)
+
+    link_count = max(5, users // 2000)
+    codes = [f"promo{i}" for i in range(link_count)]
+    counts["referral_links"] = _insert(
+        conn,
+        "INSERT INTO referral_links (code, name, owner_user_id, bonus_inviter, bonus_invited, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (
+            (code, code, rng.randrange(1, users + 1) if rng.random() < 0.5 else None, 10, 10, g.ago(300))
+            for code in codes
+        ),
+    )
+    # Zipf-like popularity: a few links get most of the clicks.
+    weights = [1 / (rank + 1) for rank in range(link_count)]
+    seen_clicks = set()
+
+    def clicks_rows():
+        for _ in range(users // 5):
+            code = rng.choices(codes, weights=weights, k=1)[0]
+            tg_id = USER_TG_BASE + rng.randrange(users * 2)
+            if (code, tg_id) in seen_clicks:
+                continue
+            seen_clicks.add((code, tg_id))
+            yield (code, tg_id, g.ago(g.recent_days(300)))
+
+    counts["referral_clicks"] = _insert(
+        conn,
+        "INSERT INTO referral_clicks (link_code, tg_id, created_at) VALUES (?, ?, ?)",
+        clicks_rows(),
+    )
+    seen_clicks.clear()
+
+    def events_rows():
+        for user_idx in range(1, users):
+            if rng.random() >= 0.1:
+                continue
+            inviter = 1 + int(user_idx * rng.random() ** 3)
+            yield (
+                inviter,
+                user_idx + 1,
+                rng.choices(codes, weights=weights, k=1)[0],
+                10,
+                10,
+                g.ago(user_created[user_idx]),
+            )
+
+    counts["referral_events"] = _insert(
+        conn,
+        "INSERT INTO referral_events (inviter_user_id, invited_user_id, link_code, bonus_inviter, "
+        "bonus_invited, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+        events_rows(),
+    )
+
+    ticket_users = [idx + 1 for idx in range(users) if rng.random() < 0.03]
+    tickets = []
+    for ticket_id, user_id in enumerate(ticket_users, start=1):
+        roll = rng.random()
+        status = "closed" if roll < 0.7 else ("waiting_user" if roll < 0.85 else "waiting_admin")
+        created_days = g.recent_days(180)
+        updated_days = created_days * rng.random()
+        tickets.append(
+            (
+                user_id,
+                status,
+                1 if rng.random() < 0.3 else None,
+                g.ago(created_days),
+                g.ago(updated_days),
+            )
+        )
+    counts["support_tickets"] = _insert(
+        conn,
+        "INSERT INTO support_tickets (user_id, status, assigned_admin_tg_id, created_at, updated_at) "
+        "VALUES (?, ?, ?, ?, ?)",
+        tickets,
+    )
+
+    def messages_rows():
+        for ticket_id, ticket in enumerate(tickets, start=1):
+            for n in range(1 + g.heavy_tail(1.5, 30)):
+                admin = n % 2 == 1
+                yield (
+                    ticket_id,
+                    "admin" if admin else "user",
+                    1 if admin else USER_TG_BASE + ticket[0] - 1,
+                    "Сообщение поддержки " + "x" * rng.randrange(10, 300),
+                    ticket[3],
+                )
+
+    counts["support_messages"] = _insert(
+        conn,
+        "INSERT INTO support_messages (ticket_id, sender_role, sender_id, message, created_at) "
+        "VALUES (?, ?, ?, ?, ?)",
+        messages_rows(),
+    )
+    counts["admin_audit_log"] = _insert(
+        conn,
+        "INSERT INTO admin_audit_log (admin_tg_id, action, target_type, target_id, details, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (
+            (1, rng.choice(("balance_delta", "block", "setting_set")), "user", str(rng.randrange(1, users + 1)),
+             "bench", g.ago(g.recent_days(365)))
+            for _ in range(max(10, users // 100))
+        ),
+    )
+    for sql in EPOCH_INDEX_SQL + EPOCH_BACKFILL_SQL:
+        conn.execute(sql)
+    conn.execute(EPOCH_BACKFILL_DONE_SQL)
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.close()
+    counts["seconds"] = round(time.perf_counter() - started, 1)
+    return counts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Генерация синтетической bot.db для бенчмарков")
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--out", default="data/bench.db")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    counts = generate(args.out, args.users, args.seed)
+    for key, value in counts.items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()